@@ -0,0 +1,131 @@
+"""
+bench_backends.py
+Compare detector backends on the same clip.
+
+Samples frames from a video at the pipeline rate, runs every requested
+backend over the same frames and reports frames/sec plus detection parity
+against the first backend (the reference): per-frame detections are matched
+by class and IoU, and the script prints recall, precision and the mean IoU
+of matched boxes.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_backends clip.mp4 --weights models/best.pt \
+        --onnx models/best.onnx --frames 200 --batch-size 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.detectors import Detections, Detector, OnnxDetector, UltralyticsDetector
+from utils.frame_source import SampledFrameReader
+from utils.model_registry import get_model
+from utils.pipeline import iou_matrix
+
+
+def load_frames(video_path: str, n_frames: int, interval_sec: float) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise SystemExit(f'cannot open {video_path}')
+    frames = []
+    for _, frame in SampledFrameReader(cap, interval_sec=interval_sec):
+        frames.append(frame)
+        if len(frames) >= n_frames:
+            break
+    cap.release()
+    return frames
+
+
+def run_backend(detector: Detector, frames: List[np.ndarray], batch_size: int) -> Tuple[float, List[Optional[Detections]]]:
+    """Return frames/sec and the detections of every frame."""
+    detector.detect(frames[:1])  # warm-up
+    out: List[Optional[Detections]] = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        out.extend(detector.detect(frames[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return len(frames) / max(elapsed, 1e-9), out
+
+
+def _to_xywh_topleft(xywh: np.ndarray) -> np.ndarray:
+    boxes = xywh.astype(np.float64).copy()
+    boxes[:, :2] -= boxes[:, 2:] / 2
+    return boxes
+
+
+def parity(ref: List[Optional[Detections]], other: List[Optional[Detections]], iou_thresh: float) -> dict:
+    """Match detections frame by frame (same class, IoU >= threshold)."""
+    matched = n_ref = n_other = 0
+    ious: List[float] = []
+    for a, b in zip(ref, other):
+        a = a if a is not None else (np.zeros((0, 4)), np.zeros(0))
+        b = b if b is not None else (np.zeros((0, 4)), np.zeros(0))
+        n_ref += len(a[1])
+        n_other += len(b[1])
+        if not len(a[1]) or not len(b[1]):
+            continue
+        iou = iou_matrix(_to_xywh_topleft(a[0]), _to_xywh_topleft(b[0]))
+        iou[a[1][:, None].astype(int) != b[1][None, :].astype(int)] = 0.0
+        # greedy one-to-one matching, best pairs first
+        while iou.size and iou.max() >= iou_thresh:
+            r, c = np.unravel_index(int(iou.argmax()), iou.shape)
+            ious.append(float(iou[r, c]))
+            matched += 1
+            iou[r, :] = 0.0
+            iou[:, c] = 0.0
+    return {
+        'recall': matched / n_ref if n_ref else 1.0,
+        'precision': matched / n_other if n_other else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else 0.0,
+        'ref_boxes': n_ref,
+        'boxes': n_other,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video')
+    parser.add_argument('--weights', help='ultralytics .pt weights (reference backend)')
+    parser.add_argument('--onnx', help='ONNX export of the same model')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between sampled frames')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU needed to count two boxes as the same')
+    args = parser.parse_args()
+
+    backends: List[Detector] = []
+    if args.weights:
+        model = get_model(args.weights, num_threads=args.threads, warmup=False)
+        if model is None:
+            raise SystemExit(f'cannot load {args.weights}')
+        backends.append(UltralyticsDetector(model))
+    if args.onnx:
+        backends.append(OnnxDetector(args.onnx, imgsz=args.imgsz, num_threads=args.threads))
+    if not backends:
+        raise SystemExit('give at least one of --weights / --onnx')
+
+    frames = load_frames(args.video, args.frames, args.interval)
+    print(f'{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, batch size {args.batch_size}')
+    reference: Optional[List[Optional[Detections]]] = None
+    for detector in backends:
+        fps, dets = run_backend(detector, frames, args.batch_size)
+        line = f'{detector.name:>12}: {fps:8.2f} frames/s'
+        if reference is None:
+            reference = dets
+        else:
+            p = parity(reference, dets, args.iou)
+            line += (f"  recall {p['recall']:.3f}  precision {p['precision']:.3f}"
+                     f"  mean IoU {p['mean_iou']:.3f}  ({p['boxes']} vs {p['ref_boxes']} boxes)")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+bench_keyframes.py
+Per-sample cost of random frame access with and without a keyframe index.
+
+Replays the access patterns of :mod:`utils.main_processor` on one video:
+
+* ``coarse``: one frame every ``--step`` seconds (the timestamp scan), the
+  indexed run snapping to the cheapest frame within ``--snap`` seconds;
+* ``bisect``: bisection of ``--step``-long intervals down to one second
+  (session boundary refinement);
+* ``random``: exact frames at random times.
+
+Each pattern is run with blind ``cap.set(CAP_PROP_POS_MSEC)`` seeks and with
+:class:`utils.keyframe_index.KeyframeSeeker`, and the script prints the
+milliseconds per sample and the speedup, plus the cost of building the
+index.  NVR footage has long GOPs; without a video argument a synthetic
+clip is rendered and re-encoded with a keyframe every ``--gop`` frames
+(needs PyAV or the ``ffmpeg`` executable).  Run from the repository root::
+
+    python -m benchmarks.bench_keyframes recording.mp4 --step 10 --samples 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+
+try:
+    import av  # type: ignore
+except ImportError:
+    av = None
+
+from benchmarks.synthetic import cached_video
+from utils.keyframe_index import KeyframeSeeker, probe_keyframes
+
+Sample = Tuple[float, float]  # (time_sec, snap_sec)
+
+
+def long_gop_copy(src: str, dst: str, gop: int) -> str:
+    """Re-encode ``src`` as H.264 with a keyframe every ``gop`` frames."""
+    if os.path.exists(dst):
+        return dst
+    tmp = dst + '.part.mp4'
+    if av is not None:
+        with av.open(src) as inp, av.open(tmp, 'w') as out:
+            in_stream = inp.streams.video[0]
+            stream = out.add_stream('libx264', rate=in_stream.average_rate)
+            stream.width, stream.height = in_stream.width, in_stream.height
+            stream.pix_fmt = 'yuv420p'
+            stream.options = {'g': str(gop), 'keyint_min': str(gop), 'sc_threshold': '0', 'preset': 'veryfast'}
+            for frame in inp.decode(in_stream):
+                # fresh frames get timestamps from the output stream
+                frame = av.VideoFrame.from_ndarray(frame.to_ndarray(format='rgb24'), format='rgb24')
+                for packet in stream.encode(frame):
+                    out.mux(packet)
+            for packet in stream.encode():
+                out.mux(packet)
+        os.replace(tmp, dst)
+        return dst
+    exe = shutil.which('ffmpeg')
+    if exe is None:
+        raise SystemExit('re-encoding the synthetic clip needs PyAV or ffmpeg; pass a video instead')
+    subprocess.run(
+        [exe, '-v', 'error', '-y', '-i', src, '-c:v', 'libx264', '-g', str(gop), '-keyint_min', str(gop),
+         '-sc_threshold', '0', '-preset', 'veryfast', tmp],
+        check=True,
+    )
+    os.replace(tmp, dst)
+    return dst
+
+
+def coarse_pattern(duration_sec: float, step: float, snap: float) -> List[Sample]:
+    return [(i * step, snap) for i in range(int(duration_sec // step) + 1)]
+
+
+def bisect_pattern(duration_sec: float, step: float, n: int, rng: random.Random) -> List[Sample]:
+    out: List[Sample] = []
+    for _ in range(n):
+        lo = rng.uniform(0, max(duration_sec - step, 0))
+        hi = lo + step
+        while hi - lo > 1.0:
+            mid = (lo + hi) / 2
+            out.append((mid, (hi - lo) / 4))
+            if rng.random() < 0.5:
+                lo = mid
+            else:
+                hi = mid
+    return out
+
+
+def random_pattern(duration_sec: float, n: int, rng: random.Random) -> List[Sample]:
+    return [(rng.uniform(0, duration_sec), 0.0) for _ in range(n)]
+
+
+def blind_read(cap: "cv2.VideoCapture") -> Callable[[float, float], bool]:
+    def read(time_sec: float, snap_sec: float) -> bool:
+        cap.set(cv2.CAP_PROP_POS_MSEC, time_sec * 1000.0)
+        return cap.read()[0]
+    return read
+
+
+def run(video: str, samples: List[Sample], index: Optional[object]) -> float:
+    """Milliseconds per sample; ``index`` selects the indexed reader."""
+    cap = cv2.VideoCapture(video)
+    read = KeyframeSeeker(cap, index).read_at if index is not None else blind_read(cap)  # type: ignore[arg-type]
+    start = time.perf_counter()
+    for time_sec, snap_sec in samples:
+        read(time_sec, snap_sec)
+    elapsed = time.perf_counter() - start
+    cap.release()
+    return elapsed / max(len(samples), 1) * 1000.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='?', help='video to measure (default: synthetic long-GOP clip)')
+    parser.add_argument('--step', type=float, default=10.0, help='coarse scan step in seconds')
+    parser.add_argument('--snap', type=float, default=2.5, help='coarse scan snap tolerance in seconds')
+    parser.add_argument('--samples', type=int, default=200, help='random samples (and bisections / 4)')
+    parser.add_argument('--duration', type=float, default=600.0, help='length of the synthetic clip')
+    parser.add_argument('--gop', type=int, default=250, help='keyframe interval of the synthetic clip')
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'bench_videos'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    video = args.video
+    if video is None:
+        src = cached_video(args.video_dir, args.duration, (640, 360), 3)
+        video = long_gop_copy(src, src.replace('.mp4', f'_gop{args.gop}.mp4'), args.gop)
+
+    start = time.perf_counter()
+    index = probe_keyframes(video)
+    probe_sec = time.perf_counter() - start
+    if index is None:
+        raise SystemExit(f'cannot index {video}')
+    gop = index.frame_count / max(len(index.keyframes), 1)
+    print(f'{video}: {index.duration_sec:.0f} s, {index.frame_count} frames, {len(index.keyframes)} keyframes '
+          f'(mean GOP {gop:.0f} frames), indexed with {index.source} in {probe_sec:.2f} s')
+
+    rng = random.Random(args.seed)
+    patterns = {
+        'coarse': coarse_pattern(index.duration_sec, args.step, args.snap),
+        'bisect': bisect_pattern(index.duration_sec, args.step, max(args.samples // 4, 1), rng),
+        'random': random_pattern(index.duration_sec, args.samples, rng),
+    }
+    print(f"{'pattern':>8} {'samples':>8} {'blind ms':>9} {'index ms':>9} {'speedup':>8}")
+    for name, samples in patterns.items():
+        blind = run(video, samples, None)
+        indexed = run(video, samples, index)
+        print(f'{name:>8} {len(samples):>8} {blind:>9.2f} {indexed:>9.2f} {blind / max(indexed, 1e-9):>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+bench_pipeline.py
+End-to-end throughput benchmark of :func:`utils.pipeline.run_pipeline`.
+
+Runs the full pipeline (decode, detection, tracking, event output) on
+synthetic videos from :mod:`benchmarks.synthetic` with the deterministic
+:class:`benchmarks.synthetic.FakeModel`, so it needs neither weights nor a
+GPU and measures the pipeline itself.  Every combination of video length,
+resolution and object count is run in a fresh child process, and the
+script reports:
+
+* video seconds processed per wall-clock second and inferred frames/sec,
+* time per stage, measured in the benchmarked run itself by the pipeline
+  profiler (``run_pipeline(profile=True)``): decoding, detection (the
+  inference stage) and tracking plus event output (parsing, tracking, zones
+  and output).  With ``--decode-queue-size`` above zero decoding overlaps
+  inference and its column is the time spent waiting for frames,
+* peak resident memory of the child process.
+
+Results are printed as a table and written as JSON; ``--baseline`` compares
+against an earlier JSON file.  Run from the repository root::
+
+    python -m benchmarks.bench_pipeline --durations 60 300 --resolutions 640x360 1280x720 \
+        --objects 3 20 --out bench_pipeline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from benchmarks.synthetic import FakeModel, cached_video
+from utils.events import iter_events
+from utils.pipeline import run_pipeline
+
+# profiler stages summed into the tracking-and-output column
+TRACK_STAGES = ('parse', 'tracking', 'zones', 'output')
+
+
+def _rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024.0 ** (2 if sys.platform == 'darwin' else 1)
+
+
+def run_case(case: dict) -> dict:
+    """Run one benchmark case; meant to be called in a fresh child process."""
+    rss_start = _rss_mb()
+    video = case['video']
+    model = FakeModel(infer_ms=case['infer_ms'])
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        people_path, train_path = run_pipeline(
+            video, model, '2024-01-01 00:00:00', '', 'bench', out_dir=out_dir,
+            batch_size=case['batch_size'], decode_queue_size=case['decode_queue_size'],
+            output_format='jsonl', motion_gate=case['motion_gate'], profile=True,
+        )
+        wall = time.perf_counter() - start
+        people_events = sum(1 for _ in iter_events(people_path))
+        train_events = sum(1 for _ in iter_events(train_path))
+        with open(os.path.join(out_dir, 'profile_bench.json'), 'r', encoding='utf-8') as f:
+            stage_sec = {name: st['total_sec'] for name, st in json.load(f)['stages'].items()}
+    rss_end = _rss_mb()
+    return dict(
+        case,
+        wall_sec=round(wall, 4),
+        video_sec_per_sec=round(case['duration_sec'] / wall, 2),
+        inferred_fps=round(model.frames / wall, 2),
+        frames_inferred=model.frames,
+        stages={
+            'decode_sec': round(stage_sec.get('decode', 0.0), 4),
+            'detect_sec': round(stage_sec.get('inference', 0.0), 4),
+            'motion_gate_sec': round(stage_sec.get('motion_gate', 0.0), 4),
+            'track_and_output_sec': round(sum(stage_sec.get(name, 0.0) for name in TRACK_STAGES), 4),
+        },
+        profile_stages={name: round(sec, 4) for name, sec in stage_sec.items()},
+        peak_rss_mb=round(rss_end, 1) if rss_end is not None else None,
+        rss_growth_mb=round(rss_end - rss_start, 1) if rss_end is not None and rss_start is not None else None,
+        people_events=people_events,
+        train_events=train_events,
+    )
+
+
+def _parse_size(text: str) -> Tuple[int, int]:
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _case_key(r: dict) -> tuple:
+    return r['duration_sec'], r['width'], r['height'], r['objects'], r['batch_size'], r['motion_gate']
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[60.0], help='video lengths in seconds')
+    parser.add_argument('--resolutions', nargs='+', default=['640x360', '1280x720'], help='WIDTHxHEIGHT')
+    parser.add_argument('--objects', type=int, nargs='+', default=[3, 20], help='number of people in view')
+    parser.add_argument('--trains', type=int, default=1)
+    parser.add_argument('--fps', type=float, default=25.0)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--decode-queue-size', type=int, default=0)
+    parser.add_argument('--motion-gate', action='store_true')
+    parser.add_argument('--infer-ms', type=float, default=0.0, help='emulated model latency per frame')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case; the fastest is kept')
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'bench_videos'))
+    parser.add_argument('--out', default='bench_pipeline.json')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    cases: List[dict] = []
+    for duration in args.durations:
+        for res in args.resolutions:
+            w, h = _parse_size(res)
+            for objects in args.objects:
+                video = cached_video(args.video_dir, duration, (w, h), objects, args.trains, args.fps)
+                cases.append({
+                    'video': video, 'duration_sec': duration, 'width': w, 'height': h, 'objects': objects,
+                    'trains': args.trains, 'fps': args.fps, 'batch_size': args.batch_size,
+                    'decode_queue_size': args.decode_queue_size, 'motion_gate': args.motion_gate,
+                    'infer_ms': args.infer_ms,
+                })
+
+    results: List[dict] = []
+    print(f"{'length':>7} {'size':>10} {'obj':>4} {'wall s':>8} {'video s/s':>10} {'decode':>8} "
+          f"{'detect':>8} {'track':>8} {'rss MB':>8}")
+    for case in cases:
+        best: Optional[dict] = None
+        for _ in range(max(1, args.repeat)):
+            # a fresh process per run gives a clean peak-memory reading
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                r = pool.submit(run_case, case).result()
+            if best is None or r['wall_sec'] < best['wall_sec']:
+                best = r
+        assert best is not None
+        results.append(best)
+        st = best['stages']
+        print(f"{best['duration_sec']:>7.0f} {best['width']:>5}x{best['height']:<4} {best['objects']:>4} "
+              f"{best['wall_sec']:>8.2f} {best['video_sec_per_sec']:>10.1f} {st['decode_sec']:>8.2f} "
+              f"{st['detect_sec']:>8.2f} {st['track_and_output_sec']:>8.2f} {best['peak_rss_mb'] or 0:>8.1f}")
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = {_case_key(r): r for r in json.load(f)['results']}
+        print(f"{'length':>7} {'size':>10} {'obj':>4} {'base s':>8} {'now s':>8} {'change':>8}")
+        for r in results:
+            old = baseline.get(_case_key(r))
+            if old is None:
+                continue
+            change = (r['wall_sec'] - old['wall_sec']) / old['wall_sec'] * 100
+            print(f"{r['duration_sec']:>7.0f} {r['width']:>5}x{r['height']:<4} {r['objects']:>4} "
+                  f"{old['wall_sec']:>8.2f} {r['wall_sec']:>8.2f} {change:>+7.1f}%")
+
+
+if __name__ == '__main__':
+    main()
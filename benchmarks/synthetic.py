@@ -0,0 +1,167 @@
+"""
+synthetic.py
+Synthetic footage and a fake detector for benchmarks.
+
+:func:`make_video` renders a platform-like scene: a static textured
+background, green boxes for people walking, standing and leaving, and blue
+boxes for trains that arrive, stop and depart.  :class:`FakeModel` finds
+those boxes by colour and returns them through the same
+``results[i].boxes.xywh``/``.cls`` interface as an ultralytics model, so
+the whole pipeline runs without weights, torch or a GPU and always produces
+the same detections for the same video.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from utils.pipeline import PERSON_CLASS, TRAIN_CLASS
+
+PERSON_COLOUR = (0, 255, 0)
+TRAIN_COLOUR = (255, 0, 0)
+MIN_AREA = 50  # connected components smaller than this are ignored
+
+
+class _Boxes:
+    def __init__(self, xywh: np.ndarray, cls: np.ndarray) -> None:
+        self.xywh = xywh
+        self.cls = cls
+
+
+class _Result:
+    def __init__(self, boxes: _Boxes) -> None:
+        self.boxes = boxes
+
+
+class FakeModel:
+    """Deterministic stand-in for an ultralytics ``YOLO`` model.
+
+    Args:
+        infer_ms: Extra time spent per frame, to emulate the latency of a
+            real model.
+
+    Attributes:
+        frames: Number of frames processed.
+        seconds: Total time spent inside calls.
+    """
+
+    def __init__(self, infer_ms: float = 0.0) -> None:
+        self.infer_ms = infer_ms
+        self.frames = 0
+        self.seconds = 0.0
+
+    def _detect(self, frame: np.ndarray) -> _Result:
+        xywh: List[List[float]] = []
+        cls: List[int] = []
+        for label, colour in ((PERSON_CLASS, PERSON_COLOUR), (TRAIN_CLASS, TRAIN_COLOUR)):
+            lo = np.clip(np.asarray(colour) - 40, 0, 255)
+            hi = np.clip(np.asarray(colour) + 40, 0, 255)
+            mask = cv2.inRange(frame, lo, hi)
+            n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            for x, y, w, h, area in stats[1:n].tolist():
+                if area >= MIN_AREA:
+                    xywh.append([x + w / 2, y + h / 2, w, h])
+                    cls.append(label)
+        return _Result(_Boxes(np.asarray(xywh, dtype=np.float32).reshape(-1, 4), np.asarray(cls, dtype=np.float32)))
+
+    def __call__(self, source: object, verbose: bool = False, **kwargs: object) -> List[_Result]:
+        start = time.perf_counter()
+        frames = source if isinstance(source, list) else [source]
+        out = [self._detect(frame) for frame in frames]
+        if self.infer_ms:
+            time.sleep(self.infer_ms * len(frames) / 1000.0)
+        self.frames += len(frames)
+        self.seconds += time.perf_counter() - start
+        return out
+
+
+def make_video(
+    path: str,
+    duration_sec: float = 60.0,
+    fps: float = 25.0,
+    size: Tuple[int, int] = (640, 360),
+    people: int = 3,
+    trains: int = 1,
+    seed: int = 0,
+) -> str:
+    """
+    Render a synthetic platform video.
+
+    People walk horizontally at random speeds, pause, and leave and come
+    back; trains enter from the left, stop for a while and leave to the
+    right.  Returns ``path``.
+    """
+    rng = random.Random(seed)
+    w, h = size
+    scale = h / 360.0
+    background = np.random.default_rng(seed).integers(40, 70, (h, w, 3), dtype=np.uint8)
+    pw, ph = max(4, int(20 * scale)), max(8, int(50 * scale))
+    walkers = [
+        {
+            'x': rng.uniform(0, w - pw), 'y': rng.uniform(0.15 * h, 0.55 * h),
+            'v': rng.choice([-1, 1]) * rng.uniform(5, 40) * scale,
+            'period': rng.uniform(10, 30), 'phase': rng.uniform(0, 30),
+        }
+        for _ in range(people)
+    ]
+    tw, th = int(0.3 * w), int(0.22 * h)
+    cycle = duration_sec / max(trains, 1)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+    try:
+        for i in range(int(duration_sec * fps)):
+            t = i / fps
+            frame = background.copy()
+            for p in walkers:
+                local = (t + p['phase']) % p['period']
+                if local > 0.8 * p['period']:
+                    continue  # out of view
+                moving = local < 0.5 * p['period']
+                if moving:
+                    p['x'] += p['v'] / fps
+                    if not 0 <= p['x'] <= w - pw:
+                        p['v'] = -p['v']
+                        p['x'] = min(max(p['x'], 0), w - pw)
+                x, y = int(p['x']), int(p['y'])
+                cv2.rectangle(frame, (x, y), (x + pw, y + ph), PERSON_COLOUR, -1)
+            for k in range(trains):
+                local = t - k * cycle
+                # enter in 20% of the cycle, stand for 40%, leave in 20%
+                if not 0 <= local < 0.8 * cycle:
+                    continue
+                stop_x = (w - tw) / 2
+                if local < 0.2 * cycle:
+                    x = -tw + (stop_x + tw) * local / (0.2 * cycle)
+                elif local < 0.6 * cycle:
+                    x = stop_x
+                else:
+                    x = stop_x + (w - stop_x) * (local - 0.6 * cycle) / (0.2 * cycle)
+                y = int(0.7 * h)
+                cv2.rectangle(frame, (int(x), y), (int(x) + tw, y + th), TRAIN_COLOUR, -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def cached_video(
+    video_dir: str,
+    duration_sec: float,
+    size: Tuple[int, int],
+    people: int,
+    trains: int = 1,
+    fps: float = 25.0,
+    seed: int = 0,
+) -> str:
+    """Return the path of a synthetic video, rendering it only if missing."""
+    os.makedirs(video_dir, exist_ok=True)
+    name = f'synthetic_{int(duration_sec)}s_{size[0]}x{size[1]}_{people}p_{trains}t_{int(fps)}fps_s{seed}.mp4'
+    path = os.path.join(video_dir, name)
+    if not os.path.exists(path):
+        make_video(path, duration_sec, fps, size, people, trains, seed)
+    return path
@@ -0,0 +1,374 @@
+"""
+batch_runner.py
+Batch processing of many videos with a pool of worker processes.
+
+:func:`run_batch` runs :func:`utils.pipeline.run_pipeline` over a list of
+videos in a process pool.  Every worker loads the detector once, when it
+starts, through the process-wide model registry and pins its torch thread
+count (by default the CPU cores are split evenly between the workers), so
+the model is not reloaded per video and the workers do not oversubscribe
+the host.
+
+Progress is kept in a JSON Lines manifest in the output directory: one line
+per finished video with its ``video_id``, status, timings and output paths,
+appended and flushed as soon as the video is done.  Videos whose
+``video_id`` is already recorded as done are skipped, so an interrupted
+batch is resumed by running the same command again; failed videos are
+retried.  At the end the aggregate throughput and every failure are
+printed.
+
+Videos are given as files, directories (searched for video files) or a
+manifest (``.csv``, ``.json`` or ``.jsonl``) with one entry per video::
+
+    video_path,video_id,video_start_dt,video_link,camera_id
+    /data/cam01/0800.mp4,cam01_0800,2024-01-01 08:00:00,s3://videos/cam01/0800.mp4,cam01
+
+Only ``video_path`` is required; ``video_id`` defaults to the file name
+without extension.  Example::
+
+    python -m utils.batch_runner /data/videos --out-dir results --workers 4 \\
+        --camera-configs cameras.json --train-numbers numbers.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Union
+
+import cv2
+
+from utils.camera_config import CameraConfig, load_camera_configs
+from utils.detectors import Detector, as_detector
+from utils.events import iter_events
+from utils.model_registry import set_cpu_threads
+from utils.pipeline import OUTPUT_FORMATS, load_detector, run_pipeline, video_duration
+from utils.train_numbers import TrainNumberIndex, as_train_number_index, load_train_numbers
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mov', '.mp4', '.avi', '.mkv')
+MANIFEST_NAME = 'batch_manifest.jsonl'
+DEFAULT_MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+
+# set in each worker process by _init_worker
+_WORKER: dict = {}
+
+
+##############################
+# Inputs and manifest
+##############################
+
+def _video_entry(path: str) -> dict:
+    return {'video_path': path, 'video_id': os.path.splitext(os.path.basename(path))[0]}
+
+
+def collect_videos(inputs: Iterable[str]) -> List[dict]:
+    """
+    Expand files, directories and manifests into one entry per video.
+
+    Directories are searched recursively for files with an extension from
+    :data:`VIDEO_EXTENSIONS`.  Entries without ``video_id`` get the file name
+    without extension.
+
+    Raises:
+        ValueError: If two videos share a ``video_id``.
+    """
+    entries: List[dict] = []
+    for item in inputs:
+        lower = item.lower()
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        entries.append(_video_entry(os.path.join(root, name)))
+        elif lower.endswith('.csv'):
+            with open(item, 'r', encoding='utf-8-sig', newline='') as f:
+                for row in csv.DictReader(f):
+                    entries.append({k.strip(): v.strip() for k, v in row.items() if k and v})
+        elif lower.endswith(('.json', '.jsonl', '.jsonl.gz')):
+            entries.extend(dict(e) for e in iter_events(item))
+        else:
+            entries.append(_video_entry(item))
+    seen: Dict[str, str] = {}
+    for entry in entries:
+        if 'video_path' not in entry:
+            raise ValueError(f'manifest entry without video_path: {entry!r}')
+        entry.setdefault('video_id', _video_entry(entry['video_path'])['video_id'])
+        other = seen.setdefault(entry['video_id'], entry['video_path'])
+        if other != entry['video_path']:
+            raise ValueError(f"video_id {entry['video_id']!r} is used by {other} and {entry['video_path']}")
+    return entries
+
+
+def read_manifest(path: str) -> Dict[str, dict]:
+    """Return the last manifest record of every ``video_id`` (empty if the file is missing)."""
+    records: Dict[str, dict] = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash while it was being written
+                continue
+            records[record['video_id']] = record
+    return records
+
+
+def _append_manifest(f, record: dict) -> None:
+    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+
+##############################
+# Workers
+##############################
+
+def _init_worker(
+    model: Optional[object],
+    backend: str,
+    models_dir: str,
+    num_threads: Optional[int],
+    camera_configs: Dict[str, CameraConfig],
+    numbers: Optional[TrainNumberIndex],
+    options: dict,
+) -> None:
+    # torch may already be imported (and its OpenMP pool sized) by the time
+    # the initializer runs, so the pool is sized through torch directly
+    detector: Optional[Detector]
+    if model is not None:
+        detector = as_detector(model)
+        set_cpu_threads(num_threads)
+    else:
+        detector = load_detector(backend, models_dir, num_threads)
+    _WORKER.update(
+        detector=detector, backend=backend, num_threads=num_threads,
+        camera_configs=camera_configs, numbers=numbers, options=options,
+    )
+
+
+def _can_open(video_path: str) -> bool:
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.isOpened()
+    finally:
+        cap.release()
+
+
+def _process_video(entry: dict) -> dict:
+    """Run the pipeline on one video in a worker; never raises."""
+    start = time.perf_counter()
+    record = {'video_id': entry['video_id'], 'video_path': entry['video_path'], 'pid': os.getpid()}
+    try:
+        if not _can_open(entry['video_path']):
+            # run_pipeline would silently write empty outputs
+            raise RuntimeError('cannot open video')
+        detector = _WORKER['detector']
+        if detector is None:
+            raise RuntimeError(f"detector backend {_WORKER['backend']!r} is not available in the worker")
+        camera_id = entry.get('camera_id')
+        camera_config = _WORKER['camera_configs'].get(camera_id) if camera_id else None
+        if camera_id and camera_config is None:
+            logger.warning('no configuration for camera %s, using the whole frame', camera_id)
+        options = _WORKER['options']
+        people_path, train_path = run_pipeline(
+            entry['video_path'], detector, entry.get('video_start_dt'), entry.get('video_link'), entry['video_id'],
+            train_numbers_list=_WORKER['numbers'], out_dir=os.path.join(options['out_dir'], entry['video_id']),
+            batch_size=options['batch_size'], decode_queue_size=options['decode_queue_size'],
+            output_format=options['output_format'], num_threads=_WORKER['num_threads'],
+            detection_cache_dir=options['detection_cache_dir'], motion_gate=options['motion_gate'],
+            camera_config=camera_config,
+        )
+        record.update(status='done', people_path=people_path, train_path=train_path)
+    except Exception as e:
+        record.update(status='failed', error=f'{type(e).__name__}: {e}', traceback=traceback.format_exc())
+    record['wall_sec'] = round(time.perf_counter() - start, 3)
+    record['video_sec'] = round(video_duration(entry['video_path']), 3)
+    record['finished'] = datetime.now().isoformat(timespec='seconds')
+    return record
+
+
+##############################
+# Batch
+##############################
+
+def run_batch(
+    inputs: Iterable[str],
+    out_dir: str,
+    workers: int = 1,
+    num_threads: Optional[int] = None,
+    model: Optional[object] = None,
+    backend: str = 'ultralytics',
+    models_dir: str = DEFAULT_MODELS_DIR,
+    camera_configs: Optional[Dict[str, CameraConfig]] = None,
+    train_numbers: Union[None, List[dict], TrainNumberIndex] = None,
+    batch_size: int = 4,
+    decode_queue_size: int = 8,
+    output_format: str = 'json',
+    detection_cache_dir: Optional[str] = None,
+    motion_gate: bool = False,
+    manifest_path: Optional[str] = None,
+    retry_failed: bool = True,
+) -> dict:
+    """
+    Process many videos with a pool of worker processes.
+
+    Args:
+        inputs: Video files, directories and manifests, see
+            :func:`collect_videos`.
+        out_dir: Output directory; each video writes its events to
+            ``out_dir/<video_id>/``.
+        workers: Number of worker processes.
+        num_threads: torch CPU threads per worker; ``None`` splits the CPU
+            cores evenly between the workers.
+        model: Optional preloaded model or detector sent to every worker
+            instead of loading ``backend`` from ``models_dir``.
+        camera_configs: Camera settings by camera id, applied to entries
+            with a ``camera_id``.
+        train_numbers: Train number log shared by all videos; it is indexed
+            once and sent to every worker.
+        manifest_path: Progress manifest; defaults to
+            ``out_dir/batch_manifest.jsonl``.
+        retry_failed: Re-run videos recorded as failed.
+
+    The remaining arguments are passed to :func:`utils.pipeline.run_pipeline`.
+
+    Returns:
+        A summary with the counts of processed, skipped and failed videos,
+        the processed video and wall-clock seconds, the throughput and the
+        failure records.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'unknown output format: {output_format!r}')
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(out_dir, MANIFEST_NAME)
+    entries = collect_videos(inputs)
+    previous = read_manifest(manifest_path)
+
+    def finished(entry: dict) -> bool:
+        status = previous.get(entry['video_id'], {}).get('status')
+        return status == 'done' or (status == 'failed' and not retry_failed)
+
+    todo = [e for e in entries if not finished(e)]
+    skipped = len(entries) - len(todo)
+    if skipped:
+        logger.info('skipping %d videos already in %s', skipped, manifest_path)
+    workers = max(1, min(workers, len(todo) or 1))
+    if not num_threads:
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+    options = {
+        'out_dir': out_dir, 'batch_size': batch_size, 'decode_queue_size': decode_queue_size,
+        'output_format': output_format, 'detection_cache_dir': detection_cache_dir, 'motion_gate': motion_gate,
+    }
+
+    start = time.perf_counter()
+    done: List[dict] = []
+    failed: List[dict] = []
+    if todo:
+        with open(manifest_path, 'a', encoding='utf-8') as manifest, ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                model, backend, models_dir, num_threads, camera_configs or {},
+                as_train_number_index(train_numbers), options,
+            ),
+        ) as pool:
+            futures = {pool.submit(_process_video, entry): entry for entry in todo}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # the worker process died (e.g. out of memory)
+                    record = {
+                        'video_id': entry['video_id'], 'video_path': entry['video_path'], 'status': 'failed',
+                        'error': f'{type(e).__name__}: {e}', 'finished': datetime.now().isoformat(timespec='seconds'),
+                    }
+                _append_manifest(manifest, {k: v for k, v in record.items() if k != 'traceback'})
+                if record['status'] == 'done':
+                    done.append(record)
+                    logger.info('%s done in %.1f s', record['video_id'], record['wall_sec'])
+                else:
+                    failed.append(record)
+                    logger.error('%s failed: %s\n%s', record['video_id'], record['error'], record.get('traceback', ''))
+    wall = time.perf_counter() - start
+    video_sec = sum(r['video_sec'] for r in done)
+    return {
+        'videos': len(entries),
+        'processed': len(done),
+        'skipped': skipped,
+        'failed': len(failed),
+        'workers': workers,
+        'threads_per_worker': num_threads,
+        'wall_sec': round(wall, 3),
+        'video_sec': round(video_sec, 3),
+        'video_sec_per_sec': round(video_sec / wall, 2) if wall > 0 else 0.0,
+        'videos_per_hour': round(len(done) / wall * 3600, 1) if wall > 0 else 0.0,
+        'failures': [{'video_id': r['video_id'], 'video_path': r['video_path'], 'error': r['error']} for r in failed],
+        'manifest': manifest_path,
+    }
+
+
+##############################
+# Command line
+##############################
+
+def _print_summary(summary: dict) -> None:
+    print(f"{summary['videos']} videos: {summary['processed']} processed, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed")
+    print(f"{summary['workers']} workers x {summary['threads_per_worker']} threads, "
+          f"{summary['wall_sec']:.1f} s wall for {summary['video_sec']:.1f} s of video: "
+          f"{summary['video_sec_per_sec']:.2f} video s/s, {summary['videos_per_hour']:.1f} videos/h")
+    for failure in summary['failures']:
+        print(f"  FAILED {failure['video_id']} ({failure['video_path']}): {failure['error']}")
+    print(f"manifest: {summary['manifest']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run the detection pipeline over many videos.')
+    parser.add_argument('inputs', nargs='+', help='video files, directories or manifests (.csv/.json/.jsonl)')
+    parser.add_argument('--out-dir', required=True)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument('--threads', type=int, default=None, help='torch threads per worker')
+    parser.add_argument('--backend', default='ultralytics', choices=('ultralytics', 'onnx'))
+    parser.add_argument('--models-dir', default=DEFAULT_MODELS_DIR)
+    parser.add_argument('--camera-configs', help='JSON file of camera settings by camera id')
+    parser.add_argument('--train-numbers', help='train number log (.csv/.json/.jsonl)')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--decode-queue-size', type=int, default=8)
+    parser.add_argument('--output-format', default='json', choices=OUTPUT_FORMATS)
+    parser.add_argument('--detection-cache-dir')
+    parser.add_argument('--motion-gate', action='store_true')
+    parser.add_argument('--manifest', help=f'progress manifest (default: OUT_DIR/{MANIFEST_NAME})')
+    parser.add_argument('--no-retry-failed', action='store_true', help='skip videos that failed before')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    summary = run_batch(
+        args.inputs, args.out_dir, workers=args.workers, num_threads=args.threads, backend=args.backend,
+        models_dir=args.models_dir,
+        camera_configs=load_camera_configs(args.camera_configs) if args.camera_configs else None,
+        train_numbers=load_train_numbers(args.train_numbers) if args.train_numbers else None,
+        batch_size=args.batch_size, decode_queue_size=args.decode_queue_size, output_format=args.output_format,
+        detection_cache_dir=args.detection_cache_dir, motion_gate=args.motion_gate, manifest_path=args.manifest,
+        retry_failed=not args.no_retry_failed,
+    )
+    _print_summary(summary)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
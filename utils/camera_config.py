@@ -0,0 +1,267 @@
+"""
+camera_config.py
+Per-camera settings for the detection pipeline.
+
+Platform cameras are fixed and wide-angle: trains and people only ever
+appear on the rails and the platform, which is often a fraction of the
+frame.  A :class:`CameraConfig` lists the regions of interest (ROIs) of one
+camera, the inference size to use for them and the named zones that person
+events are assigned to (see :mod:`utils.zones`).  :class:`RoiDetector` wraps
+any :class:`utils.detectors.Detector`: it crops every ROI out of the frame
+(blanking pixels outside polygon ROIs), runs the wrapped detector on the
+crops in one batch and maps the boxes back to full-frame coordinates.
+
+Configurations are stored as JSON, one object per camera id::
+
+    {
+        "cam_01": {
+            "imgsz": 640,
+            "rois": [
+                [0, 300, 1920, 500],
+                [[100, 800], [1800, 800], [1900, 1080], [0, 1080]]
+            ],
+            "zones": {
+                "платформа": [[100, 800], [1800, 800], [1900, 1080], [0, 1080]],
+                "пути": [0, 300, 1920, 500]
+            }
+        }
+    }
+
+ROIs and zones are either rectangles ``[x, y, w, h]`` or polygons given as
+a list of ``[x, y]`` vertices, in pixels of the full frame.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+from utils.detectors import Detections, Detector, _empty
+from utils.zones import Polygon
+
+PAD_VALUE = 114  # grey used by letterboxing; also fills pixels outside polygon ROIs
+ROI_DUPLICATE_THRESH = 0.8  # share of the smaller box covered by another view of the same object
+EDGE_TOLERANCE_PX = 2.0  # a box this close to an inner ROI edge is considered cut off
+
+
+def _as_polygon(roi: Sequence) -> Polygon:
+    """Convert ``[x, y, w, h]`` or ``[[x, y], ...]`` to a list of vertices."""
+    if len(roi) == 4 and all(isinstance(v, (int, float)) for v in roi):
+        x, y, w, h = (float(v) for v in roi)
+        return [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+    polygon = [(float(p[0]), float(p[1])) for p in roi]
+    if len(polygon) < 3:
+        raise ValueError(f'a polygon ROI needs at least 3 vertices: {roi!r}')
+    return polygon
+
+
+@dataclass
+class CameraConfig:
+    """Inference settings of one camera.
+
+    Attributes:
+        camera_id: Identifier of the camera.
+        imgsz: Inference size passed to the detector (``None`` keeps the
+            backend default).
+        rois: Regions of interest as polygons in full-frame pixels.  Empty
+            means the whole frame.
+        zones: Zone name to polygon in full-frame pixels, in priority order
+            (a later zone wins where zones overlap).
+    """
+
+    camera_id: str = 'default'
+    imgsz: Optional[int] = None
+    rois: List[Polygon] = field(default_factory=list)
+    zones: Dict[str, Polygon] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, camera_id: str, data: dict) -> 'CameraConfig':
+        return cls(
+            camera_id=camera_id,
+            imgsz=data.get('imgsz'),
+            rois=[_as_polygon(roi) for roi in data.get('rois', [])],
+            zones={name: _as_polygon(zone) for name, zone in data.get('zones', {}).items()},
+        )
+
+    def detection_settings(self) -> dict:
+        """Settings that change detector output, e.g. for cache keys."""
+        return {'imgsz': self.imgsz, 'rois': [[list(p) for p in roi] for roi in self.rois]}
+
+
+def load_camera_configs(path: str) -> Dict[str, CameraConfig]:
+    """Read a JSON file mapping camera ids to their settings."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {camera_id: CameraConfig.from_dict(camera_id, cfg) for camera_id, cfg in data.items()}
+
+
+class _RoiCrop:
+    """Bounding rectangle of one ROI clipped to a frame size, plus its mask."""
+
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'mask')
+
+    def __init__(self, polygon: Polygon, width: int, height: int) -> None:
+        pts = np.asarray(polygon, dtype=np.float64)
+        self.x0 = int(max(0, np.floor(pts[:, 0].min())))
+        self.y0 = int(max(0, np.floor(pts[:, 1].min())))
+        self.x1 = int(min(width, np.ceil(pts[:, 0].max())))
+        self.y1 = int(min(height, np.ceil(pts[:, 1].max())))
+        self.mask: Optional[np.ndarray] = None
+        if self.x1 <= self.x0 or self.y1 <= self.y0:
+            return
+        local = np.round(pts - (self.x0, self.y0)).astype(np.int32)
+        mask = np.zeros((self.y1 - self.y0, self.x1 - self.x0), dtype=np.uint8)
+        cv2.fillPoly(mask, [local], 255)
+        # axis-aligned rectangles need no masking
+        if not mask.all():
+            self.mask = mask == 0
+
+    @property
+    def empty(self) -> bool:
+        return self.x1 <= self.x0 or self.y1 <= self.y0
+
+    def cut_off(self, xywh: np.ndarray, width: int, height: int) -> np.ndarray:
+        """Flag boxes touching an edge of this crop that lies inside the frame."""
+        x1 = xywh[:, 0] - xywh[:, 2] / 2
+        y1 = xywh[:, 1] - xywh[:, 3] / 2
+        x2 = x1 + xywh[:, 2]
+        y2 = y1 + xywh[:, 3]
+        tol = EDGE_TOLERANCE_PX
+        return (
+            ((x1 <= self.x0 + tol) & (self.x0 > 0))
+            | ((y1 <= self.y0 + tol) & (self.y0 > 0))
+            | ((x2 >= self.x1 - tol) & (self.x1 < width))
+            | ((y2 >= self.y1 - tol) & (self.y1 < height))
+        )
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        crop = frame[self.y0:self.y1, self.x0:self.x1]
+        if self.mask is not None:
+            crop = crop.copy()
+            crop[self.mask] = PAD_VALUE
+        return crop
+
+
+def _merge_rois(xywh: np.ndarray, cls: np.ndarray, roi_idx: np.ndarray, cut: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge detections of the same object seen through overlapping ROIs.
+
+    Only boxes from different ROIs are merged (boxes from one crop already
+    went through the detector's NMS).  An object crossing the edge of a ROI
+    is seen cut off, so plain IoU between the two views is low; instead two
+    same-class boxes are merged when the shared area covers
+    ``ROI_DUPLICATE_THRESH`` of the smaller box, or half of it when one of
+    them touches the inner edge of its crop.  Cut boxes are replaced by the
+    union of both views; otherwise the larger box is kept.
+    """
+    boxes = np.empty((len(xywh), 4), dtype=np.float64)
+    boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+    boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+    areas = np.maximum(xywh[:, 2] * xywh[:, 3], 1e-9)
+    kept: List[int] = []
+    for i in np.argsort(-areas, kind='stable').tolist():
+        merged = False
+        for k in kept:
+            if cls[k] != cls[i] or roi_idx[k] == roi_idx[i]:
+                continue
+            iw = min(boxes[i, 2], boxes[k, 2]) - max(boxes[i, 0], boxes[k, 0])
+            ih = min(boxes[i, 3], boxes[k, 3]) - max(boxes[i, 1], boxes[k, 1])
+            if iw <= 0 or ih <= 0:
+                continue
+            overlap = iw * ih / min(areas[i], areas[k])
+            either_cut = bool(cut[i] or cut[k])
+            if overlap >= ROI_DUPLICATE_THRESH or (either_cut and overlap >= 0.5):
+                if either_cut:
+                    boxes[k, :2] = np.minimum(boxes[k, :2], boxes[i, :2])
+                    boxes[k, 2:] = np.maximum(boxes[k, 2:], boxes[i, 2:])
+                    cut[k] = cut[k] and cut[i]
+                merged = True
+                break
+        if not merged:
+            kept.append(i)
+    kept.sort()
+    out = np.empty((len(kept), 4), dtype=np.float32)
+    out[:, :2] = (boxes[kept, :2] + boxes[kept, 2:]) / 2
+    out[:, 2:] = boxes[kept, 2:] - boxes[kept, :2]
+    return out, cls[kept]
+
+
+class RoiDetector(Detector):
+    """Run a detector on the regions of interest of a camera only.
+
+    Every ROI of every frame becomes one crop; all crops of a call go to the
+    wrapped detector in a single batch at the configured ``imgsz``.  Boxes
+    are shifted back to full-frame coordinates and, when ROIs overlap,
+    duplicates of the same object are removed.  Without ROIs the whole frame
+    is passed through with the configured ``imgsz``.
+
+    Args:
+        detector: The backend doing the inference.
+        config: ROIs and inference size of the camera.
+    """
+
+    def __init__(self, detector: Detector, config: CameraConfig) -> None:
+        self.detector = detector
+        self.config = config
+        self.name = detector.name
+        self.weights_path = detector.weights_path
+        self._crops: Dict[Tuple[int, int], List[_RoiCrop]] = {}
+
+    def settings(self) -> dict:
+        return dict(self.detector.settings(), camera=self.config.detection_settings())
+
+    def _crops_for(self, frame: np.ndarray) -> List[_RoiCrop]:
+        h, w = frame.shape[:2]
+        crops = self._crops.get((h, w))
+        if crops is None:
+            crops = [c for c in (_RoiCrop(p, w, h) for p in self.config.rois) if not c.empty]
+            self._crops[(h, w)] = crops
+        return crops
+
+    def detect(self, frames: Sequence[np.ndarray], imgsz: Optional[int] = None) -> List[Optional[Detections]]:
+        imgsz = imgsz or self.config.imgsz
+        if not self.config.rois:
+            return self.detector.detect(frames, imgsz=imgsz)
+        images: List[np.ndarray] = []
+        owners: List[Tuple[int, _RoiCrop]] = []
+        for i, frame in enumerate(frames):
+            for roi in self._crops_for(frame):
+                images.append(roi.crop(frame))
+                owners.append((i, roi))
+        results = self.detector.detect(images, imgsz=imgsz) if images else []
+        # per frame: (xywh, cls, roi index, cut-off flag) of every ROI
+        parts: List[List[Tuple[np.ndarray, np.ndarray, int, np.ndarray]]] = [[] for _ in frames]
+        failed = [False] * len(frames)
+        for (i, roi), res in zip(owners, results):
+            if res is None:
+                failed[i] = True
+                continue
+            xywh, cls = res
+            xywh = xywh.copy()
+            xywh[:, 0] += roi.x0
+            xywh[:, 1] += roi.y0
+            parts[i].append((xywh, cls, id(roi), roi.cut_off(xywh, frames[i].shape[1], frames[i].shape[0])))
+        out: List[Optional[Detections]] = []
+        for i in range(len(frames)):
+            if failed[i]:
+                out.append(None)
+            elif not parts[i]:
+                out.append(_empty())
+            elif len(parts[i]) == 1:
+                out.append((parts[i][0][0], parts[i][0][1]))
+            else:
+                out.append(_merge_rois(
+                    np.concatenate([p[0] for p in parts[i]]),
+                    np.concatenate([p[1] for p in parts[i]]),
+                    np.concatenate([np.full(len(p[1]), p[2], dtype=np.int64) for p in parts[i]]),
+                    np.concatenate([p[3] for p in parts[i]]),
+                ))
+        return out
@@ -0,0 +1,250 @@
+"""
+detection_cache.py
+Persistent on-disk cache of per-frame detections.
+
+Tuning tracker settings (the ``iou_thresh``, ``max_lost_sec`` and
+``v_thresh_stop`` arguments) re-runs :func:`utils.pipeline.run_pipeline` on
+the same footage with the same detector, yet every run used to repeat
+inference on every sampled frame.
+This cache stores the detector output of each sampled frame as compact NumPy
+arrays so that a re-run only repeats tracking and event building.
+
+An entry is keyed by the SHA-256 of the video content, the SHA-256 of the
+weights file and the sampling parameters, so renaming or re-uploading a
+video still hits the cache while any change of footage, weights or sampling
+misses it.  Content hashes of large files are remembered per
+``(path, size, mtime)`` so they are computed only once.  Each path has its
+own small memo file, replaced atomically, so threads and batch workers
+sharing the directory never overwrite each other's memos, and a file that
+changed simply replaces its stale memo.
+
+Entries are ``.npz`` files holding four arrays:
+
+* ``times`` – timestamp of each sampled frame (float64),
+* ``counts`` – detections per frame, ``-1`` where inference failed (int32),
+* ``xywh`` – concatenated boxes of all frames (float32, ``(N, 4)``),
+* ``cls`` – concatenated class ids (int16).
+
+The cache directory is bounded by size; the least recently used entries are
+evicted first.  A small CLI warms or inspects the cache::
+
+    python -m utils.detection_cache warm videos/*.mp4 --cache-dir .detcache
+    python -m utils.detection_cache info --cache-dir .detcache
+    python -m utils.detection_cache evict --cache-dir .detcache --max-size-mb 512
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.detectors import Detections
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+_HASH_DIR = 'content_hashes'
+
+# (time_sec, detections or None) for each sampled frame, in time order
+CachedFrames = List[Tuple[float, Optional[Detections]]]
+
+
+def file_sha256(path: str, chunk_size: int = 4 * 1024 * 1024) -> str:
+    """Return the hex SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """Size-bounded directory of cached detections.
+
+    Args:
+        cache_dir: Directory holding the entries; created if missing.
+        max_bytes: Total size above which least recently used entries are
+            evicted after every :meth:`save`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ---- keys ----
+
+    def content_hash(self, path: str) -> str:
+        """SHA-256 of ``path``, memoised on disk by path, size and mtime."""
+        st = os.stat(path)
+        real_path = os.path.realpath(path)
+        stamp = {'path': real_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        memo_dir = os.path.join(self.cache_dir, _HASH_DIR)
+        # one memo per path: writers never merge a shared index
+        memo_path = os.path.join(memo_dir, hashlib.sha1(real_path.encode('utf-8')).hexdigest() + '.json')
+        try:
+            with open(memo_path, 'r', encoding='utf-8') as f:
+                memo: Dict[str, object] = json.load(f)
+            if all(memo.get(k) == v for k, v in stamp.items()) and isinstance(memo.get('sha256'), str):
+                return memo['sha256']  # type: ignore[return-value]
+        except (OSError, ValueError):
+            pass
+        digest = file_sha256(path)
+        os.makedirs(memo_dir, exist_ok=True)
+        # replaces the memo of an older size or mtime of the same path
+        self._atomic_write_text(memo_path, json.dumps(dict(stamp, sha256=digest)))
+        return digest
+
+    def key(self, video_path: str, weights_path: str, params: dict) -> str:
+        """Cache key of a video processed with given weights and sampling parameters."""
+        payload = json.dumps(
+            {
+                'video': self.content_hash(video_path),
+                'weights': self.content_hash(weights_path),
+                'params': params,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    # ---- entries ----
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def load(self, key: str) -> Optional[CachedFrames]:
+        """Return the cached frames for ``key``, or ``None`` on a miss."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                times, counts, xywh, cls = data['times'], data['counts'], data['xywh'], data['cls']
+        except (OSError, KeyError, ValueError):
+            return None
+        # mark as recently used for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        frames: CachedFrames = []
+        offset = 0
+        for t, n in zip(times.tolist(), counts.tolist()):
+            if n < 0:
+                frames.append((t, None))
+                continue
+            frames.append((t, (xywh[offset:offset + n], cls[offset:offset + n].astype(np.float32))))
+            offset += n
+        return frames
+
+    def save(self, key: str, frames: CachedFrames) -> None:
+        """Store ``frames`` under ``key`` atomically, then enforce the size limit."""
+        times = np.asarray([t for t, _ in frames], dtype=np.float64)
+        counts = np.asarray([-1 if d is None else len(d[1]) for _, d in frames], dtype=np.int32)
+        dets = [d for _, d in frames if d is not None and len(d[1])]
+        xywh = np.concatenate([d[0] for d in dets]).astype(np.float32) if dets else np.zeros((0, 4), np.float32)
+        cls = np.concatenate([d[1] for d in dets]).astype(np.int16) if dets else np.zeros((0,), np.int16)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.npz.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, times=times, counts=counts, xywh=xywh, cls=cls)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def entries(self) -> List[dict]:
+        """Describe every entry, most recently used first."""
+        out = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append({'key': name[:-4], 'path': path, 'bytes': st.st_size, 'used': st.st_mtime})
+        out.sort(key=lambda e: e['used'], reverse=True)
+        return out
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """Delete least recently used entries until the cache fits; returns the count removed."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(e['bytes'] for e in entries)
+        removed = 0
+        while entries and total > limit:
+            victim = entries.pop()
+            try:
+                os.remove(victim['path'])
+            except OSError:
+                continue
+            total -= victim['bytes']
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _atomic_write_text(path: str, text: str) -> None:
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+##############################
+# Command line
+##############################
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Warm or inspect the detection cache.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('warm', 'info', 'evict'):
+        p = sub.add_parser(name)
+        p.add_argument('--cache-dir', required=True)
+        if name == 'warm':
+            p.add_argument('videos', nargs='+')
+            p.add_argument('--backend', default='ultralytics', choices=('ultralytics', 'onnx'))
+            p.add_argument('--batch-size', type=int, default=4)
+            p.add_argument('--threads', type=int, default=None)
+        if name == 'evict':
+            p.add_argument('--max-size-mb', type=float, required=True)
+    args = parser.parse_args(argv)
+
+    cache = DetectionCache(args.cache_dir)
+    if args.command == 'info':
+        entries = cache.entries()
+        total = sum(e['bytes'] for e in entries)
+        print(f'{len(entries)} entries, {total / 1024 ** 2:.1f} MB in {args.cache_dir}')
+        for e in entries:
+            with np.load(e['path']) as data:
+                n_frames, n_boxes = len(data['times']), len(data['cls'])
+            print(f"  {e['key']}  {e['bytes'] / 1024:9.1f} KB  {n_frames:7d} frames  {n_boxes:8d} boxes")
+    elif args.command == 'evict':
+        removed = cache.evict(int(args.max_size_mb * 1024 ** 2))
+        print(f'removed {removed} entries')
+    else:
+        # imported here: the pipeline pulls in OpenCV and the detector stack
+        from utils.pipeline import run_pipeline
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            for video in args.videos:
+                run_pipeline(
+                    video, out_dir=out_dir, backend=args.backend, batch_size=args.batch_size,
+                    num_threads=args.threads, detection_cache_dir=args.cache_dir,
+                )
+                print(f'cached {video}')
+
+
+if __name__ == '__main__':
+    main()
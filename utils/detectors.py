@@ -0,0 +1,311 @@
+"""
+detectors.py
+Detector backends used by the detection pipeline.
+
+:func:`utils.pipeline.run_pipeline` talks to a :class:`Detector`: an object
+that takes a list of BGR frames and returns, for each frame, the detections
+as a pair of arrays ``(xywh, cls)`` — box centres and sizes in frame pixels
+and class indices — or ``None`` if inference failed for that frame.
+
+Two backends are provided:
+
+* :class:`UltralyticsDetector` wraps an ultralytics ``YOLO`` model (or any
+  object with the same call signature and ``results[i].boxes`` interface).
+* :class:`OnnxDetector` runs a YOLOv8 model exported to ONNX with ONNX
+  Runtime on CPU.  It does its own letterbox preprocessing and vectorised
+  confidence filtering and NMS, and needs neither torch nor ultralytics,
+  which makes it much lighter to import and faster on CPU-only hosts.
+
+Heavy dependencies are imported lazily so that importing this module (and
+the pipeline) stays cheap when a backend is not used.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import inspect
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+# per-frame detector output: box centres/sizes (N, 4) and class ids (N,)
+Detections = Tuple[np.ndarray, np.ndarray]
+
+
+def _no_grad():
+    # torch is only imported once a torch-based model is actually called;
+    # stand-in models without torch simply run without a grad context
+    try:
+        import torch  # type: ignore
+    except ImportError:
+        return contextlib.nullcontext()
+    return torch.no_grad()
+
+
+def _empty() -> Detections:
+    return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32)
+
+
+class Detector:
+    """Interface of a detection backend."""
+
+    #: Short backend name used in logs, caches and benchmarks.
+    name = 'detector'
+    #: Weights file the backend was loaded from, if known; detection caches
+    #: key their entries on its content.
+    weights_path: Optional[str] = None
+
+    def settings(self) -> dict:
+        """Inference settings that change the output for the same weights."""
+        return {'backend': self.name}
+
+    def detect(self, frames: Sequence[np.ndarray], imgsz: Optional[int] = None) -> List[Optional[Detections]]:
+        """
+        Detect objects on a batch of frames.
+
+        Args:
+            frames: BGR images as produced by OpenCV.
+            imgsz: Optional inference size overriding the backend default.
+
+        Returns:
+            One ``(xywh, cls)`` pair per frame, or ``None`` for frames whose
+            inference failed.
+        """
+        raise NotImplementedError
+
+
+class UltralyticsDetector(Detector):
+    """Backend wrapping an ultralytics ``YOLO`` model.
+
+    A batched forward pass is attempted first.  If it fails, each frame is
+    retried on its own so that a single bad frame only loses its own
+    detections.
+    """
+
+    name = 'ultralytics'
+
+    def __init__(self, model: object, weights_path: Optional[str] = None) -> None:
+        self.model = model
+        # ultralytics models remember the checkpoint they were loaded from
+        self.weights_path = weights_path or getattr(model, 'ckpt_path', None)
+
+    def _call(self, source: object, imgsz: Optional[int]) -> list:
+        kwargs = {'verbose': False}
+        if imgsz:
+            kwargs['imgsz'] = imgsz
+        with _no_grad():
+            return list(self.model(source, **kwargs))  # type: ignore[operator]
+
+    @staticmethod
+    def _to_arrays(res: object) -> Optional[Detections]:
+        if res is None:
+            return None
+        try:
+            boxes = res.boxes  # type: ignore[attr-defined]
+            xywh = boxes.xywh.cpu().numpy() if hasattr(boxes.xywh, 'cpu') else np.asarray(boxes.xywh)
+            cls = boxes.cls.cpu().numpy() if hasattr(boxes.cls, 'cpu') else np.asarray(boxes.cls)
+            return np.asarray(xywh, dtype=np.float32).reshape(-1, 4), np.asarray(cls, dtype=np.float32).reshape(-1)
+        except Exception:
+            return None
+
+    def detect(self, frames: Sequence[np.ndarray], imgsz: Optional[int] = None) -> List[Optional[Detections]]:
+        frames = list(frames)
+        if not frames:
+            return []
+        try:
+            results = self._call(frames if len(frames) > 1 else frames[0], imgsz)
+            if len(results) == len(frames):
+                return [self._to_arrays(r) for r in results]
+        except Exception:
+            pass
+        if len(frames) == 1:
+            return [None]
+        out: List[Optional[Detections]] = []
+        for frame in frames:
+            try:
+                res = self._call(frame, imgsz)
+                out.append(self._to_arrays(res[0]) if res else None)
+            except Exception:
+                out.append(None)
+        return out
+
+
+def letterbox(frame: np.ndarray, size: Tuple[int, int], pad_value: int = 114) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    Resize ``frame`` to fit ``size`` (height, width) keeping aspect ratio and
+    pad the rest, as ultralytics does before inference.
+
+    Returns:
+        The padded image, the scale factor and the ``(pad_x, pad_y)`` offset
+        needed to map boxes back to the original frame.
+    """
+    h, w = frame.shape[:2]
+    th, tw = size
+    r = min(th / h, tw / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    pad_x, pad_y = (tw - nw) / 2, (th - nh) / 2
+    if (nw, nh) != (w, h):
+        frame = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    out = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(pad_value,) * 3)
+    return out, r, (left, top)
+
+
+def nms(boxes_xyxy: np.ndarray, scores: np.ndarray, iou_thresh: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression.
+
+    Each iteration suppresses all remaining boxes overlapping the current
+    best one in a single vectorised IoU computation.
+
+    Returns:
+        Indices of the kept boxes, highest score first.
+    """
+    order = np.argsort(-scores, kind='stable')
+    x1, y1, x2, y2 = boxes_xyxy.T
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    keep: List[int] = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        iw = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        ih = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = iw * ih
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_thresh]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class OnnxDetector(Detector):
+    """YOLOv8 ONNX model executed with ONNX Runtime on CPU.
+
+    Args:
+        onnx_path: Path to a model exported with ``yolo export format=onnx``.
+        imgsz: Inference size used when the model has dynamic spatial
+            dimensions; otherwise the exported size is used.
+        conf_thresh: Minimum class confidence.
+        iou_thresh: IoU threshold of the per-class NMS.
+        max_det: Maximum detections kept per frame.
+        num_threads: ONNX Runtime intra-op thread count (``None`` for the
+            runtime default).
+    """
+
+    name = 'onnx'
+
+    def __init__(
+        self,
+        onnx_path: str,
+        imgsz: int = 640,
+        conf_thresh: float = 0.25,
+        iou_thresh: float = 0.7,
+        max_det: int = 300,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        import onnxruntime as ort  # type: ignore
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.weights_path = onnx_path
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        batch, _, h, w = inp.shape
+        self.fixed_batch = batch if isinstance(batch, int) else None
+        self.fixed_size = (h, w) if isinstance(h, int) and isinstance(w, int) else None
+        self.imgsz = imgsz
+        self.conf_thresh = conf_thresh
+        self.iou_thresh = iou_thresh
+        self.max_det = max_det
+
+    def settings(self) -> dict:
+        # a fixed exported size is part of the weights, so the configured
+        # size is reported and the defaults match :func:`default_settings`
+        return {
+            'backend': self.name, 'imgsz': self.imgsz,
+            'conf_thresh': self.conf_thresh, 'iou_thresh': self.iou_thresh, 'max_det': self.max_det,
+        }
+
+    def _preprocess(self, frames: Sequence[np.ndarray], size: Tuple[int, int]) -> Tuple[np.ndarray, list]:
+        blobs = []
+        meta = []
+        for frame in frames:
+            img, r, pad = letterbox(frame, size)
+            blobs.append(img)
+            meta.append((r, pad))
+        # BGR HWC uint8 -> RGB NCHW float32 in [0, 1]
+        batch = np.stack(blobs)[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(batch, dtype=np.float32) / 255.0, meta
+
+    def _postprocess(self, pred: np.ndarray, r: float, pad: Tuple[float, float]) -> Detections:
+        # pred: (4 + num_classes, num_anchors) -> (num_anchors, 4 + num_classes)
+        pred = pred.T
+        scores_all = pred[:, 4:]
+        cls = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(cls)), cls]
+        mask = scores >= self.conf_thresh
+        if not mask.any():
+            return _empty()
+        boxes, scores, cls = pred[mask, :4], scores[mask], cls[mask]
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+        # offset boxes by class so one NMS pass never suppresses across classes
+        offset = cls[:, None].astype(np.float32) * 7680.0
+        keep = nms(xyxy + offset, scores, self.iou_thresh)[: self.max_det]
+        boxes, cls = boxes[keep], cls[keep]
+        boxes[:, 0] = (boxes[:, 0] - pad[0]) / r
+        boxes[:, 1] = (boxes[:, 1] - pad[1]) / r
+        boxes[:, 2:] /= r
+        return boxes.astype(np.float32), cls.astype(np.float32)
+
+    def detect(self, frames: Sequence[np.ndarray], imgsz: Optional[int] = None) -> List[Optional[Detections]]:
+        frames = list(frames)
+        if not frames:
+            return []
+        if self.fixed_size is not None:
+            size = self.fixed_size
+        else:
+            side = int(imgsz or self.imgsz)
+            size = (side, side)
+        chunk = self.fixed_batch or len(frames)
+        out: List[Optional[Detections]] = []
+        for i in range(0, len(frames), chunk):
+            part = frames[i:i + chunk]
+            # a model exported with a fixed batch needs full batches
+            padded = part + [part[-1]] * (chunk - len(part))
+            try:
+                blob, meta = self._preprocess(padded, size)
+                preds = self.session.run(None, {self.input_name: blob})[0][:len(part)]
+                out.extend(self._postprocess(p, r, pad) for p, (r, pad) in zip(preds, meta))
+            except Exception:
+                out.extend([None] * len(part))
+        return out
+
+
+def default_settings(backend: str) -> dict:
+    """
+    Return the :meth:`Detector.settings` of a ``backend`` detector loaded
+    with its default arguments, without loading the model.
+    """
+    if backend == OnnxDetector.name:
+        params = inspect.signature(OnnxDetector.__init__).parameters
+        return dict(
+            {'backend': backend},
+            **{name: params[name].default for name in ('imgsz', 'conf_thresh', 'iou_thresh', 'max_det')},
+        )
+    return {'backend': backend}
+
+
+def as_detector(model: object) -> Detector:
+    """Return ``model`` if it already is a :class:`Detector`, else wrap it as ultralytics."""
+    if isinstance(model, Detector):
+        return model
+    return UltralyticsDetector(model)
@@ -0,0 +1,229 @@
+"""
+events.py
+Event construction helpers for the detection pipeline.
+
+The tracker observes every person once per sampled frame.  Writing one record
+per observation produces thousands of near-identical rows for a short clip,
+so :class:`PersonEventCompactor` merges consecutive observations of the same
+person with the same status and zone into a single interval with real
+``start_sec``/``end_sec``.  It runs incrementally: an interval is emitted as
+soon as it can no longer grow (status or zone change, a gap in observations
+or the track being retired), so memory only holds one open interval per
+visible person.  On live streams :meth:`PersonEventCompactor.flush_older`
+additionally cuts intervals that have been open for too long.
+
+:class:`JsonLinesWriter` streams events to disk as JSON Lines (optionally
+gzip-compressed) while processing runs and publishes the file atomically
+when it is closed; :func:`iter_events` reads any of the pipeline output
+formats back one event at a time.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import IO, Callable, Dict, Iterator, List, Optional
+
+DT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def format_event_dt(start_dt: datetime, sec: float) -> str:
+    """Return the wall-clock time ``sec`` seconds after ``start_dt``."""
+    return (start_dt + timedelta(seconds=sec)).strftime(DT_FORMAT)
+
+
+class _OpenInterval:
+    __slots__ = ('start_sec', 'end_sec', 'status', 'zone')
+
+    def __init__(self, start_sec: float, status: str, zone: Optional[str]) -> None:
+        self.start_sec = start_sec
+        self.end_sec = start_sec
+        self.status = status
+        self.zone = zone
+
+
+class PersonEventCompactor:
+    """Merge per-frame person observations into interval events.
+
+    Args:
+        sink: Callable receiving each finished event dictionary.
+        filename: Video file name stored in every event.
+        video_link: Original video URL stored in every event.
+        video_id: Fragment identifier stored in every event.
+        start_dt: Wall-clock time of the start of the video.
+        max_gap_sec: Observations further apart than this start a new
+            interval even if status and zone are unchanged.
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[dict], None],
+        filename: str,
+        video_link: str,
+        video_id: str,
+        start_dt: datetime,
+        max_gap_sec: float = 5.0,
+    ) -> None:
+        self.sink = sink
+        self.filename = filename
+        self.video_link = video_link
+        self.video_id = video_id
+        self.start_dt = start_dt
+        self.max_gap_sec = max_gap_sec
+        self._open: Dict[int, _OpenInterval] = {}
+
+    def observe(self, person_id: int, sec: float, status: str, zone: Optional[str] = None) -> None:
+        """Record one observation, extending or replacing the open interval."""
+        cur = self._open.get(person_id)
+        if cur is not None:
+            if cur.status == status and cur.zone == zone and sec - cur.end_sec <= self.max_gap_sec:
+                cur.end_sec = sec
+                return
+            self._emit(person_id, cur)
+        self._open[person_id] = _OpenInterval(sec, status, zone)
+
+    def close(self, person_id: int) -> None:
+        """Emit the open interval of ``person_id``, e.g. when its track is retired."""
+        cur = self._open.pop(person_id, None)
+        if cur is not None:
+            self._emit(person_id, cur)
+
+    def flush_older(self, now_sec: float, max_age_sec: float) -> None:
+        """
+        Emit open intervals that started at least ``max_age_sec`` before ``now_sec``.
+
+        Bounds the delay between an observation and the event covering it on
+        live streams, where a person may stay in view for hours.  The next
+        observation of the person opens a new interval; the pieces can be
+        joined again with :func:`merge_person_intervals`.
+        """
+        for person_id in [p for p, cur in self._open.items() if now_sec - cur.start_sec >= max_age_sec]:
+            self._emit(person_id, self._open.pop(person_id))
+
+    def _emit(self, person_id: int, cur: _OpenInterval) -> None:
+        self.sink({
+            'person_id': person_id,
+            'filename': self.filename,
+            'video_link': self.video_link,
+            'video_id': self.video_id,
+            'start_sec': cur.start_sec,
+            'end_sec': cur.end_sec,
+            'start_dt': format_event_dt(self.start_dt, cur.start_sec),
+            'end_dt': format_event_dt(self.start_dt, cur.end_sec),
+            'status': cur.status,
+            'zone': cur.zone,
+        })
+
+
+def merge_person_intervals(events: List[dict], max_gap_sec: float) -> List[dict]:
+    """
+    Join interval events that continue each other.
+
+    Used after stitching independently compacted parts of a video (for
+    example time shards): two events of the same person with the same status
+    and zone are merged when the second starts at most ``max_gap_sec`` after
+    the first ends.  The result is ordered by ``(start_sec, person_id)``.
+    """
+    merged: List[dict] = []
+    last: Dict[int, dict] = {}
+    for event in sorted(events, key=lambda e: (e['person_id'], e['start_sec'])):
+        prev = last.get(event['person_id'])
+        if (
+            prev is not None
+            and prev['status'] == event['status']
+            and prev['zone'] == event['zone']
+            and event['start_sec'] - prev['end_sec'] <= max_gap_sec
+        ):
+            prev['end_sec'] = event['end_sec']
+            prev['end_dt'] = event['end_dt']
+            continue
+        event = dict(event)
+        merged.append(event)
+        last[event['person_id']] = event
+    merged.sort(key=lambda e: (e['start_sec'], e['person_id']))
+    return merged
+
+
+class JsonLinesWriter:
+    """Append events to a JSON Lines file and publish it atomically.
+
+    Events are written to ``<path>.part`` as they arrive, so progress is
+    visible while a long video is processed and memory does not grow with
+    the number of events.  The buffer is flushed to disk every
+    ``flush_interval_sec`` seconds.  :meth:`close` renames the part file to
+    ``path``; :meth:`abort` discards it.  The writer is a context manager
+    that closes on success and aborts on error.
+
+    Args:
+        path: Final output path.  A ``.gz`` suffix enables gzip compression.
+        flush_interval_sec: Maximum time between flushes to disk.
+    """
+
+    def __init__(self, path: str, flush_interval_sec: float = 5.0) -> None:
+        self.path = path
+        self.tmp_path = path + '.part'
+        self.flush_interval_sec = flush_interval_sec
+        self.count = 0
+        self._last_flush = time.monotonic()
+        if path.endswith('.gz'):
+            self._file: IO[str] = gzip.open(self.tmp_path, 'wt', encoding='utf-8')  # type: ignore[assignment]
+        else:
+            self._file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def write(self, event: dict) -> None:
+        self._file.write(json.dumps(event, ensure_ascii=False))
+        self._file.write('\n')
+        self.count += 1
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval_sec:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self) -> str:
+        """Finish the file and move it into place; returns the final path."""
+        if not self._file.closed:
+            self._file.close()
+            os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        """Discard the partially written file."""
+        if not self._file.closed:
+            self._file.close()
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+    def __enter__(self) -> 'JsonLinesWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def iter_events(path: str) -> Iterator[dict]:
+    """
+    Iterate over the events stored in a pipeline output file.
+
+    Supports JSON Lines (``.jsonl``), gzip-compressed JSON Lines
+    (``.jsonl.gz``) and the JSON array format (``.json``).  JSON Lines files
+    are read one line at a time, so arbitrarily large outputs can be
+    processed in constant memory.
+    """
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:  # type: ignore[operator]
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -0,0 +1,365 @@
+"""
+frame_source.py
+Frame sources used by the detection pipeline.
+
+Decoding dominates the cost of reading a video at 25–30 fps when the pipeline
+only looks at about one frame per second.  :class:`SampledFrameReader`
+advances through the stream with ``VideoCapture.grab()``, which demuxes and
+decodes the packet but skips the colour conversion and copy into a NumPy
+array, and only calls ``retrieve()`` for frames that are actually sampled.
+For sparse sampling it can optionally seek by timestamp instead of grabbing
+through the gap.
+
+Timestamps are taken from the container's presentation timestamps
+(``CAP_PROP_POS_MSEC``) rather than ``frame_idx / fps``, so sampling on
+29.97 fps footage does not drift against wall-clock time.
+
+:class:`ThreadedFrameSource` moves any frame source onto a background thread
+feeding a bounded queue, so decoding overlaps with inference.  OpenCV and
+torch both release the GIL in their heavy sections, which lets the two
+stages run on separate cores.
+
+For live processing, :class:`GrowingFileReader` follows a recording that is
+still being written and :class:`RealTimeReplay` paces any source at its
+timestamps, so a local file can stand in for a camera feed.
+"""
+
+from __future__ import annotations
+
+import math
+import queue
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+
+class SampledFrameReader:
+    """Iterate over ``(time_sec, frame)`` pairs sampled at a fixed interval.
+
+    Args:
+        cap: An opened ``cv2.VideoCapture``.
+        interval_sec: Target spacing between sampled frames in seconds.  The
+            attribute can be changed while iterating; the next sample is
+            scheduled on the grid ``start_sec + k * interval_sec`` of the new
+            value.
+        start_sec: Timestamp of the first sampled frame.
+        end_sec: Stop once the presentation timestamp reaches this value.
+        seek_threshold_sec: When set and the gap to the next sample exceeds
+            this many seconds, seek by timestamp instead of grabbing every
+            intermediate frame.  Useful for very sparse sampling of long-GOP
+            files; leave ``None`` for dense sampling.
+
+    Attributes:
+        frames_grabbed: Number of frames advanced over with ``grab()``.
+        frames_retrieved: Number of frames decoded into arrays and yielded.
+        seeks: Number of timestamp seeks performed.
+    """
+
+    def __init__(
+        self,
+        cap: "cv2.VideoCapture",
+        interval_sec: float = 1.0,
+        start_sec: float = 0.0,
+        end_sec: Optional[float] = None,
+        seek_threshold_sec: Optional[float] = None,
+    ) -> None:
+        self.cap = cap
+        self.interval_sec = interval_sec
+        self.start_sec = max(0.0, start_sec)
+        self.end_sec = end_sec
+        self.seek_threshold_sec = seek_threshold_sec
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frames_grabbed = 0
+        self.frames_retrieved = 0
+        self.seeks = 0
+
+    def _seek(self, time_sec: float) -> None:
+        self.cap.set(cv2.CAP_PROP_POS_MSEC, time_sec * 1000.0)
+        self.seeks += 1
+
+    def _position_sec(self, fallback_sec: float, last_sec: Optional[float]) -> float:
+        """Presentation timestamp of the frame that was just grabbed.
+
+        Backends that do not report timestamps return 0 or values that do
+        not advance; in that case the frame-count estimate is used.
+        """
+        msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if msec is None or msec < 0 or (last_sec is not None and msec / 1000.0 <= last_sec):
+            return fallback_sec
+        return msec / 1000.0
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray]]:
+        half_frame = 0.5 / self.fps
+        next_sec = self.start_sec
+        if self.start_sec > 0:
+            self._seek(self.start_sec)
+        frame_pos = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)
+        last_sec: Optional[float] = None
+        while True:
+            if (
+                self.seek_threshold_sec is not None
+                and last_sec is not None
+                and next_sec - last_sec > self.seek_threshold_sec
+            ):
+                # land a little before the target so the sample is not skipped
+                self._seek(max(0.0, next_sec - half_frame))
+                frame_pos = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)
+                last_sec = None
+            if not self.cap.grab():
+                break
+            self.frames_grabbed += 1
+            pos_sec = self._position_sec(frame_pos / self.fps, last_sec)
+            frame_pos += 1
+            last_sec = pos_sec
+            if self.end_sec is not None and pos_sec >= self.end_sec:
+                break
+            if pos_sec + half_frame < next_sec:
+                continue
+            ok, frame = self.cap.retrieve()
+            if not ok or frame is None:
+                continue
+            self.frames_retrieved += 1
+            interval = max(self.interval_sec, 1e-6)
+            # schedule the next sample on the interval grid anchored at
+            # start_sec, skipping grid points we are already past; anchoring
+            # keeps samples on one grid when the interval changes mid-stream
+            steps = math.floor((pos_sec + half_frame - self.start_sec) / interval) + 1
+            next_sec = self.start_sec + steps * interval
+            yield pos_sec, frame
+
+
+class ThreadedFrameSource:
+    """Decode frames on a background thread into a bounded queue.
+
+    Wraps any iterable of ``(time_sec, frame)`` pairs (typically a
+    :class:`SampledFrameReader`).  The producer thread starts on iteration
+    and stops when the source is exhausted, when the consumer stops
+    iterating, or when :meth:`close` is called.  Exceptions raised by the
+    source are re-raised in the consumer after the queued frames.
+
+    Args:
+        source: Iterable producing ``(time_sec, frame)`` pairs.
+        maxsize: Queue depth, i.e. how many decoded frames may be buffered
+            ahead of the consumer.
+        stop_event: Optional event ending iteration once set.  The consumer
+            waits on the queue with a timeout and checks it on every
+            wake-up, so a live source stalled inside a read does not block
+            the stop.
+
+    Attributes:
+        consumer_stalls: Times the consumer found the queue empty and had to
+            wait for decoding (the inference stage was starved).
+        producer_stalls: Times the producer found the queue full and had to
+            wait for the consumer (decoding is ahead of inference).
+        consumer_wait_sec: Total time the consumer spent waiting.
+        producer_wait_sec: Total time the producer spent waiting.
+    """
+
+    _END = object()
+
+    def __init__(
+        self,
+        source: Iterable[Tuple[float, np.ndarray]],
+        maxsize: int = 8,
+        stop_event: Optional[threading.Event] = None,
+    ) -> None:
+        self.source = source
+        self.stop_event = stop_event
+        self.queue: "queue.Queue[object]" = queue.Queue(maxsize=max(1, int(maxsize)))
+        self.consumer_stalls = 0
+        self.producer_stalls = 0
+        self.consumer_wait_sec = 0.0
+        self.producer_wait_sec = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def _put(self, item: object) -> bool:
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.producer_stalls += 1
+        t0 = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.producer_wait_sec += time.perf_counter() - t0
+
+    def _produce(self) -> None:
+        try:
+            for item in self.source:
+                if self._stop.is_set() or not self._put(item):
+                    return
+        except BaseException as e:  # re-raised in the consumer
+            self._error = e
+        finally:
+            if not self._stop.is_set():
+                self._put(self._END)
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray]]:
+        self._thread = threading.Thread(target=self._produce, name='frame-decoder', daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    self.consumer_stalls += 1
+                    t0 = time.perf_counter()
+                    item = self._wait()
+                    self.consumer_wait_sec += time.perf_counter() - t0
+                if item is self._END:
+                    break
+                yield item  # type: ignore[misc]
+            if self._error is not None:
+                raise self._error
+        finally:
+            self.close()
+
+    def _wait(self) -> object:
+        if self.stop_event is None:
+            return self.queue.get()
+        while not self.stop_event.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return self._END
+
+    def close(self) -> None:
+        """Stop the producer thread and drop any buffered frames."""
+        self._stop.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        if self._thread is not None and self._thread is not threading.current_thread():
+            # after an external stop the producer may be blocked inside a
+            # stalled source; it is a daemon and exits with its next frame
+            stopped = self.stop_event is not None and self.stop_event.is_set()
+            self._thread.join(timeout=1.0 if stopped else None)
+
+    def stats(self) -> dict:
+        """Return the stall counters as a plain dictionary."""
+        return {
+            'queue_size': self.queue.maxsize,
+            'consumer_stalls': self.consumer_stalls,
+            'producer_stalls': self.producer_stalls,
+            'consumer_wait_sec': round(self.consumer_wait_sec, 3),
+            'producer_wait_sec': round(self.producer_wait_sec, 3),
+        }
+
+
+class GrowingFileReader:
+    """Sample a video file that is still being written, like ``tail -f``.
+
+    At end of stream the file is reopened every ``poll_sec`` seconds and
+    reading resumes after the last sampled timestamp.  Iteration ends once
+    no new frame has appeared for ``idle_timeout_sec`` seconds.  Works with
+    containers that are readable while being written (MPEG-TS, MKV,
+    fragmented MP4), as produced by recorders segmenting a camera feed.
+
+    Args:
+        path: Path of the growing file.
+        interval_sec: Target spacing between sampled frames; can be changed
+            while iterating, as for :class:`SampledFrameReader`.
+        poll_sec: Delay between attempts to read new data.
+        idle_timeout_sec: Give up after this long without new frames
+            (``None`` to follow the file forever).
+        stop_event: Optional event ending iteration once set, checked after
+            every frame and while waiting for the file to grow.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        interval_sec: float = 1.0,
+        poll_sec: float = 1.0,
+        idle_timeout_sec: Optional[float] = 30.0,
+        stop_event: Optional[threading.Event] = None,
+    ) -> None:
+        self.path = path
+        self.interval_sec = interval_sec
+        self.poll_sec = poll_sec
+        self.idle_timeout_sec = idle_timeout_sec
+        self.stop_event = stop_event
+        self.reopens = 0
+
+    def _stopped(self) -> bool:
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray]]:
+        next_sec = 0.0
+        idle_since = time.monotonic()
+        while not self._stopped():
+            cap = cv2.VideoCapture(self.path)
+            try:
+                if cap.isOpened():
+                    reader = SampledFrameReader(cap, interval_sec=self.interval_sec, start_sec=next_sec)
+                    for sec, frame in reader:
+                        idle_since = time.monotonic()
+                        next_sec = sec + self.interval_sec
+                        yield sec, frame
+                        if self._stopped():
+                            return
+                        reader.interval_sec = self.interval_sec
+            finally:
+                cap.release()
+            if self.idle_timeout_sec is not None and time.monotonic() - idle_since > self.idle_timeout_sec:
+                return
+            if self.stop_event is not None:
+                if self.stop_event.wait(self.poll_sec):
+                    return
+            else:
+                time.sleep(self.poll_sec)
+            self.reopens += 1
+
+
+class RealTimeReplay:
+    """Pace a frame source so frames arrive at their timestamps in wall-clock time.
+
+    Replaying a local file this way reproduces the timing of a live camera,
+    which makes latency of stream processing testable offline.
+
+    Args:
+        source: Iterable producing ``(time_sec, frame)`` pairs.
+        speed: Playback speed; ``2.0`` replays twice as fast as real time.
+    """
+
+    def __init__(self, source: Iterable[Tuple[float, np.ndarray]], speed: float = 1.0) -> None:
+        self.source = source
+        self.speed = max(speed, 1e-6)
+
+    @property
+    def interval_sec(self) -> Optional[float]:
+        return getattr(self.source, 'interval_sec', None)
+
+    @interval_sec.setter
+    def interval_sec(self, value: float) -> None:
+        if hasattr(self.source, 'interval_sec'):
+            self.source.interval_sec = value  # type: ignore[attr-defined]
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray]]:
+        origin: Optional[Tuple[float, float]] = None
+        for sec, frame in self.source:
+            if origin is None:
+                origin = (time.monotonic(), sec)
+            delay = origin[0] + (sec - origin[1]) / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            yield sec, frame
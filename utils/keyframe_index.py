@@ -0,0 +1,369 @@
+"""
+keyframe_index.py
+Keyframe index of a video for cheap random access.
+
+NVR recordings are long-GOP H.264/H.265 with a keyframe every few seconds,
+sometimes every ten or more.  Any frame can only be decoded starting from
+the keyframe before it, and blind seeks with OpenCV are more expensive
+still: the FFmpeg backend handles ``cap.set(CAP_PROP_POS_FRAMES, n)`` by
+seeking to the keyframe before frame ``n - 16`` and decoding forward, so a
+target less than 16 frames after a keyframe costs a whole extra GOP.
+
+:func:`probe_keyframes` reads the packet headers of the video stream once,
+without decoding, using PyAV, ``ffprobe`` or OpenCV's raw packet mode,
+whichever is available, and builds a :class:`KeyframeIndex`: frame rate,
+frame count and the frame number and timestamp of every keyframe.  The
+index is stored as a JSON sidecar next to the video (:func:`sidecar_path`,
+:func:`load_or_build_index`) so each recording is probed only once.
+
+:class:`KeyframeSeeker` wraps a ``cv2.VideoCapture`` and positions it for
+every requested frame with the cheaper of reading forward and seeking.
+Samplers that do not need an exact frame, like the coarse timestamp scan,
+can let it snap the sample to the cheapest frame within a tolerance.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import subprocess
+from bisect import bisect_left, bisect_right
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+try:
+    import av  # type: ignore
+except ImportError:
+    av = None
+
+SIDECAR_SUFFIX = '.keyframes.json'
+INDEX_VERSION = 1
+# cap_ffmpeg seeks this many frames before the requested one and decodes forward
+OPENCV_SEEK_BACKOFF_FRAMES = 16
+# fixed cost of a seek (demuxer seek, decoder flush) in decoded frames
+SEEK_OVERHEAD_FRAMES = 24
+# a probe hung on a broken file or a stalled mount falls back to OpenCV after this
+FFPROBE_TIMEOUT_SEC = 120.0
+
+
+@dataclass
+class KeyframeIndex:
+    """Frame rate, frame count and keyframe positions of a video stream.
+
+    Frame numbers are in presentation order, as reported by
+    ``CAP_PROP_POS_FRAMES``; times are seconds from the first frame.
+    """
+
+    fps: float
+    frame_count: int
+    keyframes: List[int]
+    keyframe_times: List[float]
+    source: str = ''
+    file_size: Optional[int] = None
+    version: int = field(default=INDEX_VERSION)
+
+    @property
+    def duration_sec(self) -> float:
+        return self.frame_count / self.fps if self.fps else 0.0
+
+    def frame_at(self, time_sec: float) -> int:
+        """Frame shown at ``time_sec``."""
+        i = bisect_right(self.keyframe_times, time_sec) - 1
+        if i < 0:
+            frame = int(round(time_sec * self.fps))
+        else:
+            frame = self.keyframes[i] + int(round((time_sec - self.keyframe_times[i]) * self.fps))
+        return min(max(frame, 0), max(self.frame_count - 1, 0))
+
+    def keyframe_before(self, frame: int) -> int:
+        """Last keyframe at or before ``frame`` (0 if there is none)."""
+        i = bisect_right(self.keyframes, frame) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def seek_cost(self, frame: int) -> int:
+        """Frames decoded by an OpenCV seek to ``frame``, plus the seek overhead."""
+        landing = self.keyframe_before(max(frame - OPENCV_SEEK_BACKOFF_FRAMES, 0))
+        return frame - landing + 1 + SEEK_OVERHEAD_FRAMES
+
+    def keyframes_between(self, first: int, last: int) -> Sequence[int]:
+        """Keyframes in ``[first, last]``."""
+        return self.keyframes[bisect_left(self.keyframes, first):bisect_right(self.keyframes, last)]
+
+    # ---- persistence ----
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'KeyframeIndex':
+        return cls(
+            fps=float(data['fps']),
+            frame_count=int(data['frame_count']),
+            keyframes=[int(k) for k in data['keyframes']],
+            keyframe_times=[float(t) for t in data['keyframe_times']],
+            source=data.get('source', ''),
+            file_size=data.get('file_size'),
+            version=int(data.get('version', INDEX_VERSION)),
+        )
+
+    def save(self, path: str) -> bool:
+        """Write the index as JSON; returns ``False`` if the file cannot be written."""
+        tmp = f'{path}.{os.getpid()}.part'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f, separators=(',', ':'))
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        return True
+
+    @classmethod
+    def load(cls, path: str) -> Optional['KeyframeIndex']:
+        """Read an index written by :meth:`save`, or ``None``."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return index if index.version == INDEX_VERSION else None
+
+
+##############################
+# probing
+##############################
+
+def _from_packets(
+    times: List[float], keys: List[bool], fps: float, source: str, file_size: Optional[int],
+) -> Optional[KeyframeIndex]:
+    """Build an index from per-packet timestamps (any order) and keyframe flags."""
+    if not times:
+        return None
+    order = np.argsort(np.asarray(times), kind='stable')
+    t = np.asarray(times, dtype=np.float64)[order]
+    k = np.asarray(keys, dtype=bool)[order]
+    if not fps or fps <= 0:
+        span = t[-1] - t[0]
+        fps = (len(t) - 1) / span if span > 0 else 25.0
+    keyframes = np.flatnonzero(k)
+    if not len(keyframes):
+        return None
+    return KeyframeIndex(
+        fps=float(fps),
+        frame_count=len(t),
+        keyframes=keyframes.tolist(),
+        keyframe_times=np.round(t[keyframes] - t[0], 6).tolist(),
+        source=source,
+        file_size=file_size,
+    )
+
+
+def _probe_pyav(path: str) -> Optional[Tuple[List[float], List[bool], float]]:
+    if av is None:
+        return None
+    try:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            base = float(stream.time_base)
+            times, keys = [], []
+            for packet in container.demux(stream):
+                if packet.pts is None:
+                    continue
+                times.append(packet.pts * base)
+                keys.append(bool(packet.is_keyframe))
+            rate = stream.average_rate or stream.guessed_rate
+            return times, keys, float(rate) if rate else 0.0
+    except (av.error.FFmpegError, IndexError, OSError):
+        return None
+
+
+def _probe_ffprobe(path: str) -> Optional[Tuple[List[float], List[bool], float]]:
+    exe = shutil.which('ffprobe')
+    if exe is None:
+        return None
+    try:
+        out = subprocess.run(
+            [exe, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+             '-of', 'csv=p=0', path],
+            capture_output=True, text=True, check=True, timeout=FFPROBE_TIMEOUT_SEC,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    times, keys = [], []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(',')
+        try:
+            times.append(float(pts))
+        except ValueError:
+            continue  # N/A
+        keys.append('K' in flags)
+    return times, keys, 0.0
+
+
+def _probe_opencv(path: str) -> Optional[Tuple[List[float], List[bool], float]]:
+    if cv2 is None or not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+        return None
+    cap = cv2.VideoCapture(path)
+    try:
+        # read() returns the undecoded packets
+        if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        times, keys = [], []
+        while True:
+            ok, _ = cap.read()
+            if not ok:
+                break
+            times.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+            keys.append(bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+        return times, keys, fps
+    finally:
+        cap.release()
+
+
+_PROBES = (('pyav', _probe_pyav), ('ffprobe', _probe_ffprobe), ('opencv', _probe_opencv))
+
+
+def probe_keyframes(video_path: str) -> Optional[KeyframeIndex]:
+    """
+    Build the keyframe index of the first video stream in one pass over the
+    packet headers.  Returns ``None`` if no backend can read the file.
+    """
+    try:
+        file_size = os.path.getsize(video_path)
+    except OSError:
+        return None
+    for name, probe in _PROBES:
+        packets = probe(video_path)
+        if packets is None:
+            continue
+        index = _from_packets(*packets, source=name, file_size=file_size)
+        if index is not None:
+            return index
+    return None
+
+
+def sidecar_path(video_path: str) -> str:
+    return video_path + SIDECAR_SUFFIX
+
+
+def load_or_build_index(video_path: str, path: Optional[str] = None, save: bool = True) -> Optional[KeyframeIndex]:
+    """
+    Load the sidecar index of ``video_path``, probing the video if the
+    sidecar is missing or belongs to a file of another size.
+
+    Args:
+        video_path: The video.
+        path: Sidecar location, by default :func:`sidecar_path`.
+        save: Write a newly built index to ``path``; an unwritable
+            directory is not an error.
+    """
+    path = path or sidecar_path(video_path)
+    index = KeyframeIndex.load(path)
+    try:
+        size = os.path.getsize(video_path)
+    except OSError:
+        return None
+    if index is not None and index.file_size == size:
+        return index
+    index = probe_keyframes(video_path)
+    if index is not None and save:
+        index.save(path)
+    return index
+
+
+##############################
+# seeking
+##############################
+
+class KeyframeSeeker:
+    """Random access to the frames of an opened ``cv2.VideoCapture``.
+
+    Each request is served by reading forward from the current position
+    when that decodes fewer frames than a seek would, and by a seek
+    otherwise.
+
+    Args:
+        cap: An opened ``cv2.VideoCapture`` of the indexed video.
+        index: The video's :class:`KeyframeIndex`.
+
+    Attributes:
+        seeks: Seeks performed.
+        grabs: Frames skipped by reading forward.
+        reads: Frames returned.
+    """
+
+    def __init__(self, cap: "cv2.VideoCapture", index: KeyframeIndex) -> None:
+        self.cap = cap
+        self.index = index
+        self.seeks = 0
+        self.grabs = 0
+        self.reads = 0
+
+    def position(self) -> int:
+        """Frame returned by the next ``read()``."""
+        return int(self.cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)
+
+    def cost(self, frame: int, position: Optional[int] = None) -> int:
+        """Frames decoded to reach ``frame`` from ``position``."""
+        position = self.position() if position is None else position
+        seek = self.index.seek_cost(frame)
+        if position <= frame:
+            return min(frame - position + 1, seek)
+        return seek
+
+    def snap(self, frame: int, max_shift: int) -> int:
+        """Cheapest frame to reach within ``max_shift`` frames of ``frame``."""
+        if max_shift <= 0:
+            return frame
+        position = self.position()
+        last = max(self.index.frame_count - 1, 0)
+        first, end = max(frame - max_shift, 0), min(frame + max_shift, last)
+        candidates = {frame}
+        if first <= position <= end:
+            candidates.add(position)
+        # the cheapest seek targets sit just past a keyframe
+        for key in self.index.keyframes_between(first - OPENCV_SEEK_BACKOFF_FRAMES, end):
+            candidates.add(min(max(key + OPENCV_SEEK_BACKOFF_FRAMES, first), end))
+            if key >= first:
+                candidates.add(key)
+        return min(candidates, key=lambda c: (self.cost(c, position), abs(c - frame)))
+
+    def goto(self, frame: int) -> None:
+        """Position the capture so that the next ``read()`` returns ``frame``."""
+        position = self.position()
+        if position <= frame and frame - position + 1 <= self.index.seek_cost(frame):
+            while position < frame and self.cap.grab():
+                position += 1
+                self.grabs += 1
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            self.seeks += 1
+
+    def read_at(self, time_sec: float, snap_sec: float = 0.0) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Decode the frame at ``time_sec``, or the cheapest one within
+        ``snap_sec`` of it.  The frame's own time is ``CAP_PROP_POS_MSEC``
+        afterwards, as for ``cap.read()``.
+        """
+        frame = self.index.frame_at(time_sec)
+        frame = self.snap(frame, int(snap_sec * self.index.fps))
+        self.goto(frame)
+        ok, image = self.cap.read()
+        if ok:
+            self.reads += 1
+        return ok, image
+
+    def stats(self) -> dict:
+        return {'seeks': self.seeks, 'grabs': self.grabs, 'reads': self.reads}
@@ -9,10 +9,19 @@ import re
 import requests
 import boto3
 import tempfile
-from dataclasses import dataclass, asdict
-from typing import Optional, List, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, Optional, List, Tuple
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 import logging
+import numpy as np
+
+from utils.keyframe_index import KeyframeIndex, KeyframeSeeker, load_or_build_index, sidecar_path
+from utils.ocr_cache import DEFAULT_CACHE_PATH, OcrCache, crop_dhash
+from utils.ocr_local import TimestampReader, load_reader
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,7 +43,13 @@ S3_OUTPUT_PREFIX = "processed/"
 
 VIDEO_EXTENSIONS = ['.mov', '.mp4', '.avi', '.mkv']
 COARSE_STEP_SEC = 10.0
-REFINE_STEP_SEC = 1.0
+REFINE_STEP_SEC = float(os.getenv("REFINE_STEP_SEC", "1.0"))  # точность границ сессий, 0 - до кадра
+# Индекс ключевых кадров (<видео>.keyframes.json) для дешевого доступа к кадрам
+KEYFRAME_INDEX_ENABLED = os.getenv("KEYFRAME_INDEX", "1") != "0"
+# Кадр грубого скана можно сдвинуть на столько секунд к ближайшему дешевому
+# кадру: скан быстрее, но границы сессий без уточнения (REFINE_STEP_SEC)
+# смещаются на столько же. 0 (по умолчанию) - без сдвига
+KEYFRAME_SNAP_SEC = float(os.getenv("KEYFRAME_SNAP_SEC", "0"))
 JUMP_THRESHOLD_SEC = 60
 
 MODEL_NAME = "qwen/qwen3-vl-30b-a3b-instruct"
@@ -43,6 +58,25 @@ OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 CROP_HEIGHT_RATIO = 0.20
 CROP_WIDTH_RATIO = 0.50
 
+# Параллельные OCR-запросы: не больше OCR_MAX_CONCURRENCY одновременно и не
+# чаще OCR_RATE_LIMIT_PER_SEC в секунду (с пачкой до OCR_RATE_BURST подряд)
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "8"))
+OCR_RATE_LIMIT_PER_SEC = float(os.getenv("OCR_RATE_LIMIT_PER_SEC", "5"))
+OCR_RATE_BURST = int(os.getenv("OCR_RATE_BURST", "5"))
+
+# Кэш результатов OCR по перцептивному хэшу области с датой/временем;
+# пустой OCR_CACHE_PATH отключает кэш
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", DEFAULT_CACHE_PATH)
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "100000"))
+
+# Локальное чтение даты/времени по шаблонам цифр камеры (utils/ocr_local.py);
+# VLM вызывается только при низкой уверенности. Пустой OCR_TEMPLATES_DIR
+# отключает локальное чтение
+OCR_TEMPLATES_DIR = os.getenv(
+    "OCR_TEMPLATES_DIR", os.path.join(os.path.expanduser("~"), ".cache", "smart_camera", "ocr_templates")
+)
+OCR_BOOTSTRAP_FRAMES = int(os.getenv("OCR_BOOTSTRAP_FRAMES", "4"))
+
 OPENROUTER_API_KEY_FALLBACK = "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"
 
 # ================== ДАТАКЛАССЫ ==================
@@ -57,6 +91,15 @@ class FrameInfo:
     raw_response: str = ""
     scan_level: str = ""
 
+@dataclass
+class FrameCrop:
+    """Вырезанная область с датой/временем, подготовленная для OCR"""
+    frame_index: int
+    video_time_sec: float
+    image_data_url: str
+    content_hash: str = ""
+    image: Optional[np.ndarray] = None  # область в оттенках серого для локального чтения
+
 @dataclass
 class SessionInfo:
     session_index: int
@@ -111,8 +154,35 @@ def upload_file_to_s3(local_path: str, s3_key: str) -> bool:
         logger.error(f"❌ Ошибка загрузки: {e}")
         return False
 
-def extract_session_video(input_path: str, output_path: str, start_sec: float, end_sec: float) -> bool:
-    """Вырезает сегмент видео"""
+def fetch_keyframe_index(s3_key: str, local_video_path: str) -> Optional[KeyframeIndex]:
+    """
+    Индекс ключевых кадров скачанного видео: сайдкар <ключ>.keyframes.json
+    из S3, а если его нет (или он от другого файла) - однопроходный разбор
+    пакетов видео с загрузкой нового сайдкара в S3 рядом с видео
+    """
+    local_sidecar = sidecar_path(local_video_path)
+    remote_sidecar = sidecar_path(s3_key)
+    cached = None
+    s3 = get_s3_client()
+    if s3:
+        try:
+            s3.download_file(YANDEX_S3_CONFIG['bucket'], remote_sidecar, local_sidecar)
+            cached = KeyframeIndex.load(local_sidecar)
+        except Exception:
+            pass  # сайдкара еще нет
+    index = load_or_build_index(local_video_path, local_sidecar)
+    if index is not None and index != cached and os.path.exists(local_sidecar):
+        upload_file_to_s3(local_sidecar, remote_sidecar)
+    return index
+
+def extract_session_video(
+    input_path: str,
+    output_path: str,
+    start_sec: float,
+    end_sec: float,
+    keyframe_index: Optional[KeyframeIndex] = None,
+) -> bool:
+    """Вырезает сегмент видео (с индексом ключевых кадров - без лишнего декодирования при переходе к началу)"""
     try:
         cap = cv2.VideoCapture(input_path)
         if not cap.isOpened():
@@ -135,7 +205,10 @@ def extract_session_video(input_path: str, output_path: str, start_sec: float, e
             logger.error(f"Некорректные временные метки: {start_sec} - {end_sec}")
             return False
             
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        if keyframe_index is not None:
+            KeyframeSeeker(cap, keyframe_index).goto(start_frame)
+        else:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
         out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
         
         if not out.isOpened():
@@ -175,7 +248,70 @@ def encode_image_to_data_url(image_bgr) -> str:
     b64 = base64.b64encode(buffer.tobytes()).decode("utf-8")
     return f"data:image/jpeg;base64,{b64}"
 
-def call_openrouter_qwen(image_data_url: str, api_key: str) -> dict:
+class TokenBucket:
+    """
+    Потокобезопасный ограничитель частоты запросов (token bucket).
+    Токены пополняются со скоростью rate_per_sec, в запасе не больше burst.
+    """
+
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        self.rate = rate_per_sec
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Блокирует поток, пока не появится свободный токен"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_ocr_cache: Optional[OcrCache] = None
+_ocr_cache_lock = threading.Lock()
+
+def get_ocr_cache() -> Optional[OcrCache]:
+    """Возвращает общий кэш OCR (None, если кэш отключен или недоступен)"""
+    global _ocr_cache
+    if not OCR_CACHE_PATH:
+        return None
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            try:
+                _ocr_cache = OcrCache(OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES)
+            except Exception as e:
+                logger.warning(f"Кэш OCR недоступен ({OCR_CACHE_PATH}): {e}")
+                return None
+        return _ocr_cache
+
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+def get_http_session(pool_size: int = OCR_MAX_CONCURRENCY) -> requests.Session:
+    """
+    Возвращает общую keep-alive сессию requests.
+    Соединения с OpenRouter переиспользуются, пул рассчитан на pool_size потоков.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+def call_openrouter_qwen(image_data_url: str, api_key: str, session: Optional[requests.Session] = None) -> dict:
     """Вызывает OpenRouter API для OCR"""
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -217,7 +353,8 @@ def call_openrouter_qwen(image_data_url: str, api_key: str) -> dict:
     }
 
     try:
-        response = requests.post(OPENROUTER_URL, headers=headers, json=body, timeout=120)
+        session = session or get_http_session()
+        response = session.post(OPENROUTER_URL, headers=headers, json=body, timeout=120)
         response.raise_for_status()
         data = response.json()
         
@@ -255,19 +392,26 @@ def time_diff_seconds(a: Optional[int], b: Optional[int]) -> Optional[int]:
         diff = 24 * 3600 - diff
     return diff
 
-def analyze_frame_at_time(
+def read_crop_at_time(
     cap: cv2.VideoCapture,
-    api_key: str,
     time_sec: float,
-    scan_level: str,
-    fps: float,
-) -> Optional[FrameInfo]:
-    """Анализирует кадр в указанное время"""
+    seeker: Optional[KeyframeSeeker] = None,
+    snap_sec: float = 0.0,
+) -> Optional[FrameCrop]:
+    """
+    Декодирует кадр в указанное время и вырезает область с датой/временем.
+    С seeker кадр читается вперед от текущей позиции или после перехода к
+    ключевому кадру, смотря что дешевле; при snap_sec > 0 берется самый
+    дешевый кадр в пределах snap_sec от time_sec (его время - в результате).
+    """
     if time_sec < 0:
         time_sec = 0.0
 
-    cap.set(cv2.CAP_PROP_POS_MSEC, time_sec * 1000.0)
-    success, frame = cap.read()
+    if seeker is not None:
+        success, frame = seeker.read_at(time_sec, snap_sec)
+    else:
+        cap.set(cv2.CAP_PROP_POS_MSEC, time_sec * 1000.0)
+        success, frame = cap.read()
     if not success:
         return None
 
@@ -282,7 +426,60 @@ def analyze_frame_at_time(
 
     try:
         img_data_url = encode_image_to_data_url(cropped)
-        parsed = call_openrouter_qwen(img_data_url, api_key)
+    except Exception as e:
+        logger.error(f"Ошибка кодирования кадра: {e}")
+        img_data_url = ""
+
+    return FrameCrop(
+        frame_index=frame_index,
+        video_time_sec=video_time_sec,
+        image_data_url=img_data_url,
+        content_hash=crop_dhash(cropped),
+        image=cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY),
+    )
+
+def ocr_frame_crop(
+    crop: FrameCrop,
+    api_key: str,
+    scan_level: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    cache: Optional[OcrCache] = None,
+    reader: Optional[TimestampReader] = None,
+) -> FrameInfo:
+    """
+    Распознает дату/время на подготовленной области кадра.
+    Сначала время читается локально по шаблонам (reader), затем ищется в
+    кэше (cache); запрос к API выполняется, только если оба не дали ответа.
+    Ответы VLM пополняют шаблоны reader.
+    """
+    try:
+        parsed = None
+        if reader is not None and crop.image is not None:
+            local_date, local_time, confidence = reader.read(crop.image)
+            reader.record(local_date is not None)
+            if local_date is not None:
+                parsed = {
+                    "date": local_date,
+                    "time": local_time,
+                    "camera_id": reader.camera_id,
+                    "source": "local",
+                    "confidence": round(confidence, 3),
+                }
+        if parsed is None and cache is not None and crop.content_hash:
+            parsed = cache.get(crop.content_hash)
+        if parsed is None:
+            if not crop.image_data_url:
+                raise RuntimeError("Не удалось закодировать кадр в JPEG")
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            parsed = call_openrouter_qwen(crop.image_data_url, api_key, session)
+            # Кэшируются только полные ответы: ошибки HTTP и парсинга, а также
+            # ответы без даты или времени будут запрошены повторно
+            if cache is not None and crop.content_hash and parsed.get("date") and parsed.get("time"):
+                cache.put(crop.content_hash, parsed)
+        if reader is not None and crop.image is not None and parsed.get("source") != "local":
+            reader.learn(crop.image, parsed.get("date"), parsed.get("time"), parsed.get("camera_id"))
         
         ocr_date = parsed.get("date")
         ocr_time = parsed.get("time")
@@ -297,8 +494,8 @@ def analyze_frame_at_time(
     ocr_seconds = parse_hms_to_seconds(ocr_time)
 
     return FrameInfo(
-        frame_index=frame_index,
-        video_time_sec=video_time_sec,
+        frame_index=crop.frame_index,
+        video_time_sec=crop.video_time_sec,
         ocr_date=ocr_date,
         ocr_time=ocr_time,
         ocr_seconds=ocr_seconds,
@@ -307,8 +504,228 @@ def analyze_frame_at_time(
         scan_level=scan_level,
     )
 
-def process_video(video_path: str) -> Tuple[List[FrameInfo], List[SessionInfo]]:
-    """Основная функция обработки видео"""
+def analyze_frame_at_time(
+    cap: cv2.VideoCapture,
+    api_key: str,
+    time_sec: float,
+    scan_level: str,
+    fps: float,
+    reader: Optional[TimestampReader] = None,
+    seeker: Optional[KeyframeSeeker] = None,
+) -> Optional[FrameInfo]:
+    """Анализирует кадр в указанное время"""
+    crop = read_crop_at_time(cap, time_sec, seeker)
+    if crop is None:
+        return None
+    return ocr_frame_crop(crop, api_key, scan_level, cache=get_ocr_cache(), reader=reader)
+
+def ocr_crops_concurrently(
+    crops: List[FrameCrop],
+    api_key: str,
+    scan_level: str,
+    max_concurrency: int = OCR_MAX_CONCURRENCY,
+    rate_limit_per_sec: float = OCR_RATE_LIMIT_PER_SEC,
+    rate_burst: int = OCR_RATE_BURST,
+    reader: Optional[TimestampReader] = None,
+    known: Optional[Dict[int, FrameInfo]] = None,
+) -> List[FrameInfo]:
+    """
+    Отправляет OCR-запросы параллельно через общую keep-alive сессию.
+    Одновременно выполняется не больше max_concurrency запросов, частота
+    ограничена token bucket. Кадры, уверенно прочитанные локально (reader),
+    в API не отправляются. known - уже распознанные кадры по индексу в crops
+    (например, кадры начального обучения reader), они не распознаются повторно.
+    Результаты возвращаются в порядке кадров.
+    """
+    if not crops:
+        return []
+    known = known or {}
+    session = get_http_session(max_concurrency)
+    limiter = TokenBucket(rate_limit_per_sec, rate_burst)
+    cache = get_ocr_cache()
+    results: List[Optional[FrameInfo]] = [None] * len(crops)
+    for i, frame in known.items():
+        results[i] = replace(frame, scan_level=scan_level)
+    # Одинаковые области (замерший поток) распознаются один раз
+    first_by_hash = {}
+    duplicates: List[Tuple[int, int]] = []
+    unique: List[int] = []
+    for i, crop in enumerate(crops):
+        if i in known:
+            if crop.content_hash:
+                first_by_hash.setdefault(crop.content_hash, i)
+            continue
+        first = first_by_hash.setdefault(crop.content_hash, i) if crop.content_hash else i
+        if first == i:
+            unique.append(i)
+        else:
+            duplicates.append((i, first))
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        futures = {
+            pool.submit(ocr_frame_crop, crops[i], api_key, scan_level, session, limiter, cache, reader): i
+            for i in unique
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="OCR"):
+            results[futures[future]] = future.result()
+    for i, first in duplicates:
+        results[i] = replace(results[first], frame_index=crops[i].frame_index, video_time_sec=crops[i].video_time_sec)
+    if cache is not None:
+        stats = cache.stats()
+        logger.info(
+            f"💾 Кэш OCR: {stats['hits']} попаданий, {stats['misses']} промахов "
+            f"(доля попаданий {stats['hit_rate']:.0%}), записей: {len(cache)}; "
+            f"повторов в скане: {len(duplicates)}"
+        )
+    # Ответы приходят в произвольном порядке - восстанавливаем порядок кадров
+    return sorted(results, key=lambda f: f.video_time_sec)
+
+def _continues(prev: FrameInfo, frame: FrameInfo) -> Optional[int]:
+    """Расхождение OCR-времени кадра с временем, продолженным от prev (в секундах)"""
+    if prev.ocr_seconds is None or frame.ocr_seconds is None:
+        return None
+    expected = (prev.ocr_seconds + int(round(frame.video_time_sec - prev.video_time_sec))) % (24 * 3600)
+    return time_diff_seconds(expected, frame.ocr_seconds)
+
+def refine_boundary(
+    video_path: str,
+    api_key: str,
+    frame_a: FrameInfo,
+    frame_b: FrameInfo,
+    precision_sec: float = REFINE_STEP_SEC,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    cache: Optional[OcrCache] = None,
+    reader: Optional[TimestampReader] = None,
+    keyframe_index: Optional[KeyframeIndex] = None,
+) -> Tuple[FrameInfo, FrameInfo, List[FrameInfo]]:
+    """
+    Уточняет границу сессий делением отрезка пополам.
+    frame_a - последний кадр грубого скана до скачка времени, frame_b - первый
+    после. Кадр в середине отрезка относится к той сессии, с временем которой
+    он согласуется лучше; деление продолжается, пока отрезок длиннее
+    precision_sec (0 - до соседних кадров), т.е. около log2(COARSE_STEP_SEC / precision_sec) чтений.
+    С индексом ключевых кадров берется самый дешевый кадр в средней половине
+    отрезка: сходимость остается логарифмической.
+    Возвращает последний кадр старой сессии, первый кадр новой и все прочитанные кадры.
+    """
+    cap = cv2.VideoCapture(video_path)
+    seeker = KeyframeSeeker(cap, keyframe_index) if keyframe_index is not None else None
+    lo, hi = frame_a, frame_b
+    probes: List[FrameInfo] = []
+    try:
+        while hi.video_time_sec - lo.video_time_sec > precision_sec:
+            span = hi.video_time_sec - lo.video_time_sec
+            crop = read_crop_at_time(cap, lo.video_time_sec + span / 2, seeker, span / 4)
+            if crop is None or not lo.video_time_sec < crop.video_time_sec < hi.video_time_sec:
+                break  # между lo и hi больше нет кадров
+            probe = ocr_frame_crop(crop, api_key, "refine", session, rate_limiter, cache, reader)
+            probes.append(probe)
+            err_a = _continues(lo, probe)
+            err_b = _continues(hi, probe)
+            if err_a is None or err_b is None:
+                break  # время не прочитано - оставляем достигнутую точность
+            if err_a <= err_b:
+                lo = probe
+            else:
+                hi = probe
+    finally:
+        cap.release()
+    return lo, hi, probes
+
+def refine_boundaries(
+    video_path: str,
+    api_key: str,
+    jumps: List[Tuple[FrameInfo, FrameInfo]],
+    precision_sec: float = REFINE_STEP_SEC,
+    max_concurrency: int = OCR_MAX_CONCURRENCY,
+    rate_limit_per_sec: float = OCR_RATE_LIMIT_PER_SEC,
+    reader: Optional[TimestampReader] = None,
+    keyframe_index: Optional[KeyframeIndex] = None,
+) -> List[Tuple[FrameInfo, FrameInfo, List[FrameInfo]]]:
+    """Уточняет все границы параллельно (у каждой границы свой VideoCapture)"""
+    if not jumps:
+        return []
+    session = get_http_session(max_concurrency)
+    limiter = TokenBucket(rate_limit_per_sec, OCR_RATE_BURST)
+    cache = get_ocr_cache()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(jumps)))) as pool:
+        futures = [
+            pool.submit(
+                refine_boundary, video_path, api_key, a, b, precision_sec, session, limiter, cache, reader,
+                keyframe_index,
+            )
+            for a, b in jumps
+        ]
+        return [f.result() for f in futures]
+
+def _templates_path(camera_id: Optional[str]) -> str:
+    name = re.sub(r"[^\w.-]", "_", camera_id or "default")
+    return os.path.join(OCR_TEMPLATES_DIR, f"{name}.npz")
+
+def prepare_timestamp_reader(
+    crops: List[FrameCrop],
+    api_key: str,
+    camera_id: Optional[str] = None,
+    max_concurrency: int = OCR_MAX_CONCURRENCY,
+    rate_limit_per_sec: float = OCR_RATE_LIMIT_PER_SEC,
+) -> Tuple[Optional[TimestampReader], Dict[int, FrameInfo]]:
+    """
+    Готовит локальный читатель даты/времени для видео.
+    OCR_BOOTSTRAP_FRAMES кадров, равномерно взятых по видео, распознаются
+    через VLM. По ним определяется камера (если camera_id не задан),
+    загружаются ее сохраненные шаблоны и дообучаются. Если сохраненные
+    шаблоны уверенно читают не то, что VLM, оверлей изменился - шаблоны
+    сбрасываются.
+    Возвращает читатель и распознанные кадры по индексу в crops, чтобы
+    грубый скан не отправлял их в VLM повторно.
+    """
+    if not OCR_TEMPLATES_DIR or not crops or OCR_BOOTSTRAP_FRAMES <= 0:
+        return None, {}
+    n = min(OCR_BOOTSTRAP_FRAMES, len(crops))
+    indices = sorted({round(i * (len(crops) - 1) / max(n - 1, 1)) for i in range(n)})
+    picks = [crops[i] for i in indices]
+    confirmed = ocr_crops_concurrently(
+        picks, api_key, "bootstrap", max_concurrency=max_concurrency, rate_limit_per_sec=rate_limit_per_sec,
+    )
+    if camera_id is None:
+        ids = Counter(f.camera_id for f in confirmed if f.camera_id)
+        camera_id = ids.most_common(1)[0][0] if ids else None
+
+    reader = load_reader(_templates_path(camera_id)) or TimestampReader(camera_id)
+    for crop, frame in zip(picks, confirmed):
+        if crop.image is None or not frame.ocr_date or not frame.ocr_time:
+            continue
+        local_date, local_time, _ = reader.read(crop.image)
+        if local_date is not None and (local_date, local_time) != (frame.ocr_date, frame.ocr_time):
+            logger.warning(f"⚠️ Шаблоны камеры {camera_id} не совпадают с VLM, обучаем заново")
+            reader.reset()
+        reader.learn(crop.image, frame.ocr_date, frame.ocr_time, frame.camera_id)
+    # кадры отсортированы по времени, как и crops; неудачные запросы скан повторит
+    return reader, {i: f for i, f in zip(indices, confirmed) if f.ocr_date and f.ocr_time}
+
+def process_video(
+    video_path: str,
+    max_concurrency: int = OCR_MAX_CONCURRENCY,
+    rate_limit_per_sec: float = OCR_RATE_LIMIT_PER_SEC,
+    camera_id: Optional[str] = None,
+    refine_precision_sec: Optional[float] = REFINE_STEP_SEC,
+    keyframe_index: Optional[KeyframeIndex] = None,
+) -> Tuple[List[FrameInfo], List[SessionInfo]]:
+    """
+    Основная функция обработки видео.
+    Сначала последовательно декодируются все кадры грубого сканирования,
+    затем дата/время читаются локально по шаблонам цифр камеры, а кадры с
+    низкой уверенностью отправляются в VLM параллельно (max_concurrency
+    потоков, не чаще rate_limit_per_sec запросов в секунду).
+    Границы сессий уточняются делением пополам до refine_precision_sec
+    (0 - до кадра, None - без уточнения, точность COARSE_STEP_SEC).
+    Кадры берутся по индексу ключевых кадров (keyframe_index или сайдкар
+    рядом с видео, при KEYFRAME_INDEX_ENABLED). При KEYFRAME_SNAP_SEC > 0
+    кадр грубого скана заменяется самым дешевым кадром в пределах
+    KEYFRAME_SNAP_SEC; в video_time_sec записывается время взятого кадра,
+    поэтому без уточнения границ (refine_precision_sec=None) начало и конец
+    сессий смещаются вместе с ним.
+    """
     api_key = load_api_key()
 
     cap = cv2.VideoCapture(video_path)
@@ -321,6 +738,14 @@ def process_video(video_path: str) -> Tuple[List[FrameInfo], List[SessionInfo]]:
 
     logger.info(f"📊 Анализ видео: {duration_sec:.2f} сек, {total_frames} кадров, {fps:.2f} FPS")
 
+    if keyframe_index is None and KEYFRAME_INDEX_ENABLED:
+        keyframe_index = load_or_build_index(video_path)
+    seeker = KeyframeSeeker(cap, keyframe_index) if keyframe_index is not None else None
+    if keyframe_index is not None:
+        logger.info(
+            f"🔑 Индекс ключевых кадров ({keyframe_index.source}): {len(keyframe_index.keyframes)} ключевых кадров"
+        )
+
     all_frames: List[FrameInfo] = []
     sessions: List[SessionInfo] = []
     coarse_frames: List[FrameInfo] = []
@@ -328,22 +753,37 @@ def process_video(video_path: str) -> Tuple[List[FrameInfo], List[SessionInfo]]:
     n_steps = int(math.floor(duration_sec / COARSE_STEP_SEC)) + 1
     logger.info(f"🔍 Сканирование каждые {COARSE_STEP_SEC} секунд ({n_steps} шагов)...")
     
-    for i in tqdm(range(n_steps), desc="Сканирование"):
+    # Декодирование в одном потоке: VideoCapture не потокобезопасен
+    crops: List[FrameCrop] = []
+    for i in tqdm(range(n_steps), desc="Декодирование"):
         time_sec = min(i * COARSE_STEP_SEC, duration_sec)
-        frame_info = analyze_frame_at_time(cap, api_key, time_sec, "10s", fps)
-        if frame_info is not None:
-            coarse_frames.append(frame_info)
-            all_frames.append(frame_info)
-        time.sleep(0.05)  # Пауза чтобы не перегружать API
+        crop = read_crop_at_time(cap, time_sec, seeker, KEYFRAME_SNAP_SEC)
+        if crop is not None:
+            crops.append(crop)
+    if seeker is not None:
+        stats = seeker.stats()
+        logger.info(f"⏩ Доступ к кадрам: {stats['seeks']} переходов, {stats['grabs']} кадров прочитано вперед")
+
+    reader, bootstrap = prepare_timestamp_reader(crops, api_key, camera_id, max_concurrency, rate_limit_per_sec)
+    coarse_frames = ocr_crops_concurrently(
+        crops, api_key, "10s", max_concurrency=max_concurrency, rate_limit_per_sec=rate_limit_per_sec,
+        reader=reader, known=bootstrap,
+    )
+    if reader is not None:
+        reader.save(_templates_path(reader.camera_id))
+        stats = reader.stats()
+        logger.info(
+            f"🔢 Локальное чтение времени: {stats['local_reads']} кадров локально, "
+            f"{stats['fallbacks']} через VLM (камера {stats['camera_id']}, известно цифр: {stats['digits_known']})"
+        )
+    all_frames.extend(coarse_frames)
 
     if not coarse_frames:
         cap.release()
         return all_frames, sessions
 
-    # Обнаружение сессий (упрощенная логика)
-    current_session_index = 1
-    current_start = coarse_frames[0]
-
+    # Обнаружение сессий: скачки времени между соседними кадрами грубого скана
+    jumps: List[Tuple[FrameInfo, FrameInfo]] = []
     for i in range(len(coarse_frames) - 1):
         frame_a = coarse_frames[i]
         frame_b = coarse_frames[i + 1]
@@ -351,18 +791,40 @@ def process_video(video_path: str) -> Tuple[List[FrameInfo], List[SessionInfo]]:
         diff = time_diff_seconds(frame_a.ocr_seconds, frame_b.ocr_seconds)
 
         if diff is not None and diff > JUMP_THRESHOLD_SEC:
-            # Конец сессии
-            sessions.append(SessionInfo(
-                session_index=current_session_index,
-                start_video_sec=current_start.video_time_sec,
-                end_video_sec=frame_a.video_time_sec,
-                start_ocr_date=current_start.ocr_date,
-                start_ocr_time=current_start.ocr_time,
-                end_ocr_date=frame_a.ocr_date,
-                end_ocr_time=frame_a.ocr_time,
-            ))
-            current_session_index += 1
-            current_start = frame_b
+            jumps.append((frame_a, frame_b))
+
+    # Уточнение границ: (последний кадр старой сессии, первый кадр новой)
+    if refine_precision_sec is not None and jumps:
+        refined = refine_boundaries(
+            video_path, api_key, jumps, refine_precision_sec, max_concurrency, rate_limit_per_sec, reader,
+            keyframe_index,
+        )
+        boundaries = [(lo, hi) for lo, hi, _ in refined]
+        all_frames.extend(probe for _, _, probes in refined for probe in probes)
+        all_frames.sort(key=lambda f: f.video_time_sec)
+        logger.info(
+            f"🎯 Уточнено границ: {len(boundaries)}, дополнительных чтений: "
+            f"{sum(len(probes) for _, _, probes in refined)}"
+        )
+    else:
+        boundaries = jumps
+
+    current_session_index = 1
+    current_start = coarse_frames[0]
+
+    for frame_a, frame_b in boundaries:
+        # Конец сессии
+        sessions.append(SessionInfo(
+            session_index=current_session_index,
+            start_video_sec=current_start.video_time_sec,
+            end_video_sec=frame_a.video_time_sec,
+            start_ocr_date=current_start.ocr_date,
+            start_ocr_time=current_start.ocr_time,
+            end_ocr_date=frame_a.ocr_date,
+            end_ocr_time=frame_a.ocr_time,
+        ))
+        current_session_index += 1
+        current_start = frame_b
 
     # Добавляем последнюю сессию
     last_frame = coarse_frames[-1]
@@ -419,9 +881,11 @@ def process_uploaded_video(s3_url: str, filename: str) -> dict:
         if not download_video_from_s3(s3_key, temp_path):
             return {"status": "error", "message": f"Ошибка скачивания видео: {s3_key}"}
         
+        keyframe_index = fetch_keyframe_index(s3_key, temp_path) if KEYFRAME_INDEX_ENABLED else None
+
         # Обрабатываем видео
         logger.info("🔍 Начинаем анализ видео...")
-        frames, sessions = process_video(temp_path)
+        frames, sessions = process_video(temp_path, keyframe_index=keyframe_index)
         
         # Сохраняем JSON результат
         json_filename = f"{os.path.splitext(filename)[0]}_result.json"
@@ -443,7 +907,7 @@ def process_uploaded_video(s3_url: str, filename: str) -> dict:
             logger.info(f"🎬 Вырезаем сессию {session.session_index}")
             
             if extract_session_video(temp_path, session_video_path, 
-                                   session.start_video_sec, session.end_video_sec):
+                                   session.start_video_sec, session.end_video_sec, keyframe_index):
                 
                 # ИСПРАВЛЕНО: Используем то же имя файла, но с расширением .mp4
                 original_name = os.path.splitext(filename)[0]  # Убираем оригинальное расширение
@@ -478,6 +942,7 @@ def process_uploaded_video(s3_url: str, filename: str) -> dict:
         try:
             os.remove(temp_path)
             os.remove(local_json_path)
+            os.remove(sidecar_path(temp_path))
         except OSError:
             pass
         
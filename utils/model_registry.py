@@ -0,0 +1,182 @@
+"""
+model_registry.py
+Process-wide cache of loaded detector models.
+
+Loading ``models/best.pt`` takes seconds and hundreds of megabytes, and the
+first inference after loading is much slower than the following ones while
+torch allocates buffers and picks kernels.  :func:`get_model` loads each
+weights file once per process, keyed by its real path, modification time
+and device, runs a warm-up inference, and hands the same resident model to
+every later caller: repeated :func:`utils.pipeline.run_pipeline` jobs, shard
+workers and batch workers.  Replacing the weights file on disk changes
+its mtime, so the next call loads the new weights.  :func:`get_onnx_detector`
+does the same for the ONNX Runtime backend.
+
+The device is chosen explicitly (CUDA when available, CPU otherwise) so the
+pipeline works on CPU-only nodes, and the torch CPU thread pool can be sized
+per process to avoid oversubscription when several workers share a host.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.detectors import OnnxDetector
+
+if TYPE_CHECKING:
+    from ultralytics import YOLO  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_REGISTRY: Dict[Tuple[str, float, str], object] = {}
+_LOCK = threading.Lock()
+
+
+def _import_torch():
+    # torch and ultralytics are imported on first use only: they take
+    # seconds to import and are not needed by the ONNX backend
+    try:
+        import torch  # type: ignore
+    except ImportError:
+        return None
+    return torch
+
+
+def select_device(device: Optional[str] = None) -> str:
+    """Return ``device`` if given, else ``'cuda:0'`` when available, else ``'cpu'``."""
+    if device:
+        return device
+    torch = _import_torch()
+    if torch is not None and torch.cuda.is_available():
+        return 'cuda:0'
+    return 'cpu'
+
+
+def set_cpu_threads(num_threads: Optional[int]) -> None:
+    """
+    Size the torch intra-op thread pool; ``None`` keeps the torch default.
+
+    Does nothing until torch has been imported by a torch-based backend.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None or not num_threads:
+        return
+    if torch.get_num_threads() != num_threads:
+        torch.set_num_threads(max(1, int(num_threads)))
+
+
+def _warm_up(model: "YOLO", imgsz: int) -> None:
+    torch = _import_torch()
+    frame = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    try:
+        with torch.no_grad():  # type: ignore
+            model(frame, verbose=False)
+    except Exception as e:
+        logger.warning('model warm-up failed: %s', e)
+
+
+def get_model(
+    weights_path: str,
+    device: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    warmup: bool = True,
+    warmup_imgsz: int = 640,
+) -> Optional["YOLO"]:
+    """
+    Return the resident YOLO model for ``weights_path``, loading it if needed.
+
+    Args:
+        weights_path: Path to the ultralytics weights file.
+        device: Device to run on; selected with :func:`select_device` when
+            ``None``.
+        num_threads: torch CPU thread count applied before loading (and on
+            every call, so each process keeps its own setting).
+        warmup: Run one inference on a blank frame right after loading.
+        warmup_imgsz: Side of the square blank frame used for warm-up.
+
+    Returns:
+        The model, or ``None`` if ultralytics/torch are not installed, the
+        weights file does not exist or loading fails.
+    """
+    try:
+        from ultralytics import YOLO  # type: ignore
+    except ImportError:
+        return None
+    if _import_torch() is None:
+        return None
+    set_cpu_threads(num_threads)
+    try:
+        real_path = os.path.realpath(weights_path)
+        mtime = os.path.getmtime(real_path)
+    except OSError:
+        return None
+    device = select_device(device)
+    key = (real_path, mtime, device)
+    with _LOCK:
+        model = _REGISTRY.get(key)
+        if model is not None:
+            return model
+        try:
+            model = YOLO(real_path, task='detect')  # type: ignore
+            # ultralytics merges ``overrides`` into every predict call
+            model.overrides['device'] = device
+        except Exception as e:
+            logger.error('failed to load model %s: %s', real_path, e)
+            return None
+        if warmup:
+            _warm_up(model, warmup_imgsz)
+        # drop models loaded from older versions of the same file
+        for old in [k for k in _REGISTRY if k[0] == real_path and k[2] == device]:
+            del _REGISTRY[old]
+        _REGISTRY[key] = model
+        logger.info('loaded model %s on %s', real_path, device)
+        return model
+
+
+def get_onnx_detector(
+    onnx_path: str,
+    num_threads: Optional[int] = None,
+    imgsz: int = 640,
+    warmup: bool = True,
+) -> Optional[OnnxDetector]:
+    """
+    Return the resident :class:`OnnxDetector` for ``onnx_path``.
+
+    Sessions are cached like :func:`get_model`, keyed by path, mtime and
+    thread count.  Returns ``None`` if onnxruntime is not installed or the
+    file cannot be loaded.
+    """
+    try:
+        real_path = os.path.realpath(onnx_path)
+        mtime = os.path.getmtime(real_path)
+    except OSError:
+        return None
+    key = (real_path, mtime, f'onnx-cpu-{num_threads or 0}')
+    with _LOCK:
+        detector = _REGISTRY.get(key)
+        if detector is not None:
+            return detector  # type: ignore[return-value]
+        try:
+            detector = OnnxDetector(real_path, imgsz=imgsz, num_threads=num_threads)
+        except Exception as e:
+            logger.error('failed to load ONNX model %s: %s', real_path, e)
+            return None
+        if warmup:
+            detector.detect([np.zeros((imgsz, imgsz, 3), dtype=np.uint8)])
+        for old in [k for k in _REGISTRY if k[0] == real_path and k[2] == key[2]]:
+            del _REGISTRY[old]
+        _REGISTRY[key] = detector
+        logger.info('loaded ONNX model %s', real_path)
+        return detector
+
+
+def clear_registry() -> None:
+    """Forget all resident models, e.g. to free memory."""
+    with _LOCK:
+        _REGISTRY.clear()
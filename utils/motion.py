@@ -0,0 +1,130 @@
+"""
+motion.py
+Cheap motion gate placed in front of the detector.
+
+Platform cameras spend long stretches looking at an empty, unchanging scene,
+yet the pipeline used to run the detector on every sampled frame.
+:class:`MotionGate` compares a heavily downscaled grayscale copy of each
+sampled frame with the last frame that was actually sent to the detector.
+When the fraction of changed pixels stays below a threshold the frame is
+declared static: the caller skips inference and carries the previous
+detections forward, so tracks stay alive without a model call.
+
+The gate also chooses the sampling interval: while there is motion or
+people are being tracked it asks for ``active_interval_sec`` (denser
+sampling gives the tracker smaller displacements to associate), otherwise
+for the pipeline's base ``interval_sec``.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+MOTION_SIZE = (160, 90)  # (width, height) of the comparison thumbnails
+PIXEL_DIFF_THRESH = 20  # grey levels for a thumbnail pixel to count as changed
+CHANGED_FRACTION_THRESH = 0.001  # fraction of changed pixels that means motion
+MAX_SKIP_SEC = 10.0  # run the detector at least this often even on a static scene
+
+
+class MotionGate:
+    """Decide per sampled frame whether the detector needs to run.
+
+    Args:
+        interval_sec: Sampling interval used for a quiet scene.
+        active_interval_sec: Sampling interval used while there is motion or
+            active person tracks.  Should divide ``interval_sec`` so every
+            sample stays on the base sampling grid.
+        pixel_diff_thresh: Grey-level difference for a thumbnail pixel to
+            count as changed.
+        changed_fraction_thresh: Fraction of changed pixels above which the
+            frame is considered to contain motion.
+        max_skip_sec: Longest time inference may be skipped; guards against
+            gradual changes (lighting, slow objects) that stay under the
+            threshold frame to frame.
+        size: ``(width, height)`` of the comparison thumbnails.
+
+    Attributes:
+        frames_seen: Sampled frames passed to :meth:`needs_inference`.
+        frames_skipped: Frames declared static.
+    """
+
+    def __init__(
+        self,
+        interval_sec: float = 1.0,
+        active_interval_sec: float = 0.5,
+        pixel_diff_thresh: int = PIXEL_DIFF_THRESH,
+        changed_fraction_thresh: float = CHANGED_FRACTION_THRESH,
+        max_skip_sec: float = MAX_SKIP_SEC,
+        size: tuple = MOTION_SIZE,
+    ) -> None:
+        self.interval_sec = interval_sec
+        self.active_interval_sec = min(active_interval_sec, interval_sec)
+        self.pixel_diff_thresh = pixel_diff_thresh
+        self.changed_fraction_thresh = changed_fraction_thresh
+        self.max_skip_sec = max_skip_sec
+        self.size = size
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.moving = False
+        self._first_sec: Optional[float] = None
+        self._last_sec: Optional[float] = None
+        # thumbnail and time of the last frame sent to the detector
+        self._reference: Optional[np.ndarray] = None
+        self._reference_sec = 0.0
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        # area interpolation averages out sensor and compression noise
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+
+    def needs_inference(self, time_sec: float, frame: np.ndarray) -> bool:
+        """Return ``False`` if ``frame`` is unchanged since the last inferred frame."""
+        self.frames_seen += 1
+        if self._first_sec is None:
+            self._first_sec = time_sec
+        self._last_sec = time_sec
+        thumb = self._thumbnail(frame)
+        if self._reference is not None and time_sec - self._reference_sec < self.max_skip_sec:
+            diff = cv2.absdiff(thumb, self._reference)
+            changed = np.count_nonzero(diff > self.pixel_diff_thresh) / diff.size
+            self.moving = changed > self.changed_fraction_thresh
+            if not self.moving:
+                self.frames_skipped += 1
+                return False
+        self._reference = thumb
+        self._reference_sec = time_sec
+        return True
+
+    def next_interval(self, active_people: int) -> float:
+        """Sampling interval to use after the current frame."""
+        return self.active_interval_sec if self.moving or active_people else self.interval_sec
+
+    def settings(self) -> dict:
+        """Configuration of the gate, e.g. for cache keys."""
+        return {
+            'interval_sec': self.interval_sec,
+            'active_interval_sec': self.active_interval_sec,
+            'pixel_diff_thresh': self.pixel_diff_thresh,
+            'changed_fraction_thresh': self.changed_fraction_thresh,
+            'max_skip_sec': self.max_skip_sec,
+            'size': list(self.size),
+        }
+
+    def stats(self) -> dict:
+        """Skipped frames and the effective inference rate of the run so far."""
+        inferred = self.frames_seen - self.frames_skipped
+        span = (self._last_sec or 0.0) - (self._first_sec or 0.0)
+        return {
+            'frames_sampled': self.frames_seen,
+            'frames_inferred': inferred,
+            'frames_skipped': self.frames_skipped,
+            'skipped_ratio': round(self.frames_skipped / self.frames_seen, 3) if self.frames_seen else 0.0,
+            'inference_fps': round(inferred / span, 3) if span > 0 else float(inferred),
+        }
@@ -0,0 +1,143 @@
+"""
+ocr_cache.py
+Persistent cache of timestamp-overlay OCR results.
+
+The coarse scan in :mod:`utils.main_processor` sends a crop of the
+burned-in date/time overlay of every sampled frame to a remote vision
+model.  Many of those crops have been read before: a frozen stream repeats
+the same frame, and re-uploading or re-processing a video produces exactly
+the same crops.  :class:`OcrCache` remembers the parsed
+``date``/``time``/``camera_id`` of every crop under a perceptual hash of
+the crop, so such frames are answered locally.
+
+The key is a difference hash (:func:`crop_dhash`) of the grayscale crop
+resized to a fixed grid fine enough to tell digits apart.  Each cell stores
+whether brightness rises, falls or stays within ``DHASH_DEAD_ZONE`` of its
+right neighbour; the dead zone and the downscaling make JPEG noise and
+small encoder differences hash the same while any changed digit changes
+the key.  Lookups are exact, so a hit costs one indexed SQLite query.
+
+Entries live in a SQLite file and the least recently used ones are evicted
+beyond ``max_entries``.  Hits and misses are counted per instance.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+DHASH_SIZE = (128, 32)  # (width, height) of the difference grid
+DHASH_DEAD_ZONE = 8  # brightness steps smaller than this count as flat
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'smart_camera', 'ocr_cache.sqlite3')
+
+OCR_FIELDS = ('date', 'time', 'camera_id')
+
+
+def crop_dhash(image: np.ndarray) -> str:
+    """
+    Perceptual hash of an overlay crop (BGR or grayscale) as a hex string.
+
+    The crop is converted to grayscale and resized to ``DHASH_SIZE`` plus
+    one column; every cell is compared with its right neighbour and
+    classified as brighter, darker or equal within ``DHASH_DEAD_ZONE``.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    w, h = DHASH_SIZE
+    small = cv2.resize(gray, (w + 1, h), interpolation=cv2.INTER_AREA).astype(np.int16)
+    diff = small[:, 1:] - small[:, :-1]
+    ternary = np.sign(diff) * (np.abs(diff) >= DHASH_DEAD_ZONE)
+    # two bits per cell: rising, falling
+    bits = np.concatenate([(ternary > 0).ravel(), (ternary < 0).ravel()])
+    return hashlib.sha1(np.packbits(bits).tobytes()).hexdigest()
+
+
+class OcrCache:
+    """SQLite-backed LRU cache of parsed overlay OCR results.
+
+    Safe to use from several threads of one process.
+
+    Args:
+        path: SQLite file; created with its directory if missing.
+        max_entries: Entries kept before the least recently used are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS ocr ('
+            'key TEXT PRIMARY KEY, date TEXT, time TEXT, camera_id TEXT, last_used REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr (last_used)')
+        self._inserts = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached ``{'date', 'time', 'camera_id'}`` of ``key`` and mark it used."""
+        with self._lock:
+            row = self._db.execute('SELECT date, time, camera_id FROM ocr WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE ocr SET last_used = ? WHERE key = ?', (time.time(), key))
+        return dict(zip(OCR_FIELDS, row))
+
+    def put(self, key: str, parsed: dict) -> None:
+        """Store the OCR fields of ``parsed`` under ``key``."""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO ocr (key, date, time, camera_id, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, *(parsed.get(f) for f in OCR_FIELDS), time.time()),
+            )
+            self._inserts += 1
+            # checking the size on every insert would double the write cost
+            if self._inserts % 100 == 1:
+                self._evict()
+
+    def _evict(self) -> None:
+        (count,) = self._db.execute('SELECT COUNT(*) FROM ocr').fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                'DELETE FROM ocr WHERE key IN (SELECT key FROM ocr ORDER BY last_used LIMIT ?)',
+                (count - self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM ocr').fetchone()[0]
+
+    def stats(self) -> dict:
+        """Hits, misses and hit rate of this instance."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._db.close()
@@ -0,0 +1,270 @@
+"""
+ocr_local.py
+Local reader for the burned-in ``YYYY-MM-DD HH:MM:SS`` timestamp overlay.
+
+The overlay of a camera is a fixed-font digit string at a fixed place, so
+after a few frames have been read by the remote vision model it can be read
+locally.  :class:`TimestampReader` learns from VLM-confirmed crops:
+
+* the layout: the text row and the column range of each of the 18 visible
+  characters, found by thresholding the crop (Otsu, both polarities) and
+  splitting the text row at empty columns;
+* one template per digit: the mean of the normalised cells in which the
+  confirmed text has that digit.
+
+Local reads start only once all ten digits have a template: a cell showing
+a digit that was never learned would otherwise be scored only against the
+known ones, and a similar glyph (8 against 0, 6 or 9; 1 against 7) could
+pass the checks below and give a wrong timestamp.  The seconds field runs
+through every digit within a minute of footage, so this costs a few VLM
+calls per camera.
+
+Reading cuts the 14 digit cells of a new crop at the learned positions
+(allowing a few pixels of horizontal jitter), normalises them and scores all
+of them against all templates with one matrix product, i.e. the normalised
+cross-correlation of every cell with every digit.  The result is trusted
+only if every cell matches its best digit with at least ``MIN_SCORE`` and
+beats the runner-up by ``MIN_MARGIN`` and the string is a valid date and
+time; otherwise the caller falls back to the remote model, whose answer is
+learned in turn.
+
+Readers are stored per camera as ``.npz`` files, see :func:`load_reader` and
+:meth:`TimestampReader.save`.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+TIMESTAMP_PATTERN = 'dddd-dd-dd dd:dd:dd'  # 'd' marks a digit
+TEMPLATE_SIZE = (12, 20)  # (width, height) cells are resized to
+JITTER_PX = 2  # horizontal search around each learned cell position
+MIN_SCORE = 0.80  # normalised correlation of every cell with its digit
+MIN_MARGIN = 0.05  # lead of the best digit over the second best
+MIN_BAND_HEIGHT = 6  # text rows shorter than this are noise
+
+# visible characters of the pattern (the space has no glyph) and the
+# positions of the digits among them
+_GLYPHS = TIMESTAMP_PATTERN.replace(' ', '')
+_DIGIT_SLOTS = [i for i, c in enumerate(_GLYPHS) if c == 'd']
+
+
+def _as_gray(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def _normalise(cells: np.ndarray) -> np.ndarray:
+    """Zero-mean, unit-norm rows; flat cells become zero vectors."""
+    cells = cells - cells.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(cells, axis=1, keepdims=True)
+    return cells / np.maximum(norms, 1e-6)
+
+
+def _cell_vectors(band: np.ndarray, spans: List[Tuple[int, int]]) -> np.ndarray:
+    w, h = TEMPLATE_SIZE
+    out = np.empty((len(spans), w * h), dtype=np.float32)
+    for k, (x0, x1) in enumerate(spans):
+        out[k] = cv2.resize(band[:, x0:x1], (w, h), interpolation=cv2.INTER_AREA).ravel()
+    return _normalise(out)
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """``[start, end)`` of the runs of ``True`` in a 1-D mask."""
+    padded = np.concatenate([[False], mask, [False]]).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _find_layout(gray: np.ndarray) -> Optional[Tuple[int, int, List[Tuple[int, int]]]]:
+    """Locate the text row and the column span of each visible character."""
+    _, bright = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    for fg in (bright.astype(bool), ~bright.astype(bool)):
+        for y0, y1 in _runs(fg.any(axis=1)):
+            if y1 - y0 < MIN_BAND_HEIGHT:
+                continue
+            spans = _runs(fg[y0:y1].any(axis=0))
+            if len(spans) == len(_GLYPHS):
+                return y0, y1, spans
+    return None
+
+
+def _valid_timestamp(text: str) -> bool:
+    try:
+        datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return False
+    return True
+
+
+class TimestampReader:
+    """Per-camera digit templates and overlay layout.
+
+    Safe to use from several threads: reads take a snapshot of the
+    templates, learning is serialised.
+
+    Args:
+        camera_id: Camera the overlay belongs to, reported with local reads.
+    """
+
+    def __init__(self, camera_id: Optional[str] = None) -> None:
+        self.camera_id = camera_id
+        w, h = TEMPLATE_SIZE
+        self.sums = np.zeros((10, w * h), dtype=np.float64)
+        self.counts = np.zeros(10, dtype=np.int64)
+        self.band: Optional[Tuple[int, int]] = None
+        self.spans: Optional[List[Tuple[int, int]]] = None
+        self.local_reads = 0
+        self.fallbacks = 0
+        self.learned = 0
+        self._lock = threading.Lock()
+        self._templates: Optional[np.ndarray] = None
+
+    # ---- learning ----
+
+    def learn(self, image: np.ndarray, date: Optional[str], time: Optional[str], camera_id: Optional[str] = None) -> bool:
+        """
+        Learn the layout and digit templates from a crop read by the VLM.
+
+        Returns ``False`` (and learns nothing) when the text is not a valid
+        timestamp or its characters cannot be separated in the crop.
+        """
+        text = f'{date} {time}'
+        if not date or not time or not _valid_timestamp(text):
+            return False
+        gray = _as_gray(image)
+        layout = _find_layout(gray)
+        if layout is None:
+            return False
+        y0, y1, spans = layout
+        digits = [int(c) for c in text if c.isdigit()]
+        cells = _cell_vectors(gray[y0:y1], [spans[i] for i in _DIGIT_SLOTS])
+        with self._lock:
+            self.band, self.spans = (y0, y1), spans
+            np.add.at(self.sums, digits, cells)
+            np.add.at(self.counts, digits, 1)
+            if camera_id:
+                self.camera_id = camera_id
+            self.learned += 1
+            self._templates = None
+        return True
+
+    def reset(self) -> None:
+        """Forget the layout and templates, e.g. after the overlay changed."""
+        with self._lock:
+            self.sums[:] = 0
+            self.counts[:] = 0
+            self.band = self.spans = None
+            self._templates = None
+
+    def _snapshot(self) -> Optional[Tuple[np.ndarray, Tuple[int, int], List[Tuple[int, int]]]]:
+        with self._lock:
+            # every cell must be compared against every digit
+            if self.band is None or not self.counts.all():
+                return None
+            if self._templates is None:
+                self._templates = _normalise((self.sums / self.counts[:, None]).astype(np.float32))
+            return self._templates, self.band, list(self.spans)  # type: ignore[arg-type]
+
+    # ---- reading ----
+
+    def read(self, image: np.ndarray) -> Tuple[Optional[str], Optional[str], float]:
+        """
+        Read the timestamp of a crop.
+
+        Returns:
+            ``(date, time, confidence)``; ``date`` and ``time`` are ``None``
+            until all ten digits are learned and unless the read passes the
+            confidence checks.  ``confidence`` is
+            the lowest best-digit score over all cells.
+        """
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return None, None, 0.0
+        templates, (y0, y1), spans = snapshot
+        gray = _as_gray(image)
+        if gray.shape[0] < y1 or gray.shape[1] < spans[-1][1]:
+            return None, None, 0.0
+        band = gray[y0:y1]
+        shifts = range(-JITTER_PX, JITTER_PX + 1)
+        width = band.shape[1]
+        windows = []
+        for slot in _DIGIT_SLOTS:
+            x0, x1 = spans[slot]
+            for s in shifts:
+                a = min(max(0, x0 + s), width - (x1 - x0))
+                windows.append((a, a + x1 - x0))
+        scores = _cell_vectors(band, windows) @ templates.T
+        # best shift per cell, then the two best digits per cell
+        scores = scores.reshape(len(_DIGIT_SLOTS), len(shifts), 10).max(axis=1)
+        order = np.argsort(-scores, axis=1)
+        rows = np.arange(len(_DIGIT_SLOTS))
+        best = scores[rows, order[:, 0]]
+        second = scores[rows, order[:, 1]]
+        confidence = float(best.min())
+        digits = iter(order[:, 0].tolist())
+        text = ''.join(str(next(digits)) if c == 'd' else c for c in TIMESTAMP_PATTERN)
+        if confidence < MIN_SCORE or float((best - second).min()) < MIN_MARGIN or not _valid_timestamp(text):
+            return None, None, confidence
+        date, time = text.split(' ')
+        return date, time, confidence
+
+    def record(self, local: bool) -> None:
+        """Count a read answered locally or by the fallback."""
+        with self._lock:
+            if local:
+                self.local_reads += 1
+            else:
+                self.fallbacks += 1
+
+    def stats(self) -> dict:
+        total = self.local_reads + self.fallbacks
+        return {
+            'camera_id': self.camera_id,
+            'local_reads': self.local_reads,
+            'fallbacks': self.fallbacks,
+            'local_ratio': round(self.local_reads / total, 4) if total else 0.0,
+            'learned_frames': self.learned,
+            'digits_known': int((self.counts > 0).sum()),
+        }
+
+    # ---- persistence ----
+
+    def save(self, path: str) -> None:
+        """Write the templates and layout to an ``.npz`` file."""
+        with self._lock:
+            if self.band is None:
+                return
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.part.npz'
+            np.savez(
+                tmp, sums=self.sums, counts=self.counts, band=np.asarray(self.band),
+                spans=np.asarray(self.spans), camera_id=np.asarray(self.camera_id or ''),
+            )
+            os.replace(tmp, path)
+
+
+def load_reader(path: str) -> Optional[TimestampReader]:
+    """Load a reader saved with :meth:`TimestampReader.save`, or ``None``."""
+    try:
+        with np.load(path) as data:
+            reader = TimestampReader(str(data['camera_id']) or None)
+            if data['sums'].shape != reader.sums.shape:
+                return None  # saved with another TEMPLATE_SIZE
+            reader.sums = data['sums'].astype(np.float64)
+            reader.counts = data['counts'].astype(np.int64)
+            reader.band = tuple(int(v) for v in data['band'])  # type: ignore[assignment]
+            reader.spans = [(int(a), int(b)) for a, b in data['spans']]
+    except (OSError, KeyError, ValueError):
+        return None
+    return reader
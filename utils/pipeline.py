@@ -15,43 +15,76 @@ The main entry point is :func:`run_pipeline`.  It accepts a path to a video
 file, a YOLO model instance (or ``None`` to force lazy loading), the start
 time of the video fragment as an ISO string, a link to the original video in
 object storage, a unique identifier for the video fragment and an optional
-list of train numbers with timestamps.  It returns paths to two JSON files:
-one for people events and one for train events.  Each JSON file contains an
-array of dictionaries describing the detected entities.  When no events are
-detected, the arrays are empty.
-
-This implementation uses the ultralytics YOLOv8 API for detection.  If the
-requested weights file is not available on the host machine, the model will
-not be loaded and the pipeline will return empty outputs.  The detection
-pipeline samples one frame per second to balance performance and latency.  A
-simple IOU‑based tracker maintains consistent IDs across frames.  Person
-status is estimated by comparing the speed of movement between subsequent
-frames; train status is derived from the duration of observation.  Zones are
-not estimated in this simplified version and are always set to ``None``.
+list of train numbers with timestamps (matched to train tracks by
+:mod:`utils.train_numbers`).  It returns paths to two JSON files: one for
+people events and one for train events.  Each JSON file contains an
+array of dictionaries describing the detected entities.  Person events are
+intervals: consecutive observations of the same person with the same status
+and zone are merged into one record.  When no events are detected, the
+arrays are empty.
+
+Detection goes through a pluggable backend (:mod:`utils.detectors`): the
+ultralytics YOLOv8 API by default, or the same model exported to ONNX and run
+with ONNX Runtime on CPU.  If the requested weights file is not available on
+the host machine, the model will not be loaded and the pipeline will return
+empty outputs.  The detection pipeline samples one frame per second, by
+presentation timestamp, to balance performance and latency; frames in
+between are grabbed but not decoded.  A simple IOU‑based tracker maintains
+consistent IDs across frames.  Person status is estimated by comparing the
+speed of movement between subsequent frames; train status (arriving,
+stopped, departing) and stop intervals come from an online per-track state
+machine.  Zones are taken from the zone polygons of the camera
+configuration, looked up at the foot point of each person box, and are
+``None`` without a configuration.
+
+Long recordings can be processed in parallel: with ``workers > 1`` the video
+is cut into time shards tracked in separate processes, and track ids are
+stitched across shard boundaries using the overlapping warm-up windows.
+Detections can be persisted in a :mod:`utils.detection_cache` so that
+re-running with different tracker settings skips decoding and inference.
+
+:func:`run_stream` runs the same detection and tracking continuously on a
+live source (RTSP URL, a recording that is still being written or any
+iterator of frames) and delivers events through a callback or a queue as
+soon as they are final, with a bounded delay.
 """
 
 from __future__ import annotations
 
 import json
+import logging
+from array import array
+import math
 import os
-from datetime import datetime, timedelta
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple
-import ultralytics
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
 try:
     import cv2  # type: ignore
 except ImportError:
     cv2 = None
 
 try:
-    import torch  # type: ignore
+    from scipy.optimize import linear_sum_assignment  # type: ignore
 except ImportError:
-    torch = None
+    linear_sum_assignment = None
 
-try:
-    from ultralytics import YOLO  # type: ignore
-except ImportError:
-    YOLO = None  # type: ignore
+from utils.events import JsonLinesWriter, PersonEventCompactor, format_event_dt, merge_person_intervals
+from utils.frame_source import GrowingFileReader, RealTimeReplay, SampledFrameReader, ThreadedFrameSource
+from utils.camera_config import CameraConfig, RoiDetector
+from utils.detection_cache import CachedFrames, DetectionCache
+from utils.detectors import Detections, Detector, UltralyticsDetector, as_detector, default_settings
+from utils.model_registry import get_model, get_onnx_detector, set_cpu_threads
+from utils.motion import MotionGate
+from utils.profiler import NULL_PROFILER, NullProfiler, Profiler
+from utils.train_numbers import TrainNumberIndex, as_train_number_index
+from utils.zones import ZONE_MAP_SIZE, ZoneMap, get_zone_map
+
+logger = logging.getLogger(__name__)
 
 
 ##############################
@@ -81,13 +114,67 @@ def iou_bbox(a: Tuple[float, float, float, float], b: Tuple[float, float, float,
     return inter / union
 
 
+HISTORY_SIZE = 64  # observations kept per track for status estimation
+
+
+class TrackHistory:
+    """Fixed-capacity ring buffer of ``(time_sec, bbox)`` observations.
+
+    Entries are stored as five doubles per row in a flat ``array('d')``
+    instead of nested Python tuples, so a track costs the same memory after
+    ten seconds or ten hours.  Once full, the oldest entries are dropped.
+    Iteration yields entries oldest first; negative indices work as for a
+    list.
+    """
+
+    __slots__ = ('_buf', '_capacity', '_start', '_len')
+
+    def __init__(self, capacity: int = HISTORY_SIZE) -> None:
+        self._capacity = max(1, int(capacity))
+        self._buf = array('d', bytes(8 * 5 * self._capacity))
+        self._start = 0
+        self._len = 0
+
+    def append(self, entry: Tuple[float, Tuple[float, float, float, float]]) -> None:
+        t, (x, y, w, h) = entry
+        if self._len < self._capacity:
+            row = (self._start + self._len) % self._capacity
+            self._len += 1
+        else:
+            row = self._start
+            self._start = (self._start + 1) % self._capacity
+        self._buf[row * 5:row * 5 + 5] = array('d', (t, x, y, w, h))
+
+    def _row(self, i: int) -> Tuple[float, Tuple[float, float, float, float]]:
+        j = ((self._start + i) % self._capacity) * 5
+        b = self._buf
+        return b[j], (b[j + 1], b[j + 2], b[j + 3], b[j + 4])
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> Tuple[float, Tuple[float, float, float, float]]:
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('history index out of range')
+        return self._row(i)
+
+    def __iter__(self) -> Iterator[Tuple[float, Tuple[float, float, float, float]]]:
+        for i in range(self._len):
+            yield self._row(i)
+
+
 class SimpleTrack:
     """Represents a single object track.
 
     Tracks maintain the last bounding box, the timestamps when the object was
-    observed, and accumulate a history of observations used to infer events.
+    observed, and keep a bounded history of recent observations used to infer
+    events.
     """
 
+    __slots__ = ('id', 'kind', 'last_bbox', 'last_time', 'start_time', 'lost', 'lost_since', 'history', 'state')
+
     def __init__(self, tid: int, kind: str, bbox: Tuple[float, float, float, float], time_sec: float) -> None:
         self.id = tid
         self.kind = kind  # 'person' or 'train'
@@ -96,8 +183,10 @@ class SimpleTrack:
         self.start_time = time_sec
         self.lost = False
         self.lost_since: Optional[float] = None
-        # history entries: (time_sec, bbox)
-        self.history: List[Tuple[float, Tuple[float, float, float, float]]] = []
+        # most recent observations: (time_sec, bbox)
+        self.history = TrackHistory()
+        # online status of train tracks (a TrainStateMachine), None for people
+        self.state: Optional[TrainStateMachine] = None
 
     def update(self, bbox: Tuple[float, float, float, float], time_sec: float) -> None:
         self.last_bbox = bbox
@@ -110,16 +199,104 @@ class SimpleTrack:
         self.lost_since = time_sec
 
 
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Compute pairwise IoU between two sets of bounding boxes.
+
+    This is the vectorised counterpart of :func:`iou_bbox` used by the tracker
+    so that association costs a single NumPy broadcast instead of a Python
+    double loop.
+
+    Args:
+        a: Array of shape ``(N, 4)`` with boxes (x, y, w, h).
+        b: Array of shape ``(M, 4)`` with boxes (x, y, w, h).
+
+    Returns:
+        Array of shape ``(N, M)`` with IoU values between 0 and 1.
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+    iw = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0.0, None)
+    ih = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0.0, None)
+    inter = iw * ih
+    union = (a[:, 2:3] * a[:, 3:4]) + (b[:, 2] * b[:, 3]) - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+
+def _assign(iou: np.ndarray, iou_thresh: float) -> List[Tuple[int, int]]:
+    """Solve the detection/track assignment for an IoU matrix.
+
+    Uses the Hungarian algorithm from SciPy when available and falls back to
+    a vectorised greedy matching (highest IoU first) otherwise.  Pairs whose
+    IoU is below ``iou_thresh`` are masked out before solving, so they can
+    never displace a valid match, and are never returned.
+
+    Returns:
+        List of ``(row, col)`` index pairs.
+    """
+    if iou.size == 0:
+        return []
+    if linear_sum_assignment is not None:
+        gated = np.where(iou >= iou_thresh, iou, 0.0)
+        rows, cols = linear_sum_assignment(gated, maximize=True)
+        return [(int(r), int(c)) for r, c in zip(rows, cols) if iou[r, c] >= iou_thresh]
+    pairs: List[Tuple[int, int]] = []
+    order = np.argsort(-iou, axis=None, kind='stable')
+    used_rows: set[int] = set()
+    used_cols: set[int] = set()
+    for flat in order:
+        r, c = divmod(int(flat), iou.shape[1])
+        if iou[r, c] < iou_thresh:
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        pairs.append((r, c))
+    return pairs
+
+
 class SimpleTrackerManager:
-    """Manages multiple tracks using IoU association."""
+    """Manages multiple tracks using IoU association.
 
-    def __init__(self, iou_thresh: float = 0.3, max_lost_sec: float = 5.0) -> None:
+    Detections are matched only against active (not lost) tracks of the same
+    kind.  The full detection×track IoU matrix is computed in one NumPy
+    operation and the assignment is solved optimally, so the per-frame cost
+    does not depend on the number of lost tracks or tracks of other kinds.
+
+    Tracks not updated for more than ``max_lost_sec`` are marked lost,
+    removed from :attr:`tracks` and handed to ``on_retire`` so the caller can
+    finalise their events.  Memory therefore depends on the number of
+    objects in view, not on the length of the video.
+    """
+
+    def __init__(
+        self,
+        iou_thresh: float = 0.3,
+        max_lost_sec: float = 5.0,
+        on_retire: Optional[Callable[[SimpleTrack], None]] = None,
+    ) -> None:
         self.iou_thresh = iou_thresh
         self.max_lost_sec = max_lost_sec
+        self.on_retire = on_retire
         self.next_id = 1
+        # live tracks only; retired tracks are passed to ``on_retire``
         self.tracks: dict[int, SimpleTrack] = {}
+        # active (not lost) tracks grouped by kind, in creation order
+        self._active: dict[str, dict[int, SimpleTrack]] = {}
+
+    def active_tracks(self, kind: Optional[str] = None) -> List[SimpleTrack]:
+        """Return the active tracks, optionally restricted to one kind."""
+        if kind is not None:
+            return list(self._active.get(kind, {}).values())
+        return [t for group in self._active.values() for t in group.values()]
 
-    def step(self, detections: List[Tuple[float, float, float, float]], kind: str, frame_time: float) -> None:
+    def step(
+        self, detections: List[Tuple[float, float, float, float]], kind: str, frame_time: float,
+    ) -> List[SimpleTrack]:
         """
         Update tracks with detections for a given kind ('person' or 'train').
 
@@ -127,34 +304,53 @@ class SimpleTrackerManager:
             detections: A list of bounding boxes.
             kind: Type of detection.
             frame_time: Timestamp of current frame in seconds.
+
+        Returns:
+            Tracks of this kind updated or created at ``frame_time``, ordered
+            by track id.
         """
-        assigned: set[int] = set()
-        # first try to assign existing tracks by IoU
-        for bbox in detections:
-            best_tid = None
-            best_iou = 0.0
-            for tid, track in self.tracks.items():
-                if track.kind != kind:
-                    continue
-                iou = iou_bbox(track.last_bbox, bbox)
-                if iou >= self.iou_thresh and iou > best_iou and tid not in assigned:
-                    best_tid = tid
-                    best_iou = iou
-            if best_tid is not None:
-                track = self.tracks[best_tid]
-                track.update(bbox, frame_time)
-                assigned.add(best_tid)
-            else:
-                tid = self.next_id
-                self.next_id += 1
-                self.tracks[tid] = SimpleTrack(tid, kind, bbox, frame_time)
-                assigned.add(tid)
+        active = self._active.setdefault(kind, {})
+        candidates = list(active.values())
+        updated: List[SimpleTrack] = []
+        matched_dets: set[int] = set()
+        if detections and candidates:
+            iou = iou_matrix(
+                np.asarray(detections, dtype=np.float64),
+                np.asarray([t.last_bbox for t in candidates], dtype=np.float64),
+            )
+            for det_idx, trk_idx in _assign(iou, self.iou_thresh):
+                track = candidates[trk_idx]
+                track.update(detections[det_idx], frame_time)
+                matched_dets.add(det_idx)
+                updated.append(track)
+        for det_idx, bbox in enumerate(detections):
+            if det_idx in matched_dets:
+                continue
+            tid = self.next_id
+            self.next_id += 1
+            track = SimpleTrack(tid, kind, bbox, frame_time)
+            self.tracks[tid] = track
+            active[tid] = track
+            updated.append(track)
 
-        # mark tracks as lost when not updated for too long
-        for tid, track in list(self.tracks.items()):
+        # retire tracks that have not been updated for too long
+        for tid, track in list(active.items()):
             if track.last_time < frame_time and (frame_time - track.last_time) > self.max_lost_sec:
-                if not track.lost:
-                    track.mark_lost(frame_time)
+                track.mark_lost(frame_time)
+                self._retire(track)
+        updated.sort(key=lambda t: t.id)
+        return updated
+
+    def _retire(self, track: SimpleTrack) -> None:
+        self._active.get(track.kind, {}).pop(track.id, None)
+        self.tracks.pop(track.id, None)
+        if self.on_retire is not None:
+            self.on_retire(track)
+
+    def finalize_all(self) -> None:
+        """Retire every remaining track, e.g. at the end of a video."""
+        for track in sorted(self.tracks.values(), key=lambda t: t.id):
+            self._retire(track)
 
 
 ##############################
@@ -163,8 +359,14 @@ class SimpleTrackerManager:
 
 V_THRESH_STOP = 2.0  # px/sec threshold for distinguishing motion
 
-def person_status(prev_bbox: Optional[Tuple[float, float, float, float]], prev_t: Optional[float], cur_bbox: Tuple[float, float, float, float], cur_t: float) -> str:
-    """Infer person status based on displacement speed."""
+def person_status(
+    prev_bbox: Optional[Tuple[float, float, float, float]],
+    prev_t: Optional[float],
+    cur_bbox: Tuple[float, float, float, float],
+    cur_t: float,
+    v_thresh: float = V_THRESH_STOP,
+) -> str:
+    """Infer person status based on displacement speed (px/sec against ``v_thresh``)."""
     if prev_bbox is None or prev_t is None:
         return 'Стоит'
     dt = max(1e-6, cur_t - prev_t)
@@ -173,67 +375,928 @@ def person_status(prev_bbox: Optional[Tuple[float, float, float, float]], prev_t
     cx2 = cur_bbox[0] + cur_bbox[2] / 2
     cy2 = cur_bbox[1] + cur_bbox[3] / 2
     v = ((cx2 - cx1) ** 2 + (cy2 - cy1) ** 2) ** 0.5 / dt
-    return 'Стоит' if v <= V_THRESH_STOP else 'Идет'
+    return 'Стоит' if v <= v_thresh else 'Идет'
+
+TRAIN_STOP_REL_SPEED = 0.02  # box widths/sec (or relative area change/sec) below which a train is still
+TRAIN_MOVE_REL_SPEED = 0.05  # above this a stopped train is moving again (hysteresis against jitter)
+TRAIN_MIN_STOP_SEC = 3.0  # a train must stay still this long to count as stopped
+
+TRAIN_ARRIVING = 'Приезжает'
+TRAIN_STOPPED = 'Стоит'
+TRAIN_DEPARTING = 'Выезжает'
+
+
+class TrainStateMachine:
+    """Online arriving → stopped → departing state of one train track.
+
+    Each :meth:`update` compares the new box with the previous observation
+    only: centroid displacement and area change are normalised by the box
+    size and time step, so the cost is O(1) per observation and no history
+    is kept.  The train counts as stopped once it has been still for
+    ``min_stop_sec``; the stop started at the first still observation.  It
+    departs when the speed exceeds ``move_rel_speed``, which closes the stop
+    interval at the last still observation and reports it to ``on_stop``
+    straight away.  A train may stop several times.
+
+    Args:
+        stop_rel_speed: Speed, in box widths (or relative area change) per
+            second, at or below which the train is still.
+        move_rel_speed: Speed above which the train is moving.
+        min_stop_sec: Minimal stillness needed to register a stop.
+        on_stop: Optional callback receiving ``(start_sec, end_sec)`` of
+            every stop as soon as it ends.
+    """
+
+    __slots__ = (
+        'stop_rel_speed', 'move_rel_speed', 'min_stop_sec', 'on_stop', 'status', 'stops',
+        '_last_t', '_last_centre', '_last_area', '_still_since', '_last_still',
+    )
+
+    def __init__(
+        self,
+        stop_rel_speed: float = TRAIN_STOP_REL_SPEED,
+        move_rel_speed: float = TRAIN_MOVE_REL_SPEED,
+        min_stop_sec: float = TRAIN_MIN_STOP_SEC,
+        on_stop: Optional[Callable[[float, float], None]] = None,
+    ) -> None:
+        self.stop_rel_speed = stop_rel_speed
+        self.move_rel_speed = max(move_rel_speed, stop_rel_speed)
+        self.min_stop_sec = min_stop_sec
+        self.on_stop = on_stop
+        self.status = TRAIN_ARRIVING
+        # closed stop intervals (start_sec, end_sec)
+        self.stops: List[Tuple[float, float]] = []
+        self._last_t: Optional[float] = None
+        self._last_centre = (0.0, 0.0)
+        self._last_area = 0.0
+        # time of the first observation of the current still period
+        self._still_since: Optional[float] = None
+        self._last_still: Optional[float] = None
+
+    def update(self, time_sec: float, bbox: Tuple[float, float, float, float]) -> str:
+        """Feed one observation and return the current status."""
+        x, y, w, h = bbox
+        centre = (x + w / 2, y + h / 2)
+        area = max(w * h, 1.0)
+        if self._last_t is not None and time_sec > self._last_t:
+            dt = time_sec - self._last_t
+            shift = math.hypot(centre[0] - self._last_centre[0], centre[1] - self._last_centre[1])
+            # a train approaching the camera head-on grows rather than shifts
+            speed = max(shift / max(w, 1.0), abs(area - self._last_area) / self._last_area) / dt
+            if speed <= self.stop_rel_speed:
+                if self._still_since is None:
+                    self._still_since = self._last_t
+                self._last_still = time_sec
+                if self.status != TRAIN_STOPPED and time_sec - self._still_since >= self.min_stop_sec:
+                    self.status = TRAIN_STOPPED
+            elif speed > self.move_rel_speed or self.status != TRAIN_STOPPED:
+                if self.status == TRAIN_STOPPED:
+                    self._close_stop()
+                    self.status = TRAIN_DEPARTING
+                self._still_since = None
+        self._last_t = time_sec
+        self._last_centre = centre
+        self._last_area = area
+        return self.status
+
+    def finish(self) -> None:
+        """Close a stop still in progress, e.g. when the track ends."""
+        if self.status == TRAIN_STOPPED:
+            self._close_stop()
+
+    def _close_stop(self) -> None:
+        start, end = self._still_since, self._last_still
+        if start is None or end is None:
+            return
+        self.stops.append((start, end))
+        self._still_since = None
+        if self.on_stop is not None:
+            self.on_stop(start, end)
+
 
 def train_status(track: SimpleTrack) -> str:
-    """Infer train status from history length.
-
-    If the track has been observed for only a few frames we consider the train
-    arriving; if it persists but bounding box area changes little we call it
-    stopped; otherwise we treat it as moving.  This heuristic is a simplified
-    substitute for the more elaborate logic in the original notebook.
-    """
-    history = track.history
-    if len(history) <= 1:
-        return 'Приезжает'
-    # compute average area change
-    areas = [bbox[2] * bbox[3] for _, bbox in history]
-    avg_area = sum(areas) / len(areas)
-    var_area = max(areas) - min(areas)
-    if var_area / max(avg_area, 1.0) < 0.1:
-        return 'Стоит'
-    return 'Выезжает'
+    """Return the current status of a train track from its state machine."""
+    if track.state is None:
+        return TRAIN_ARRIVING
+    return track.state.status
+
+
+def _observe_train(
+    track: SimpleTrack,
+    time_sec: float,
+    on_stop: Optional[Callable[[SimpleTrack, float, float], None]] = None,
+) -> None:
+    """Record a train observation in the track history and its state machine."""
+    if track.state is None:
+        callback = (lambda start, end: on_stop(track, start, end)) if on_stop is not None else None
+        track.state = TrainStateMachine(on_stop=callback)
+    track.state.update(time_sec, track.last_bbox)
+    track.history.append((time_sec, track.last_bbox))
 
 
 ##############################
 # Main pipeline
 ##############################
 
-def _load_model(weights_path: str) -> Optional[YOLO]:
+SAMPLE_INTERVAL_SEC = 1.0  # spacing of sampled frames by presentation timestamp
+
+# class indices here are dataset dependent; we assume index 2 -> person, 3 -> train
+PERSON_CLASS = 2
+TRAIN_CLASS = 3
+
+DETECTOR_BACKENDS = ('ultralytics', 'onnx')
+
+
+def load_detector(
+    backend: str,
+    models_dir: str,
+    num_threads: Optional[int] = None,
+    camera_config: Optional[CameraConfig] = None,
+) -> Optional[Detector]:
     """
-    Internal helper to load the YOLO model on CPU if possible.
+    Return the process-wide resident detector of ``backend``.
+
+    ``'ultralytics'`` loads ``best.pt`` through
+    :func:`utils.model_registry.get_model` (on CUDA when available and on CPU
+    otherwise); ``'onnx'`` loads ``best.onnx`` with ONNX Runtime on CPU.
+    Either way the model is loaded and warmed up once per process.  With a
+    ``camera_config`` the detector is wrapped in a
+    :class:`utils.camera_config.RoiDetector`.
 
-    Returns ``None`` if ultralytics or torch are not available or the weights
-    file cannot be found.
+    Returns ``None`` if the backend's dependencies are not available or the
+    weights file cannot be found.
     """
-    if YOLO is None or torch is None:
-        return None
-    if not os.path.exists(weights_path):
+    detector: Optional[Detector]
+    if backend == 'onnx':
+        detector = get_onnx_detector(os.path.join(models_dir, 'best.onnx'), num_threads=num_threads)
+    elif backend == 'ultralytics':
+        weights_path = os.path.join(models_dir, 'best.pt')
+        model = get_model(weights_path, num_threads=num_threads)
+        detector = UltralyticsDetector(model, weights_path) if model is not None else None
+    else:
+        raise ValueError(f'unknown detector backend: {backend!r}')
+    if detector is not None and camera_config is not None:
+        detector = RoiDetector(detector, camera_config)
+    return detector
+
+
+def _split_detections(
+    det: Optional[Detections],
+) -> Tuple[List[Tuple[float, float, float, float]], List[Tuple[float, float, float, float]]]:
+    """
+    Split one frame's ``(xywh, cls)`` detections into person and train boxes
+    (x, y, w, h).
+
+    Returns two empty lists if ``det`` is ``None``.
+    """
+    if det is None:
+        return [], []
+    xywh, cls = det
+    cls = cls.astype(np.int64)
+    boxes = np.empty((len(xywh), 4), dtype=np.float64)
+    boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+    boxes[:, 2:] = xywh[:, 2:]
+    person_bboxes = [tuple(b) for b in boxes[cls == PERSON_CLASS].tolist()]
+    train_bboxes = [tuple(b) for b in boxes[cls == TRAIN_CLASS].tolist()]
+    return person_bboxes, train_bboxes  # type: ignore[return-value]
+
+
+OUTPUT_FORMATS = ('json', 'jsonl', 'jsonl.gz')
+
+
+class _EventOutputs:
+    """
+    Destination for the person and train events of one run.
+
+    In ``'json'`` format events are collected in memory and written as
+    indented JSON arrays when the run finishes, ordered by time and id.  In
+    ``'jsonl'``/``'jsonl.gz'`` format every event is appended to a
+    :class:`JsonLinesWriter` as soon as it is produced (in emission order)
+    and the files are published atomically by :meth:`close`.
+    """
+
+    def __init__(
+        self,
+        out_dir: str,
+        video_id: str,
+        output_format: str = 'json',
+        flush_interval_sec: float = 5.0,
+        profiler: Union[Profiler, NullProfiler] = NULL_PROFILER,
+    ) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'unknown output format: {output_format!r}')
+        self.people_path = os.path.join(out_dir, f'people_events_{video_id}.{output_format}')
+        self.train_path = os.path.join(out_dir, f'train_events_{video_id}.{output_format}')
+        self.people_events: List[dict] = []
+        self.train_events: List[dict] = []
+        self._writers: Optional[Tuple[JsonLinesWriter, JsonLinesWriter]] = None
+        self._profiler = profiler
+        if output_format != 'json':
+            self._writers = (
+                JsonLinesWriter(self.people_path, flush_interval_sec),
+                JsonLinesWriter(self.train_path, flush_interval_sec),
+            )
+
+    def add_person(self, event: dict) -> None:
+        if self._writers is not None:
+            with self._profiler.stage('output'):
+                self._writers[0].write(event)
+        else:
+            self.people_events.append(event)
+
+    def add_train(self, event: dict) -> None:
+        if self._writers is not None:
+            with self._profiler.stage('output'):
+                self._writers[1].write(event)
+        else:
+            self.train_events.append(event)
+
+    def close(self) -> Tuple[str, str]:
+        """Write or publish both outputs and return their paths."""
+        with self._profiler.stage('output'):
+            if self._writers is not None:
+                return self._writers[0].close(), self._writers[1].close()
+            self.people_events.sort(key=lambda e: (e['start_sec'], e['person_id']))
+            self.train_events.sort(key=lambda e: e['train_id'])
+            with open(self.people_path, 'w', encoding='utf-8') as f:
+                json.dump(self.people_events, f, ensure_ascii=False, indent=2)
+            with open(self.train_path, 'w', encoding='utf-8') as f:
+                json.dump(self.train_events, f, ensure_ascii=False, indent=2)
+            return self.people_path, self.train_path
+
+    def abort(self) -> None:
+        """Discard partially written streaming outputs."""
+        if self._writers is not None:
+            for writer in self._writers:
+                writer.abort()
+
+
+def _train_event(
+    track: SimpleTrack,
+    video_path: str,
+    video_link: str,
+    video_id: str,
+    start_dt: datetime,
+    numbers: Optional[TrainNumberIndex] = None,
+) -> dict:
+    """
+    Aggregate a finished train track into a single summary event.
+
+    The stop runs from the start of the first stop to the end of the last
+    one reported by the track's :class:`TrainStateMachine`.  ``номер`` is
+    looked up in ``numbers`` by the time span of the track.
+    """
+    start_sec = track.start_time
+    end_sec = track.last_time
+    stops = track.state.stops if track.state is not None else []
+    stop_start = stops[0][0] if stops else None
+    stop_end = stops[-1][1] if stops else None
+    number = None
+    if numbers is not None:
+        number = numbers.match(
+            start_sec, end_sec, (stop_start, stop_end) if stops else None, numbers.offset_for(start_dt),
+        )
+    return {
+        'train_id': track.id,
+        'filename': os.path.basename(video_path),
+        'video_link': video_link,
+        'video_id': video_id,
+        'arrival_sec': start_sec,
+        'arrival_dt': format_event_dt(start_dt, start_sec),
+        'stop_start_sec': stop_start,
+        'stop_start_dt': format_event_dt(start_dt, stop_start) if stop_start is not None else None,
+        'stop_end_sec': stop_end,
+        'stop_end_dt': format_event_dt(start_dt, stop_end) if stop_end is not None else None,
+        'departure_sec': end_sec,
+        'departure_dt': format_event_dt(start_dt, end_sec),
+        'stopped': bool(stops),
+        'номер': number,
+    }
+
+
+def _frame_size(video_path: str) -> Tuple[int, int]:
+    """Return ``(width, height)`` of the video frames, or ``(0, 0)`` if unknown."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+    finally:
+        cap.release()
+
+
+def _track_video(
+    video_path: str,
+    detector: Optional[Detector],
+    video_link: str,
+    video_id: str,
+    start_dt: datetime,
+    people_sink: Callable[[dict], None],
+    batch_size: int = 1,
+    decode_queue_size: int = 0,
+    start_sec: float = 0.0,
+    end_sec: Optional[float] = None,
+    observer: Optional[Callable[[float, List[SimpleTrack]], None]] = None,
+    on_retire: Optional[Callable[[SimpleTrack], None]] = None,
+    emit_start_sec: Optional[float] = None,
+    cached: Optional[CachedFrames] = None,
+    record: Optional[Callable[[float, Optional[Detections]], None]] = None,
+    motion_gate: Optional[MotionGate] = None,
+    camera_config: Optional[CameraConfig] = None,
+    on_train_stop: Optional[Callable[[SimpleTrack, float, float], None]] = None,
+    source: Optional[Iterable[Tuple[float, np.ndarray]]] = None,
+    max_interval_sec: Optional[float] = None,
+    stop_event: Optional[threading.Event] = None,
+    profiler: Optional[Profiler] = None,
+    iou_thresh: float = 0.3,
+    max_lost_sec: float = 5.0,
+    v_thresh_stop: float = V_THRESH_STOP,
+) -> bool:
+    """
+    Run detection and tracking over ``[start_sec, end_sec)`` of a video.
+
+    Args:
+        detector: Detection backend; unused when ``cached`` is given.
+        people_sink: Callable receiving each finished person interval event.
+        observer: Optional callback invoked after every sampled frame with the
+            frame time and the tracks updated at that time.
+        on_retire: Optional callback receiving every track once it is lost
+            and, at the end of the range, every track still alive.
+        emit_start_sec: Person observations before this time update the
+            tracker but do not produce events (used for shard warm-up).
+        cached: Detections of every sampled frame from a
+            :class:`utils.detection_cache.DetectionCache` entry.  When given,
+            the video is not decoded and the detector is not called; the
+            cached frames inside the range are replayed through the tracker.
+        record: Optional callback receiving the time and detections of every
+            frame fed to the tracker, e.g. to fill the detection cache.
+        motion_gate: Optional :class:`utils.motion.MotionGate`.  Static
+            frames skip inference and reuse the previous detections, and
+            the sampling interval follows the gate's choice.
+        camera_config: Optional camera settings; its ``zones`` fill the
+            ``zone`` of person events from the foot point of each box.
+        on_train_stop: Optional callback receiving a train track and the
+            start and end of each of its stops as soon as the stop ends.
+        source: Frames to process instead of opening ``video_path`` (which
+            then only names the events), e.g. a live stream.  If the source
+            has an ``interval_sec`` attribute the motion gate adjusts it.
+        max_interval_sec: When set, person intervals open for this long are
+            emitted without waiting for them to end.
+        stop_event: When set, processing stops after the current frame and
+            all tracks are finalised.  The decode queue is polled with a
+            timeout, so a source stalled between frames does not delay the
+            stop.
+        profiler: Optional :class:`utils.profiler.Profiler` timing the
+            decode, motion gate, inference, parse, tracking and zone stages
+            and counting detections and active tracks per frame.  The decode
+            queue and motion gate statistics are added to its report.
+        iou_thresh, max_lost_sec: Tracker association threshold and the
+            time after which an unmatched track is retired; ``max_lost_sec``
+            is also the longest gap inside one person interval.
+        v_thresh_stop: Speed in px/sec up to which a person is standing.
+
+    Returns:
+        ``False`` if the video cannot be opened, ``True`` otherwise.
+    """
+    prof = profiler or NULL_PROFILER
+    compactor = PersonEventCompactor(
+        people_sink, os.path.basename(video_path), video_link, video_id, start_dt, max_gap_sec=max_lost_sec,
+    )
+
+    def retire(track: SimpleTrack) -> None:
+        if track.kind == 'person':
+            compactor.close(track.id)
+        elif track.state is not None:
+            track.state.finish()
+        if on_retire is not None:
+            on_retire(track)
+
+    tracker = SimpleTrackerManager(iou_thresh=iou_thresh, max_lost_sec=max_lost_sec, on_retire=retire)
+    batch_size = max(1, int(batch_size))
+    zone_map: Optional[ZoneMap] = None
+    # a live source reveals its frame size with the first frame
+    zones_pending = camera_config is not None and bool(camera_config.zones)
+    if zones_pending and source is None:
+        width, height = _frame_size(video_path)
+        zones_pending = False
+        if width and height:
+            zone_map = get_zone_map(camera_config.zones, width, height, camera_config.imgsz or ZONE_MAP_SIZE)
+        else:
+            logger.warning('frame size of %s unknown, zones are not assigned', video_path)
+
+    def track_frame(current_sec: float, res: Optional[Detections]) -> None:
+        with prof.stage('parse'):
+            person_bboxes, train_bboxes = _split_detections(res)
+        with prof.stage('tracking'):
+            # Update trackers
+            updated_people = tracker.step(person_bboxes, 'person', current_sec)
+            updated_trains = tracker.step(train_bboxes, 'train', current_sec)
+            with prof.stage('zones'):
+                # one vectorised label-map lookup for every person in the frame
+                if zone_map is not None:
+                    zones = zone_map.lookup_boxes([track.last_bbox for track in updated_people])
+                else:
+                    zones = [None] * len(updated_people)
+            # Append history for status estimation
+            for track, zone in zip(updated_people, zones):
+                prev_entry = track.history[-1] if track.history else None
+                prev_bbox = prev_entry[1] if prev_entry else None
+                prev_t = prev_entry[0] if prev_entry else None
+                status = person_status(prev_bbox, prev_t, track.last_bbox, current_sec, v_thresh_stop)
+                track.history.append((current_sec, track.last_bbox))
+                if emit_start_sec is None or current_sec >= emit_start_sec:
+                    compactor.observe(track.id, current_sec, status, zone=zone)
+            for track in updated_trains:
+                _observe_train(track, current_sec, on_train_stop)
+            if observer is not None:
+                observer(current_sec, updated_people + updated_trains)
+            if max_interval_sec is not None:
+                compactor.flush_older(current_sec, max_interval_sec)
+        prof.frame(current_sec, len(person_bboxes), len(train_bboxes), len(tracker.tracks))
+
+    if cached is not None:
+        for current_sec, res in cached:
+            if current_sec >= start_sec and (end_sec is None or current_sec < end_sec):
+                track_frame(current_sec, res)
+        with prof.stage('tracking'):
+            tracker.finalize_all()
+        return True
+
+    cap = None
+    reader: Iterable[Tuple[float, np.ndarray]]
+    if source is not None:
+        reader = source
+    else:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return False
+        # Sample frames by presentation timestamp (aiming for 1 fps); skipped
+        # frames are only grabbed, never converted to arrays
+        reader = SampledFrameReader(cap, interval_sec=SAMPLE_INTERVAL_SEC, start_sec=start_sec, end_sec=end_sec)
+
+    # sampled frames waiting for a batched forward pass, in timestamp order;
+    # frames skipped by the motion gate are kept as ``None``
+    pending: List[Tuple[float, Optional[np.ndarray]]] = []
+    last_res: Optional[Detections] = None
+
+    def flush() -> None:
+        nonlocal last_res
+        with prof.stage('inference'):
+            results = iter(detector.detect([frame for _, frame in pending if frame is not None]))
+        for sec, frame in pending:
+            # a static frame carries the previous detections forward
+            res = next(results) if frame is not None else last_res
+            last_res = res
+            if record is not None:
+                record(sec, res)
+            track_frame(sec, res)
+        pending.clear()
+
+    frames = (
+        ThreadedFrameSource(reader, maxsize=decode_queue_size, stop_event=stop_event)
+        if decode_queue_size > 0 else reader
+    )
+    try:
+        # with a decode queue this times the wait for the next frame only
+        for current_sec, frame in prof.iterate(frames, 'decode'):
+            if zones_pending:
+                zones_pending = False
+                height, width = frame.shape[:2]
+                zone_map = get_zone_map(
+                    camera_config.zones, width, height,  # type: ignore[union-attr]
+                    camera_config.imgsz or ZONE_MAP_SIZE,  # type: ignore[union-attr]
+                )
+            if motion_gate is not None:
+                with prof.stage('motion_gate'):
+                    if not motion_gate.needs_inference(current_sec, frame):
+                        frame = None
+                if hasattr(reader, 'interval_sec'):
+                    interval = motion_gate.next_interval(len(tracker.active_tracks('person')))
+                    reader.interval_sec = interval  # type: ignore[attr-defined]
+            pending.append((current_sec, frame))
+            if len(pending) >= batch_size:
+                flush()
+            if stop_event is not None and stop_event.is_set():
+                break
+        # end of video: process the remaining partial batch
+        flush()
+    finally:
+        if isinstance(frames, ThreadedFrameSource):
+            frames.close()
+        if cap is not None:
+            cap.release()
+    with prof.stage('tracking'):
+        tracker.finalize_all()
+    if isinstance(frames, ThreadedFrameSource):
+        logger.info('decode queue for %s: %s', video_id, frames.stats())
+        if profiler is not None:
+            profiler.extra['decode_queue'] = frames.stats()
+    if motion_gate is not None:
+        logger.info('motion gate for %s: %s', video_id, motion_gate.stats())
+        if profiler is not None:
+            profiler.extra['motion_gate'] = motion_gate.stats()
+    return True
+
+
+##############################
+# Sharded processing
+##############################
+
+# detector used by the current shard worker process, set by the pool initializer
+_WORKER_DETECTOR: Optional[Detector] = None
+
+
+def video_duration(video_path: str) -> float:
+    """Return the container duration in seconds, or 0 if unknown."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0.0
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+    cap.release()
+    return max(0.0, frames / fps)
+
+
+def _grid_overlap(overlap_sec: float) -> float:
+    """Round a shard overlap up to a whole number of sampling intervals."""
+    return math.ceil(overlap_sec / SAMPLE_INTERVAL_SEC) * SAMPLE_INTERVAL_SEC
+
+
+def _shard_ranges(duration: float, shards: int, overlap_sec: float) -> List[Tuple[float, float, Optional[float]]]:
+    """
+    Split ``[0, duration)`` into ``(warm_start, start, end)`` time ranges.
+
+    Boundaries are aligned to the sampling grid so every shard samples the
+    same timestamps as a single-process run.  Each shard after the first
+    starts tracking ``overlap_sec`` (rounded up by :func:`_grid_overlap`)
+    early; observations in that warm-up window are only used for stitching.
+    The last shard runs to end of stream.
+    """
+    step = max(SAMPLE_INTERVAL_SEC, math.ceil(duration / shards / SAMPLE_INTERVAL_SEC) * SAMPLE_INTERVAL_SEC)
+    overlap = _grid_overlap(overlap_sec)
+    ranges: List[Tuple[float, float, Optional[float]]] = []
+    start = 0.0
+    while start < duration and len(ranges) < shards:
+        end: Optional[float] = start + step
+        if len(ranges) == shards - 1 or end >= duration:
+            end = None
+        ranges.append((max(0.0, start - overlap), start, end))
+        if end is None:
+            break
+        start = end
+    return ranges or [(0.0, 0.0, None)]
+
+
+def _init_shard_worker(
+    detector: Optional[Detector],
+    backend: str,
+    models_dir: str,
+    num_threads: Optional[int],
+    camera_config: Optional[CameraConfig] = None,
+) -> None:
+    global _WORKER_DETECTOR
+    if detector is None:
+        detector = load_detector(backend, models_dir, num_threads, camera_config)
+    else:
+        set_cpu_threads(num_threads)
+    _WORKER_DETECTOR = detector
+
+
+def _run_shard(job: dict) -> dict:
+    """
+    Detect and track one time range in a worker process.
+
+    Returns the person events and train observations that fall inside
+    ``[start, end)`` plus the observations in the leading warm-up window
+    (``head``) and the trailing overlap window (``tail``) used to stitch
+    track ids with the neighbouring shards.  ``job['overlap']`` is the
+    grid-aligned overlap, so the tail covers exactly the warm-up window of
+    the next shard.
+    """
+    warm_start, start, end = job['warm_start'], job['start'], job['end']
+    tail_start = end - job['overlap'] if end is not None else None
+    head: dict[int, Tuple[str, dict[float, Tuple[float, float, float, float]]]] = {}
+    tail: dict[int, Tuple[str, dict[float, Tuple[float, float, float, float]]]] = {}
+    # every observation of each train inside [start, end), replayed when stitching
+    train_obs: dict[int, List[Tuple[float, Tuple[float, float, float, float]]]] = {}
+    trains: dict[int, dict] = {}
+
+    def observe(sec: float, tracks: List[SimpleTrack]) -> None:
+        key = round(sec, 3)
+        for track in tracks:
+            if track.kind == 'train' and sec >= start:
+                train_obs.setdefault(track.id, []).append((sec, track.last_bbox))
+            if sec < start:
+                head.setdefault(track.id, (track.kind, {}))[1][key] = track.last_bbox
+            if tail_start is not None and sec >= tail_start:
+                tail.setdefault(track.id, (track.kind, {}))[1][key] = track.last_bbox
+
+    def retire(track: SimpleTrack) -> None:
+        if track.kind == 'train' and track.id in train_obs:
+            trains[track.id] = {'last': track.last_time, 'observations': train_obs[track.id]}
+
+    people_events: List[dict] = []
+    # detections of [start, end) only: the warm-up window belongs to the previous shard
+    detections: CachedFrames = []
+
+    def record(sec: float, res: Optional[Detections]) -> None:
+        if sec >= start:
+            detections.append((sec, res))
+
+    # per-frame counters of [start, end), forwarded to the hook by the parent
+    frame_stats: List[dict] = []
+
+    def on_frame(stats: dict) -> None:
+        if stats['time_sec'] >= start:
+            frame_stats.append(stats)
+
+    motion_gate = MotionGate(SAMPLE_INTERVAL_SEC) if job['motion_gate'] else None
+    profiler = Profiler(on_frame if job['profile_frames'] else None) if job['profile'] else None
+    result = {
+        'people_events': people_events, 'trains': trains, 'head': head, 'tail': tail,
+        'detections': detections, 'motion': None, 'profile': None, 'frame_stats': frame_stats,
+    }
+    if _WORKER_DETECTOR is None:
+        return result
+    _track_video(
+        job['video_path'], _WORKER_DETECTOR, job['video_link'], job['video_id'], job['start_dt'],
+        people_events.append,
+        batch_size=job['batch_size'], decode_queue_size=job['decode_queue_size'],
+        start_sec=warm_start, end_sec=end, observer=observe, on_retire=retire, emit_start_sec=start,
+        record=record if job['record'] else None, motion_gate=motion_gate, camera_config=job['camera_config'],
+        profiler=profiler, iou_thresh=job['iou_thresh'], max_lost_sec=job['max_lost_sec'],
+        v_thresh_stop=job['v_thresh_stop'],
+    )
+    if motion_gate is not None:
+        result['motion'] = motion_gate.stats()
+    if profiler is not None:
+        result['profile'] = profiler.summary()
+    return result
+
+
+def _match_boundary(prev_tail: dict, cur_head: dict, iou_thresh: float) -> dict[int, int]:
+    """
+    Match tracks seen in a shard's warm-up window to the previous shard's
+    tracks observed at the same timestamps.
+
+    Both shards ran the detector on the same sampled frames, so a track that
+    crosses the boundary has (near) identical boxes on both sides.  Pairs
+    are scored by their mean IoU over common timestamps and matched greedily
+    from the best score down.
+
+    Returns:
+        Mapping from current-shard local id to previous-shard local id.
+    """
+    scored: List[Tuple[float, int, int]] = []
+    for tid, (kind, obs) in cur_head.items():
+        for ptid, (pkind, pobs) in prev_tail.items():
+            if kind != pkind:
+                continue
+            common = obs.keys() & pobs.keys()
+            if not common:
+                continue
+            score = sum(iou_bbox(obs[t], pobs[t]) for t in common) / len(common)
+            if score >= iou_thresh:
+                scored.append((score, tid, ptid))
+    scored.sort(key=lambda x: (-x[0], x[1], x[2]))
+    mapping: dict[int, int] = {}
+    used: set[int] = set()
+    for _, tid, ptid in scored:
+        if tid in mapping or ptid in used:
+            continue
+        mapping[tid] = ptid
+        used.add(ptid)
+    return mapping
+
+
+def _stitch_shards(
+    results: List[dict], iou_thresh: float, max_gap_sec: float,
+) -> Tuple[List[dict], List[SimpleTrack]]:
+    """
+    Merge shard results into globally consistent person and train ids.
+
+    Tracks continuing across a boundary keep the id of the earlier shard;
+    every other track gets the next free id in creation order.  Boundary
+    matching scores tracks by their mean IoU over the overlap window, so it
+    is a heuristic: ids are consistent across the whole video but are not
+    guaranteed to equal the numbering of a single-process run, in
+    particular when the motion gate lets the shards sample different
+    frames.
+
+    Train tracks are rebuilt by replaying the observations of all their
+    parts through a fresh :class:`TrainStateMachine`, so a stop spanning a
+    shard boundary is reported once rather than split in two.  Boundary
+    tracks are matched with the tracker's ``iou_thresh`` and person
+    intervals cut at a boundary are joined across gaps up to
+    ``max_gap_sec``.
+
+    Returns:
+        The merged person events and one rebuilt :class:`SimpleTrack` per
+        global train id.
+    """
+    next_id = 1
+    people_events: List[dict] = []
+    trains: dict[int, List[dict]] = {}
+    prev_ids: dict[int, int] = {}
+    for k, res in enumerate(results):
+        ids: dict[int, int] = {}
+        if k > 0:
+            for tid, ptid in _match_boundary(results[k - 1]['tail'], res['head'], iou_thresh).items():
+                if ptid in prev_ids:
+                    ids[tid] = prev_ids[ptid]
+        local_ids = {e['person_id'] for e in res['people_events']} | set(res['trains'])
+        for tid in sorted(local_ids):
+            if tid not in ids:
+                ids[tid] = next_id
+                next_id += 1
+        for event in res['people_events']:
+            people_events.append(dict(event, person_id=ids[event['person_id']]))
+        for tid, part in res['trains'].items():
+            trains.setdefault(ids[tid], []).append(part)
+        prev_ids = ids
+    # person intervals cut at shard boundaries are joined back together
+    people_events = merge_person_intervals(people_events, max_gap_sec=max_gap_sec)
+
+    train_tracks: List[SimpleTrack] = []
+    for gid in sorted(trains):
+        observations = sorted(obs for p in trains[gid] for obs in p['observations'])
+        track = SimpleTrack(gid, 'train', observations[0][1], observations[0][0])
+        for t, bbox in observations:
+            track.update(bbox, t)
+            _observe_train(track, t)
+        track.state.finish()  # type: ignore[union-attr]
+        track.update(track.last_bbox, max(p['last'] for p in trains[gid]))
+        train_tracks.append(track)
+    return people_events, train_tracks
+
+
+def _run_sharded(
+    video_path: str,
+    detector: Optional[Detector],
+    backend: str,
+    models_dir: str,
+    video_link: str,
+    video_id: str,
+    start_dt: datetime,
+    workers: int,
+    overlap_sec: float,
+    batch_size: int,
+    decode_queue_size: int,
+    num_threads: Optional[int] = None,
+    record: Optional[CachedFrames] = None,
+    motion_gate: bool = False,
+    camera_config: Optional[CameraConfig] = None,
+    profiler: Optional[Profiler] = None,
+    numbers: Optional[TrainNumberIndex] = None,
+    iou_thresh: float = 0.3,
+    max_lost_sec: float = 5.0,
+    v_thresh_stop: float = V_THRESH_STOP,
+) -> Tuple[List[dict], List[dict]]:
+    """
+    Process a video as time shards in a process pool and stitch the tracks.
+
+    Unless ``num_threads`` is given, each worker gets an equal share of the
+    CPU cores for torch so the workers do not oversubscribe the host.  When
+    ``record`` is a list, the detections of every sampled frame are
+    collected from the shards and appended to it in time order.  With a
+    ``profiler`` every worker profiles its shard; the stage times are summed
+    into ``profiler`` and the per-frame counters are passed to its hook in
+    time order once all shards are done.
+    """
+    if not num_threads:
+        num_threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    ranges = _shard_ranges(video_duration(video_path), workers, overlap_sec)
+    jobs = [
+        {
+            'video_path': video_path, 'video_link': video_link, 'video_id': video_id, 'start_dt': start_dt,
+            'batch_size': batch_size, 'decode_queue_size': decode_queue_size,
+            'warm_start': warm_start, 'start': start, 'end': end, 'overlap': _grid_overlap(overlap_sec),
+            'record': record is not None, 'motion_gate': motion_gate, 'camera_config': camera_config,
+            'profile': profiler is not None, 'profile_frames': profiler is not None and profiler.hook is not None,
+            'iou_thresh': iou_thresh, 'max_lost_sec': max_lost_sec, 'v_thresh_stop': v_thresh_stop,
+        }
+        for warm_start, start, end in ranges
+    ]
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(jobs)),
+        initializer=_init_shard_worker,
+        initargs=(detector, backend, models_dir, num_threads, camera_config),
+    ) as pool:
+        results = list(pool.map(_run_shard, jobs))
+    if record is not None:
+        for res in results:
+            record.extend(res['detections'])
+    if motion_gate:
+        logger.info('motion gate for %s by shard: %s', video_id, [res['motion'] for res in results])
+    if profiler is not None:
+        for res in results:
+            profiler.merge(res['profile'])
+            if profiler.hook is not None:
+                for stats in res['frame_stats']:
+                    profiler.hook(stats)
+        profiler.extra['shards'] = [res['profile'] for res in results]
+    people_events, train_tracks = _stitch_shards(results, iou_thresh=iou_thresh, max_gap_sec=max_lost_sec)
+    train_events = [_train_event(t, video_path, video_link, video_id, start_dt, numbers) for t in train_tracks]
+    return people_events, train_events
+
+
+def _detection_cache_key(
+    cache: DetectionCache,
+    video_path: str,
+    detector: Optional[Detector],
+    backend: str,
+    models_dir: str,
+    motion_gate: bool = False,
+    camera_config: Optional[CameraConfig] = None,
+) -> Optional[str]:
+    """
+    Return the cache key of ``video_path`` for the detector of this run.
+
+    The weights file comes from ``detector`` when one was passed in, and
+    from ``models_dir`` for ``backend`` otherwise, so a cache hit does not
+    need to load the model at all.  The settings of a detector loaded by
+    :func:`load_detector` equal :func:`utils.detectors.default_settings`
+    of its backend, so both paths produce the same key and entries warmed
+    without a model are hit by runs that pass one in.  Returns ``None`` when
+    the weights or the video cannot be read.
+    """
+    if detector is not None:
+        weights_path, settings = detector.weights_path, detector.settings()
+    else:
+        weights_path = os.path.join(models_dir, 'best.onnx' if backend == 'onnx' else 'best.pt')
+        settings = default_settings(backend)
+        if camera_config is not None:
+            settings['camera'] = camera_config.detection_settings()
+    if not weights_path:
+        logger.warning('detection cache disabled: weights file of the detector is unknown')
         return None
+    params = {'interval_sec': SAMPLE_INTERVAL_SEC, 'detector': settings}
+    if motion_gate:
+        # gated runs sample different frames and carry detections forward
+        params['motion_gate'] = MotionGate(SAMPLE_INTERVAL_SEC).settings()
     try:
-        # Force CPU by specifying device; ultralytics automatically selects CPU
-        return YOLO(weights_path, task='detect', device='gpu')  # type: ignore
-    except Exception:
+        return cache.key(video_path, weights_path, params)
+    except OSError as e:
+        logger.warning('detection cache disabled: %s', e)
         return None
 
 
+def _save_detections(cache: Optional[DetectionCache], key: Optional[str], frames: Optional[CachedFrames]) -> None:
+    """Store the recorded detections of a run unless inference failed on some frame."""
+    if cache is None or key is None or frames is None:
+        return
+    if any(res is None for _, res in frames):
+        # failures are usually transient (e.g. out of memory); do not replay them
+        logger.warning('detections not cached: inference failed on some frames')
+        return
+    cache.save(key, frames)
+
+
+def _finish_outputs(
+    outputs: _EventOutputs, profiler: Optional[Profiler], out_dir: str, video_id: str,
+) -> Tuple[str, str]:
+    """Close the event outputs and write the profiling report, if any."""
+    paths = outputs.close()
+    if profiler is not None:
+        path = profiler.write(os.path.join(out_dir, f'profile_{video_id}.json'))
+        logger.info('profile of %s written to %s', video_id, path)
+    return paths
+
+
 def run_pipeline(
     video_path: str,
-    model: Optional[YOLO] = None,
+    model: Optional[object] = None,
     video_start_dt_str: Optional[str] = None,
     video_link: Optional[str] = None,
     video_id: Optional[str] = None,
-    train_numbers_list: Optional[List[dict]] = None,
+    train_numbers_list: Union[None, List[dict], TrainNumberIndex] = None,
     out_dir: Optional[str] = None,
+    batch_size: int = 1,
+    decode_queue_size: int = 0,
+    workers: int = 1,
+    shard_overlap_sec: float = 10.0,
+    output_format: str = 'json',
+    flush_interval_sec: float = 5.0,
+    num_threads: Optional[int] = None,
+    backend: str = 'ultralytics',
+    detection_cache_dir: Optional[str] = None,
+    motion_gate: bool = False,
+    camera_config: Optional[CameraConfig] = None,
+    profile: bool = False,
+    profile_hook: Optional[Callable[[dict], None]] = None,
+    iou_thresh: float = 0.3,
+    max_lost_sec: float = 5.0,
+    v_thresh_stop: float = V_THRESH_STOP,
 ) -> Tuple[str, str]:
     """
     Process a single video fragment and produce JSON summaries.
 
     Args:
         video_path: Path to the local video file.
-        model: A preloaded ultralytics YOLO model.  If ``None`` the model
-            weights will be loaded from ``models/best.pt`` on CPU.  When the
-            weights are not available the function returns empty outputs.
+        model: A preloaded ultralytics YOLO model or any
+            :class:`utils.detectors.Detector`.  If ``None`` the detector for
+            ``backend`` is taken from ``models/`` through the process-wide
+            model registry, so it is loaded and warmed up only once per
+            process.  When the weights are not available the function
+            returns empty outputs.
         video_start_dt_str: The start datetime of the video fragment.  It must
             be in the format ``YYYY-MM-DD HH:MM:SS``.  When ``None`` the
             function uses the current time as the base.
@@ -241,17 +1304,90 @@ def run_pipeline(
             output JSON for traceability.
         video_id: A unique identifier for this fragment.
         train_numbers_list: Optional list of dictionaries with keys ``number``
-            and ``time`` (seconds from the start of the video).  Used to
-            associate train numbers with train events.  Currently unused in
-            this simplified implementation.
+            and ``time`` (seconds from the start of the video or a datetime),
+            or ``start``/``end`` for an interval, e.g. read with
+            :func:`utils.train_numbers.load_train_numbers`.  The entry that
+            overlaps a train track the longest fills the ``номер`` of its
+            event.  For a log covering many fragments pass a prebuilt
+            :class:`utils.train_numbers.TrainNumberIndex` so it is sorted
+            only once.
         out_dir: Optional directory where JSON files will be written.  If not
             provided, files are stored in ``analysis_results`` in the current
             working directory.
+        batch_size: Number of sampled frames sent to the model in one
+            forward pass.  Results are fed to the tracker in timestamp order,
+            so the outputs are identical for any batch size; larger batches
+            only amortise per-call overhead.  Pending frames are flushed at
+            the end of the video.
+        decode_queue_size: When greater than zero, frames are decoded and
+            sampled on a background thread into a queue of this depth while
+            inference and tracking run on the calling thread.  Stall
+            counters for both sides are logged at the end of the run.
+        workers: When greater than one, the video is split into that many
+            time shards processed in parallel worker processes.  Each worker
+            loads its own model (or inherits ``model`` where the process
+            start method allows) and track ids are stitched across shard
+            boundaries into globally consistent ids.
+        shard_overlap_sec: Length of the warm-up window each shard processes
+            before its start so tracks can be matched to the previous
+            shard.  Should exceed the tracker's ``max_lost_sec``.
+        output_format: ``'json'`` (default) writes indented JSON arrays at
+            the end of the run.  ``'jsonl'`` and ``'jsonl.gz'`` stream each
+            event to a JSON Lines file as soon as it is finalised, so memory
+            stays flat and partial results are visible in ``*.part`` files
+            while the video is processed; the files are renamed into place
+            when the run completes.  Use :func:`utils.events.iter_events` to
+            read any format back.
+        flush_interval_sec: Maximum time between disk flushes in the
+            streaming formats.
+        num_threads: torch CPU thread count for inference.  ``None`` keeps
+            the torch default in single-process mode and splits the cores
+            evenly between workers in sharded mode.
+        backend: Detector backend used when ``model`` is ``None``:
+            ``'ultralytics'`` (``models/best.pt`` with torch) or ``'onnx'``
+            (``models/best.onnx`` with ONNX Runtime on CPU).
+        detection_cache_dir: Directory of a
+            :class:`utils.detection_cache.DetectionCache`.  Detections are
+            cached per video content, weights and sampling settings; on a
+            hit the video is neither decoded nor sent to the model and only
+            tracking and event building run, which makes re-running with
+            different tracker settings (``iou_thresh``, ``max_lost_sec``,
+            ``v_thresh_stop``) cheap; they are not part of the key.  On a miss the detections of
+            this run are stored.  Ignored when the weights file of the
+            detector is unknown.
+        motion_gate: Compare a small grayscale thumbnail of every sampled
+            frame with the last frame sent to the detector
+            (:class:`utils.motion.MotionGate`).  Static frames skip inference
+            and carry the previous detections forward; while something moves
+            or people are tracked, frames are sampled twice as often.
+            Skipped frames and the effective inference rate are logged at
+            the end of the run.
+        camera_config: Regions of interest and inference size of the camera
+            (:class:`utils.camera_config.CameraConfig`).  Only the ROIs are
+            sent to the detector, cropped and resized to ``imgsz``, and the
+            boxes are mapped back to full-frame coordinates.  Its ``zones``
+            fill the ``zone`` field of person events.
+        profile: Time every stage of the run (decode, motion gate,
+            inference, detection parsing, tracking, zones, event output) and
+            count detections and active tracks per frame
+            (:class:`utils.profiler.Profiler`).  The report is written to
+            ``profile_{video_id}.json`` next to the event files and its path
+            is logged.  Disabled profiling adds no measurable overhead.
+        profile_hook: Optional callable receiving the counters of every
+            processed frame (``time_sec``, ``people``, ``trains``,
+            ``active_tracks``); implies ``profile``.
+        iou_thresh: Minimum IoU for a detection to continue a track, also
+            used to match tracks across shard boundaries.
+        max_lost_sec: Time after which an unmatched track is retired and
+            its events are finalised; also the longest gap joined inside a
+            person interval.
+        v_thresh_stop: Speed of the box centre in px/sec up to which a
+            person is reported as standing.
 
     Returns:
         A tuple ``(people_json_path, train_json_path)`` containing the paths
-        to the generated JSON files.  If detection could not be performed the
-        files will contain empty arrays.
+        to the generated files.  If detection could not be performed the
+        files will contain no events.
     """
     # Ensure output directory exists
     out_dir = out_dir or os.path.join(os.getcwd(), 'analysis_results')
@@ -269,144 +1405,251 @@ def run_pipeline(
     # Set defaults
     video_link = video_link or ''
     video_id = video_id or 'fragment'
+    models_dir = os.path.join(os.path.dirname(__file__), '..', 'models')
+    detector = as_detector(model) if model is not None else None
+    if detector is not None and camera_config is not None:
+        detector = RoiDetector(detector, camera_config)
 
-    # Attempt to load model if not provided
-    if model is None:
-        weights_path = os.path.join(os.path.dirname(__file__), '..', 'models', 'best.pt')
-        model = _load_model(weights_path)
+    cache: Optional[DetectionCache] = None
+    cache_key: Optional[str] = None
+    cached: Optional[CachedFrames] = None
+    record: Optional[CachedFrames] = None
+    if detection_cache_dir and cv2 is not None:
+        cache = DetectionCache(detection_cache_dir)
+        cache_key = _detection_cache_key(
+            cache, video_path, detector, backend, models_dir, motion_gate, camera_config,
+        )
+        if cache_key is not None:
+            cached = cache.load(cache_key)
+            record = [] if cached is None else None
+            logger.info('detection cache %s for %s', 'hit' if cached is not None else 'miss', video_id)
 
-    # Prepare output containers
-    people_events: List[dict] = []
-    train_events: List[dict] = []
-
-    # If model or cv2 is unavailable we return empty outputs
-    if cv2 is None or model is None:
-        # still write empty files
-        people_out_path = os.path.join(out_dir, f'people_events_{video_id}.json')
-        train_out_path = os.path.join(out_dir, f'train_events_{video_id}.json')
-        with open(people_out_path, 'w', encoding='utf-8') as f:
-            json.dump(people_events, f, ensure_ascii=False, indent=2)
-        with open(train_out_path, 'w', encoding='utf-8') as f:
-            json.dump(train_events, f, ensure_ascii=False, indent=2)
-        return people_out_path, train_out_path
-
-    # Open video
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        # unable to open; write empty outputs
-        people_out_path = os.path.join(out_dir, f'people_events_{video_id}.json')
-        train_out_path = os.path.join(out_dir, f'train_events_{video_id}.json')
-        with open(people_out_path, 'w', encoding='utf-8') as f:
-            json.dump(people_events, f, ensure_ascii=False, indent=2)
-        with open(train_out_path, 'w', encoding='utf-8') as f:
-            json.dump(train_events, f, ensure_ascii=False, indent=2)
-        return people_out_path, train_out_path
-
-    # Determine frame sampling interval (aiming for 1 fps)
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    sample_step = max(1, int(round(fps)))
+    numbers = as_train_number_index(train_numbers_list)
+    profiler = Profiler(profile_hook) if profile or profile_hook is not None else None
+    outputs = _EventOutputs(out_dir, video_id, output_format, flush_interval_sec, profiler or NULL_PROFILER)
+    try:
+        # Sharded mode loads the model inside the workers; cached detections
+        # are replayed in-process since only tracking is left to do
+        if workers > 1 and cv2 is not None and cached is None:
+            people_events, train_events = _run_sharded(
+                video_path, detector, backend, models_dir, video_link, video_id, start_dt,
+                workers, shard_overlap_sec, batch_size, decode_queue_size, num_threads, record, motion_gate,
+                camera_config, profiler, numbers,
+                iou_thresh=iou_thresh, max_lost_sec=max_lost_sec, v_thresh_stop=v_thresh_stop,
+            )
+            _save_detections(cache, cache_key, record)
+            for event in people_events:
+                outputs.add_person(event)
+            for event in train_events:
+                outputs.add_train(event)
+            return _finish_outputs(outputs, profiler, out_dir, video_id)
+
+        # Attempt to load model if not provided (not needed on a cache hit)
+        if cached is None:
+            if detector is None:
+                detector = load_detector(backend, models_dir, num_threads, camera_config)
+            else:
+                set_cpu_threads(num_threads)
 
-    tracker = SimpleTrackerManager(iou_thresh=0.3, max_lost_sec=5.0)
+        # If model or cv2 is unavailable we return empty outputs
+        if cv2 is not None and (detector is not None or cached is not None):
+            # Aggregate train events: a single summary per track, emitted as
+            # soon as the track is retired
+            def on_retire(track: SimpleTrack) -> None:
+                if track.kind == 'train' and track.history:
+                    outputs.add_train(_train_event(track, video_path, video_link, video_id, start_dt, numbers))
 
-    frame_idx = 0
-    current_sec = 0.0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if frame is None:
-            frame_idx += 1
-            continue
-        # Only process frames at the sampling interval
-        if frame_idx % sample_step == 0:
-            current_sec = frame_idx / fps
-            # Run YOLO inference
-            try:
-                with torch.no_grad():  # type: ignore
-                    results = model(frame, verbose=False)  # type: ignore
-            except Exception:
-                results = []
-            # Parse detections
-            person_bboxes: List[Tuple[float, float, float, float]] = []
-            train_bboxes: List[Tuple[float, float, float, float]] = []
-            try:
-                if results:
-                    res = results[0]
-                    boxes = res.boxes
-                    xywh = boxes.xywh.cpu().numpy() if hasattr(boxes.xywh, 'cpu') else []
-                    classes = boxes.cls.cpu().numpy() if hasattr(boxes.cls, 'cpu') else []
-                    for (x, y, w, h), cls in zip(xywh, classes):
-                        # class indices here are dataset dependent; we assume index 2 -> person, 3 -> train
-                        if int(cls) == 2:
-                            person_bboxes.append((float(x - w / 2), float(y - h / 2), float(w), float(h)))
-                        elif int(cls) == 3:
-                            train_bboxes.append((float(x - w / 2), float(y - h / 2), float(w), float(h)))
-            except Exception:
-                # if parsing fails we ignore detections
-                pass
-            # Update trackers
-            tracker.step(person_bboxes, 'person', current_sec)
-            tracker.step(train_bboxes, 'train', current_sec)
-            # Append history for status estimation
-            for tid, track in tracker.tracks.items():
-                if track.kind == 'person' and track.last_time == current_sec:
-                    prev_entry = track.history[-1] if track.history else None
-                    prev_bbox = prev_entry[1] if prev_entry else None
-                    prev_t = prev_entry[0] if prev_entry else None
-                    status = person_status(prev_bbox, prev_t, track.last_bbox, current_sec)
-                    track.history.append((current_sec, track.last_bbox))
-                    people_events.append({
-                        'person_id': track.id,
-                        'filename': os.path.basename(video_path),
-                        'video_link': video_link,
-                        'video_id': video_id,
-                        'start_sec': current_sec,
-                        'end_sec': current_sec,
-                        'start_dt': (start_dt + timedelta(seconds=current_sec)).strftime('%Y-%m-%d %H:%M:%S'),
-                        'end_dt': (start_dt + timedelta(seconds=current_sec)).strftime('%Y-%m-%d %H:%M:%S'),
-                        'status': status,
-                        'zone': None,
-                    })
-                elif track.kind == 'train' and track.last_time == current_sec:
-                    # for trains we only store basic info at each observation
-                    track.history.append((current_sec, track.last_bbox))
-        frame_idx += 1
+            _track_video(
+                video_path, detector, video_link, video_id, start_dt, outputs.add_person,
+                batch_size=batch_size, decode_queue_size=decode_queue_size, on_retire=on_retire,
+                cached=cached, record=(lambda sec, res: record.append((sec, res))) if record is not None else None,
+                motion_gate=MotionGate(SAMPLE_INTERVAL_SEC) if motion_gate else None, camera_config=camera_config,
+                profiler=profiler, iou_thresh=iou_thresh, max_lost_sec=max_lost_sec, v_thresh_stop=v_thresh_stop,
+            )
+            _save_detections(cache, cache_key, record)
+        return _finish_outputs(outputs, profiler, out_dir, video_id)
+    except BaseException:
+        outputs.abort()
+        raise
 
-    cap.release()
 
-    # Aggregate train events: a single summary per track
-    for tid, track in tracker.tracks.items():
-        if track.kind != 'train' or not track.history:
-            continue
-        times = [t for t, _ in track.history]
-        start_sec = min(times)
-        end_sec = max(times)
-        arr_dt = (start_dt + timedelta(seconds=start_sec)).strftime('%Y-%m-%d %H:%M:%S')
-        dep_dt = (start_dt + timedelta(seconds=end_sec)).strftime('%Y-%m-%d %H:%M:%S')
-        status_label = train_status(track)
-        train_events.append({
+##############################
+# Live streams
+##############################
+
+STREAM_EVENT_KINDS = ('person', 'train', 'train_stop')
+
+
+def _open_stream_source(
+    source: Union[str, Iterable[Tuple[float, np.ndarray]]],
+    follow: bool,
+    realtime: bool,
+    speed: float,
+    stop_event: Optional[threading.Event] = None,
+) -> Tuple[Iterable[Tuple[float, np.ndarray]], Optional["cv2.VideoCapture"]]:
+    """
+    Build the frame iterable for :func:`run_stream`.
+
+    Returns the source and, for URLs and plain files, the capture to release
+    when done.
+    """
+    cap = None
+    frames: Iterable[Tuple[float, np.ndarray]]
+    if not isinstance(source, str):
+        frames = source
+    elif follow:
+        frames = GrowingFileReader(source, interval_sec=SAMPLE_INTERVAL_SEC, stop_event=stop_event)
+    else:
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            cap.release()
+            raise IOError(f'cannot open video source {source!r}')
+        frames = SampledFrameReader(cap, interval_sec=SAMPLE_INTERVAL_SEC)
+    if realtime:
+        frames = RealTimeReplay(frames, speed=speed)
+    return frames, cap
+
+
+def run_stream(
+    source: Union[str, Iterable[Tuple[float, np.ndarray]]],
+    on_event: Optional[Callable[[str, dict], None]] = None,
+    event_queue: Optional["queue.Queue"] = None,
+    model: Optional[object] = None,
+    video_start_dt_str: Optional[str] = None,
+    video_link: Optional[str] = None,
+    video_id: Optional[str] = None,
+    max_latency_sec: float = 10.0,
+    batch_size: int = 1,
+    decode_queue_size: int = 8,
+    follow: bool = False,
+    realtime: bool = False,
+    speed: float = 1.0,
+    num_threads: Optional[int] = None,
+    backend: str = 'ultralytics',
+    motion_gate: bool = False,
+    camera_config: Optional[CameraConfig] = None,
+    stop_event: Optional[threading.Event] = None,
+    train_numbers_list: Union[None, List[dict], TrainNumberIndex] = None,
+    iou_thresh: float = 0.3,
+    max_lost_sec: float = 5.0,
+    v_thresh_stop: float = V_THRESH_STOP,
+) -> dict:
+    """
+    Run detection and tracking continuously on a live source.
+
+    Events are delivered as ``(kind, event)`` pairs as soon as they are
+    final, where ``kind`` is one of :data:`STREAM_EVENT_KINDS`:
+
+    * ``'person'`` – a person interval as in :func:`run_pipeline`.  An
+      interval still open after ``max_latency_sec`` is emitted and a new one
+      starts with the next observation, so every observation is reported
+      within roughly ``max_latency_sec`` plus one inference batch.
+    * ``'train_stop'`` – a stop of a train, as soon as the train moves again.
+    * ``'train'`` – the summary of a train, once its track is retired.
+
+    Args:
+        source: An RTSP/HTTP URL or a file path (opened with OpenCV and
+            sampled once per second by timestamp), or any iterable of
+            ``(time_sec, frame)`` pairs.
+        on_event: Callback receiving ``(kind, event)``.
+        event_queue: Queue receiving ``(kind, event)`` pairs; ``None`` is put
+            after the last event when the stream ends.
+        model: Preloaded model or detector; see :func:`run_pipeline`.
+        video_start_dt_str: Wall-clock time of stream time 0 in the format
+            ``YYYY-MM-DD HH:MM:SS``; defaults to now.
+        video_link: Source URL stored in the events (defaults to ``source``
+            when it is a string).
+        video_id: Identifier stored in the events.
+        max_latency_sec: Longest time a person interval stays open before
+            it is emitted.
+        batch_size: Sampled frames per forward pass.  Larger batches add up
+            to ``batch_size`` sampling intervals of delay.
+        decode_queue_size: Depth of the background decoding queue, which
+            keeps a live source drained while inference runs; ``0`` decodes
+            on the calling thread.
+        follow: Treat a file path as a recording that is still being
+            written (:class:`utils.frame_source.GrowingFileReader`).
+        realtime: Pace the source at its timestamps
+            (:class:`utils.frame_source.RealTimeReplay`), e.g. to replay a
+            local MP4 as if it were a camera.
+        speed: Replay speed used with ``realtime``.
+        num_threads, backend, motion_gate, camera_config: As for
+            :func:`run_pipeline`.
+        stop_event: Set it from another thread to stop; open intervals and
+            tracks are finalised and emitted before returning.  The stop is
+            seen within a fraction of a second even while the source is
+            stalled (RTSP reconnect, a followed file waiting for data),
+            unless ``decode_queue_size`` is ``0`` and the read itself blocks.
+        train_numbers_list: Train number log as for :func:`run_pipeline`;
+            wall-clock entries are matched relative to
+            ``video_start_dt_str``.
+        iou_thresh, max_lost_sec, v_thresh_stop: Tracker settings as for
+            :func:`run_pipeline`.
+
+    Returns:
+        Number of events delivered per kind.
+    """
+    if video_start_dt_str:
+        try:
+            start_dt = datetime.strptime(video_start_dt_str, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            start_dt = datetime.now()
+    else:
+        start_dt = datetime.now()
+    name = source if isinstance(source, str) else 'stream'
+    video_link = video_link or (source if isinstance(source, str) else '')
+    video_id = video_id or 'stream'
+
+    if model is not None:
+        detector: Optional[Detector] = as_detector(model)
+        set_cpu_threads(num_threads)
+        if camera_config is not None:
+            detector = RoiDetector(detector, camera_config)  # type: ignore[arg-type]
+    else:
+        models_dir = os.path.join(os.path.dirname(__file__), '..', 'models')
+        detector = load_detector(backend, models_dir, num_threads, camera_config)
+    if detector is None:
+        raise RuntimeError(f'detector backend {backend!r} is not available')
+
+    numbers = as_train_number_index(train_numbers_list)
+    counts = {kind: 0 for kind in STREAM_EVENT_KINDS}
+
+    def emit(kind: str, event: dict) -> None:
+        counts[kind] += 1
+        if on_event is not None:
+            on_event(kind, event)
+        if event_queue is not None:
+            event_queue.put((kind, event))
+
+    def on_retire(track: SimpleTrack) -> None:
+        if track.kind == 'train' and track.history:
+            emit('train', _train_event(track, name, video_link, video_id, start_dt, numbers))
+
+    def on_train_stop(track: SimpleTrack, stop_start: float, stop_end: float) -> None:
+        emit('train_stop', {
             'train_id': track.id,
-            'filename': os.path.basename(video_path),
+            'filename': os.path.basename(name),
             'video_link': video_link,
             'video_id': video_id,
-            'arrival_sec': start_sec,
-            'arrival_dt': arr_dt,
-            'stop_start_sec': None,
-            'stop_start_dt': None,
-            'stop_end_sec': None,
-            'stop_end_dt': None,
-            'departure_sec': end_sec,
-            'departure_dt': dep_dt,
-            'stopped': status_label == 'Стоит',
-            'номер': None,
+            'stop_start_sec': stop_start,
+            'stop_start_dt': format_event_dt(start_dt, stop_start),
+            'stop_end_sec': stop_end,
+            'stop_end_dt': format_event_dt(start_dt, stop_end),
         })
 
-    # Write JSON outputs
-    people_out_path = os.path.join(out_dir, f'people_events_{video_id}.json')
-    train_out_path = os.path.join(out_dir, f'train_events_{video_id}.json')
-    with open(people_out_path, 'w', encoding='utf-8') as f:
-        json.dump(people_events, f, ensure_ascii=False, indent=2)
-    with open(train_out_path, 'w', encoding='utf-8') as f:
-        json.dump(train_events, f, ensure_ascii=False, indent=2)
-
-    return people_out_path, train_out_path
\ No newline at end of file
+    frames, cap = _open_stream_source(source, follow, realtime, speed, stop_event)
+    try:
+        _track_video(
+            name, detector, video_link, video_id, start_dt, lambda event: emit('person', event),
+            batch_size=batch_size, decode_queue_size=decode_queue_size, on_retire=on_retire,
+            motion_gate=MotionGate(SAMPLE_INTERVAL_SEC) if motion_gate else None, camera_config=camera_config,
+            on_train_stop=on_train_stop, source=frames, max_interval_sec=max_latency_sec, stop_event=stop_event,
+            iou_thresh=iou_thresh, max_lost_sec=max_lost_sec, v_thresh_stop=v_thresh_stop,
+        )
+    finally:
+        if cap is not None:
+            cap.release()
+        if event_queue is not None:
+            event_queue.put(None)
+    logger.info('stream %s finished: %s', video_id, counts)
+    return counts
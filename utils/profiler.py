@@ -0,0 +1,176 @@
+"""
+profiler.py
+Lightweight stage timing for the detection pipeline.
+
+:class:`Profiler` accumulates wall-clock time per named stage (decoding,
+motion gate, inference, detection parsing, tracking, zones, output) and
+per-frame counters (detections, active tracks).  Stages nest: time spent in
+an inner stage is not counted in the outer one, so the stage totals add up
+to the profiled wall time and show directly where a slow job spends it.
+An optional hook receives the counters of every frame as they are produced.
+
+When profiling is disabled the pipeline uses :data:`NULL_PROFILER`, whose
+methods do nothing and whose :meth:`NullProfiler.stage` returns one shared
+no-op context manager, so the instrumentation costs a method call per
+sampled frame at most.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+_perf = time.perf_counter
+
+
+class _Stage:
+    """Context manager timing one stage; pauses the enclosing stage while active."""
+
+    __slots__ = ('profiler', 'name')
+
+    def __init__(self, profiler: 'Profiler', name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.profiler._push(self.name)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.profiler._pop()
+
+
+class Profiler:
+    """Accumulate exclusive time per stage and per-frame counters.
+
+    Args:
+        hook: Optional callable receiving a dictionary with the counters of
+            every processed frame (``time_sec``, ``people``, ``trains``,
+            ``active_tracks``).
+    """
+
+    enabled = True
+
+    def __init__(self, hook: Optional[Callable[[dict], None]] = None) -> None:
+        self.hook = hook
+        self.totals: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.frames = 0
+        self.detections = {'person': 0, 'train': 0}
+        self.active_tracks_sum = 0
+        self.active_tracks_max = 0
+        self.extra: Dict[str, object] = {}
+        self._stack: List[List] = []  # [name, start of the current slice]
+        self._started = _perf()
+
+    # ---- stages ----
+
+    def _push(self, name: str) -> None:
+        now = _perf()
+        if self._stack:
+            parent = self._stack[-1]
+            self.totals[parent[0]] = self.totals.get(parent[0], 0.0) + now - parent[1]
+        self._stack.append([name, now])
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _pop(self) -> None:
+        now = _perf()
+        name, start = self._stack.pop()
+        self.totals[name] = self.totals.get(name, 0.0) + now - start
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def stage(self, name: str) -> _Stage:
+        """Context manager timing the enclosed block as stage ``name``."""
+        return _Stage(self, name)
+
+    def iterate(self, items: Iterable[T], name: str) -> Iterator[T]:
+        """Yield from ``items``, timing each fetch of the next item as stage ``name``."""
+        it = iter(items)
+        while True:
+            self._push(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self._pop()
+            yield item
+
+    # ---- counters ----
+
+    def frame(self, time_sec: float, people: int, trains: int, active_tracks: int) -> None:
+        """Record the counters of one processed frame."""
+        self.frames += 1
+        self.detections['person'] += people
+        self.detections['train'] += trains
+        self.active_tracks_sum += active_tracks
+        if active_tracks > self.active_tracks_max:
+            self.active_tracks_max = active_tracks
+        if self.hook is not None:
+            self.hook({'time_sec': time_sec, 'people': people, 'trains': trains, 'active_tracks': active_tracks})
+
+    def merge(self, summary: dict) -> None:
+        """Add the stage times and counters of another profiler's :meth:`summary`."""
+        for name, st in summary.get('stages', {}).items():
+            self.totals[name] = self.totals.get(name, 0.0) + st['total_sec']
+            self.calls[name] = self.calls.get(name, 0) + st['calls']
+        frames = summary.get('frames', 0)
+        self.frames += frames
+        for kind, n in summary.get('detections', {}).items():
+            self.detections[kind] = self.detections.get(kind, 0) + n
+        self.active_tracks_sum += int(round(summary.get('active_tracks_mean', 0.0) * frames))
+        self.active_tracks_max = max(self.active_tracks_max, summary.get('active_tracks_max', 0))
+
+    # ---- report ----
+
+    def summary(self) -> dict:
+        wall = _perf() - self._started
+        profiled = sum(self.totals.values())
+        stages = {
+            name: {
+                'total_sec': round(total, 6),
+                'calls': self.calls.get(name, 0),
+                'mean_ms': round(total / self.calls[name] * 1000.0, 4) if self.calls.get(name) else 0.0,
+                'share': round(total / profiled, 4) if profiled else 0.0,
+            }
+            for name, total in sorted(self.totals.items(), key=lambda kv: -kv[1])
+        }
+        return {
+            'wall_sec': round(wall, 6),
+            'profiled_sec': round(profiled, 6),
+            'frames': self.frames,
+            'detections': dict(self.detections),
+            'active_tracks_mean': round(self.active_tracks_sum / self.frames, 3) if self.frames else 0.0,
+            'active_tracks_max': self.active_tracks_max,
+            'stages': stages,
+            **self.extra,
+        }
+
+    def write(self, path: str) -> str:
+        """Write :meth:`summary` as JSON and return ``path``."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+class NullProfiler:
+    """Do-nothing stand-in used when profiling is disabled."""
+
+    enabled = False
+    _NULL_CONTEXT = contextlib.nullcontext()
+
+    def stage(self, name: str) -> contextlib.nullcontext:
+        return self._NULL_CONTEXT
+
+    def iterate(self, items: Iterable[T], name: str) -> Iterable[T]:
+        return items
+
+    def frame(self, time_sec: float, people: int, trains: int, active_tracks: int) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,215 @@
+"""
+train_numbers.py
+Association of train numbers with train tracks.
+
+Train numbers come from an external log (a number recognition system or the
+station schedule) as entries with a ``number`` and either a single ``time``
+or a ``start``/``end`` interval.  Times are seconds from the start of the
+video, or wall-clock datetimes (``YYYY-MM-DD HH:MM:SS`` or ISO format) for
+logs covering a whole day.
+
+:class:`TrainNumberIndex` keeps the entries sorted by start time and treats
+the sorted array as an implicit balanced tree whose nodes store the latest
+end in their subtree.  Finding the entries that overlap a train track walks
+only the branches that can contain them instead of the whole log, so
+full-day logs with tens of thousands of entries cost ``O(log n)`` per train
+plus the matches, even when some entries span hours.  The entry overlapping the
+track the longest wins; point entries and ties go to the entry closest to
+the middle of the stop (or of the track if the train did not stop).
+
+:func:`load_train_numbers` reads a log from CSV, JSON or JSON Lines.
+"""
+
+from __future__ import annotations
+
+import csv
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple, Union
+
+from utils.events import DT_FORMAT, iter_events
+
+MATCH_TOLERANCE_SEC = 10.0  # entries this far outside a track still match it
+
+_EPOCH = datetime(1970, 1, 1)
+
+NUMBER_KEYS = ('number', 'номер')
+TIME_KEYS = ('time', 'time_sec', 'datetime', 'dt')
+START_KEYS = ('start', 'start_sec', 'start_dt')
+END_KEYS = ('end', 'end_sec', 'end_dt')
+
+
+def _first(entry: dict, keys: Iterable[str]) -> object:
+    for key in keys:
+        value = entry.get(key)
+        if value is not None and value != '':
+            return value
+    return None
+
+
+def _parse_time(value: object) -> Tuple[float, bool]:
+    """Return ``(seconds, absolute)`` for a number of seconds or a datetime."""
+    if isinstance(value, datetime):
+        return (value - _EPOCH).total_seconds(), True
+    if isinstance(value, (int, float)):
+        return float(value), False
+    text = str(value).strip()
+    try:
+        return float(text), False
+    except ValueError:
+        pass
+    try:
+        # much faster than strptime and also accepts DT_FORMAT
+        dt = datetime.fromisoformat(text)
+    except ValueError:
+        dt = datetime.strptime(text, DT_FORMAT)
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    return (dt - _EPOCH).total_seconds(), True
+
+
+class TrainNumberIndex:
+    """Sorted interval index over a train number log.
+
+    Args:
+        entries: Log entries (see the module docstring).  Entries without a
+            number or a time, or with a time that cannot be parsed, are
+            skipped.
+        tolerance_sec: Entries up to this far before the arrival or after
+            the departure of a train still match it.
+
+    Raises:
+        ValueError: If the log mixes relative seconds and datetimes.
+    """
+
+    def __init__(self, entries: Iterable[dict], tolerance_sec: float = MATCH_TOLERANCE_SEC) -> None:
+        self.tolerance_sec = tolerance_sec
+        rows = []
+        kinds = set()
+        for entry in entries:
+            number = _first(entry, NUMBER_KEYS)
+            point = _first(entry, TIME_KEYS)
+            start = _first(entry, START_KEYS) if point is None else point
+            end = _first(entry, END_KEYS) if point is None else point
+            if number is None or start is None:
+                continue
+            try:
+                start_sec, absolute = _parse_time(start)
+                end_sec, end_absolute = _parse_time(end) if end is not None else (start_sec, absolute)
+            except ValueError:
+                continue
+            kinds.update((absolute, end_absolute))
+            rows.append((start_sec, max(start_sec, end_sec), str(number)))
+        if len(kinds) > 1:
+            raise ValueError('train number log mixes seconds and datetimes')
+        # datetimes are stored as seconds since the epoch
+        self.absolute = kinds == {True}
+        rows.sort()
+        self.starts = [r[0] for r in rows]
+        self.ends = [r[1] for r in rows]
+        self.numbers = [r[2] for r in rows]
+        # latest end in the implicit subtree rooted at each index, see _build
+        self._max_end = [0.0] * len(rows)
+        self._build(0, len(rows))
+
+    def _build(self, lo: int, hi: int) -> float:
+        """Fill :attr:`_max_end` for the subtree over ``[lo, hi)`` rooted at its middle."""
+        if lo >= hi:
+            return float('-inf')
+        mid = (lo + hi) // 2
+        self._max_end[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self._max_end[mid]
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def offset_for(self, start_dt: datetime) -> float:
+        """Offset turning video seconds into the time base of the log."""
+        return (start_dt - _EPOCH).total_seconds() if self.absolute else 0.0
+
+    def overlapping(self, start_sec: float, end_sec: float) -> List[int]:
+        """Indices of the entries overlapping ``[start_sec, end_sec]`` (in log time), in order."""
+        found: List[int] = []
+        stack = [(0, len(self.starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            # nothing in this subtree ends late enough
+            if self._max_end[mid] < start_sec:
+                continue
+            stack.append((lo, mid))
+            # entries from mid on start too late
+            if self.starts[mid] > end_sec:
+                continue
+            if self.ends[mid] >= start_sec:
+                found.append(mid)
+            stack.append((mid + 1, hi))
+        found.sort()
+        return found
+
+    def match(
+        self,
+        arrival_sec: float,
+        departure_sec: float,
+        stop_sec: Optional[Tuple[float, float]] = None,
+        offset_sec: float = 0.0,
+    ) -> Optional[str]:
+        """
+        Number of the train seen from ``arrival_sec`` to ``departure_sec``.
+
+        Args:
+            arrival_sec: First observation of the track, in video seconds.
+            departure_sec: Last observation of the track, in video seconds.
+            stop_sec: Optional ``(start, end)`` of the stop, used to break
+                ties between candidates.
+            offset_sec: Added to video seconds to get log time, see
+                :meth:`offset_for`.
+
+        Returns:
+            The matched number, or ``None`` if no entry overlaps the track.
+        """
+        start = arrival_sec + offset_sec - self.tolerance_sec
+        end = departure_sec + offset_sec + self.tolerance_sec
+        candidates = self.overlapping(start, end)
+        if not candidates:
+            return None
+        ref_start, ref_end = stop_sec if stop_sec is not None else (arrival_sec, departure_sec)
+        ref = (ref_start + ref_end) / 2 + offset_sec
+        track_start, track_end = arrival_sec + offset_sec, departure_sec + offset_sec
+
+        def score(i: int) -> Tuple[float, float]:
+            overlap = min(self.ends[i], track_end) - max(self.starts[i], track_start)
+            centre = (self.starts[i] + self.ends[i]) / 2
+            return -max(overlap, 0.0), abs(centre - ref)
+
+        return self.numbers[min(candidates, key=score)]
+
+
+def as_train_number_index(
+    numbers: Union[None, 'TrainNumberIndex', Iterable[dict]],
+) -> Optional[TrainNumberIndex]:
+    """Return ``numbers`` as an index; ``None`` or an empty log gives ``None``."""
+    if numbers is None or isinstance(numbers, TrainNumberIndex):
+        return numbers or None
+    index = TrainNumberIndex(numbers)
+    return index if len(index) else None
+
+
+def load_train_numbers(path: str) -> List[dict]:
+    """
+    Read a train number log.
+
+    ``.csv`` files need a header row naming the columns (``number`` and
+    ``time``, or ``start`` and ``end``); ``.json``, ``.jsonl`` and
+    ``.jsonl.gz`` files hold one object per entry.  Build a
+    :class:`TrainNumberIndex` once from the result and pass it to every
+    :func:`utils.pipeline.run_pipeline` call of the day.
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            return [
+                {key.strip(): value.strip() for key, value in row.items() if key is not None and value is not None}
+                for row in csv.DictReader(f)
+            ]
+    return list(iter_events(path))
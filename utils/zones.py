@@ -0,0 +1,91 @@
+"""
+zones.py
+Zone lookup for person detections.
+
+Zones are named polygons of a camera view (platform edge, track, service
+area).  Testing every detection against every polygon per frame is slow in
+Python, so :class:`ZoneMap` rasterises the polygons once into a small label
+image at inference resolution: each pixel holds the index of the zone
+covering it.  Finding the zone of a person is then a single array index at
+its foot point (bottom centre of the box), done for all people of a frame at
+once.
+
+Maps are cached per camera configuration and frame size with
+:func:`get_zone_map`, so a run builds its map once.
+"""
+
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+ZONE_MAP_SIZE = 640  # longer side of the label map, in pixels
+
+Polygon = List[Tuple[float, float]]
+
+
+class ZoneMap:
+    """Label image mapping frame coordinates to zone names.
+
+    Args:
+        zones: Zone name to polygon in full-frame pixels.  Where polygons
+            overlap, the zone listed later wins.
+        width: Frame width in pixels.
+        height: Frame height in pixels.
+        map_size: Longer side of the label image.
+    """
+
+    def __init__(self, zones: Dict[str, Polygon], width: int, height: int, map_size: int = ZONE_MAP_SIZE) -> None:
+        self.names: List[Optional[str]] = [None] + list(zones)
+        self.scale = min(1.0, map_size / max(width, height, 1))
+        self.width = max(1, int(round(width * self.scale)))
+        self.height = max(1, int(round(height * self.scale)))
+        if len(self.names) > 256:
+            raise ValueError('at most 255 zones per camera are supported')
+        self.labels = np.zeros((self.height, self.width), dtype=np.uint8)
+        for label, polygon in enumerate(zones.values(), start=1):
+            pts = np.round(np.asarray(polygon, dtype=np.float64) * self.scale).astype(np.int32)
+            cv2.fillPoly(self.labels, [pts], label)
+        self._names = np.asarray(self.names, dtype=object)
+
+    def lookup(self, points: np.ndarray) -> List[Optional[str]]:
+        """Zone name of each ``(x, y)`` point in full-frame pixels (``None`` outside all zones)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            return []
+        xs = np.clip((points[:, 0] * self.scale).astype(np.int64), 0, self.width - 1)
+        ys = np.clip((points[:, 1] * self.scale).astype(np.int64), 0, self.height - 1)
+        return self._names[self.labels[ys, xs]].tolist()
+
+    def lookup_boxes(self, boxes: Sequence[Tuple[float, float, float, float]]) -> List[Optional[str]]:
+        """Zone of the foot point of each ``(x, y, w, h)`` box."""
+        if not len(boxes):
+            return []
+        b = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        # the foot point sits on the ground plane the zones are drawn on
+        feet = np.stack([b[:, 0] + b[:, 2] / 2, b[:, 1] + b[:, 3]], axis=1)
+        return self.lookup(feet)
+
+
+@lru_cache(maxsize=32)
+def _cached_zone_map(zones_json: str, width: int, height: int, map_size: int) -> ZoneMap:
+    return ZoneMap(dict(json.loads(zones_json)), width, height, map_size)
+
+
+def get_zone_map(
+    zones: Dict[str, Polygon], width: int, height: int, map_size: int = ZONE_MAP_SIZE,
+) -> Optional[ZoneMap]:
+    """Return the cached :class:`ZoneMap` of ``zones`` for a frame size, or ``None`` without zones."""
+    if not zones:
+        return None
+    # a list of pairs keeps the zone order, which decides overlaps
+    key = json.dumps([[name, [list(p) for p in poly]] for name, poly in zones.items()])
+    return _cached_zone_map(key, int(width), int(height), int(map_size))